@@ -0,0 +1,15 @@
+-- In-memory dictionary over moi.entities for dictGet lookups instead of joins
+-- entities_dict: id -> name, type
+-- The API reloads it after entity writes; LIFETIME covers writes made elsewhere.
+-- The source must authenticate as the API's ClickHouse user (CLICKHOUSE_USERNAME /
+-- CLICKHOUSE_PASSWORD); `python backend/migrations/entity_dictionaries.py` creates it
+-- from the configured credentials and drops the retired entity_ids_by_name.
+CREATE DICTIONARY IF NOT EXISTS moi.entities_dict (
+    id String,
+    name String,
+    type String
+)
+PRIMARY KEY id
+SOURCE(CLICKHOUSE(DB 'moi' TABLE 'entities' USER 'moi' PASSWORD 'password123'))
+LAYOUT(COMPLEX_KEY_HASHED())
+LIFETIME(MIN 60 MAX 300);
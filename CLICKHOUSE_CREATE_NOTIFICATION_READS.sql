@@ -0,0 +1,12 @@
+-- Append-only read state for notifications
+-- Marking read/unread inserts a marker row instead of mutating moi.notifications.
+-- notification_id = '' is the per-user "read all up to read_until" watermark.
+CREATE TABLE IF NOT EXISTS moi.notification_reads (
+    user_id UInt64 NOT NULL,
+    notification_id String NOT NULL,
+    read UInt8 DEFAULT 1,
+    read_at DateTime DEFAULT now(),
+    read_until DateTime DEFAULT toDateTime(0),
+    version UInt64 NOT NULL
+) ENGINE = ReplacingMergeTree(version)
+ORDER BY (user_id, notification_id);
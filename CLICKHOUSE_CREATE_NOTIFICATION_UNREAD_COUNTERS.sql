@@ -0,0 +1,7 @@
+-- Per-user unread notification counters stored as +N/-N deltas
+-- sum(delta) per user_id is the unread count; background merges collapse the rows.
+CREATE TABLE IF NOT EXISTS moi.notification_unread_counters (
+    user_id UInt64 NOT NULL,
+    delta Int64 NOT NULL
+) ENGINE = SummingMergeTree(delta)
+ORDER BY (user_id);
@@ -0,0 +1,9 @@
+-- Template usage stored as append-only +N increments
+-- sum(uses) per template_id is the usage since tracking began; it is added to
+-- correspondence_templates.usage_count at read time, so no ALTER UPDATE is needed.
+CREATE TABLE IF NOT EXISTS moi.template_usage (
+    template_id String NOT NULL,
+    uses UInt64 NOT NULL,
+    used_at DateTime DEFAULT now()
+) ENGINE = SummingMergeTree(uses)
+ORDER BY (template_id);
@@ -0,0 +1,35 @@
+-- Versioned comments: edits and deletes are appended as new versions
+-- Every row with the same (correspondence_id, id) is a version of one comment;
+-- the highest version wins and is_deleted = 1 marks a tombstone.
+-- Only needed for installs created before CLICKHOUSE_SETUP.sql defined the
+-- versioned table.
+CREATE TABLE IF NOT EXISTS moi.correspondence_comments_versioned (
+    id String DEFAULT generateUUIDv4(),
+    correspondence_id String NOT NULL,
+    user_id Nullable(UInt64),
+    comment String NOT NULL,
+    is_internal UInt8 DEFAULT 1,
+    parent_comment_id Nullable(String),
+    mentioned_users Array(UInt64) DEFAULT [],
+    attachments Array(String) DEFAULT [],
+    is_edited UInt8 DEFAULT 0,
+    created_at DateTime DEFAULT now(),
+    updated_at DateTime DEFAULT now(),
+    version UInt64 DEFAULT toUnixTimestamp64Nano(now64(9)),
+    is_deleted UInt8 DEFAULT 0,
+    INDEX idx_comment_id id TYPE bloom_filter GRANULARITY 4
+) ENGINE = ReplacingMergeTree(version)
+ORDER BY (correspondence_id, id);
+
+-- Copy existing comments as version 1 of each
+INSERT INTO moi.correspondence_comments_versioned
+SELECT
+    id, correspondence_id, user_id, comment, is_internal, parent_comment_id,
+    mentioned_users, attachments, is_edited, created_at, updated_at,
+    toUInt64(toUnixTimestamp(updated_at)) * 1000000000 AS version,
+    0 AS is_deleted
+FROM moi.correspondence_comments;
+
+-- Swap; the old table is kept as correspondence_comments_legacy
+RENAME TABLE moi.correspondence_comments TO moi.correspondence_comments_legacy,
+             moi.correspondence_comments_versioned TO moi.correspondence_comments;
@@ -40,7 +40,8 @@ CREATE TABLE IF NOT EXISTS moi.sessions (
     expires_at DateTime NOT NULL,
     created_at DateTime DEFAULT now()
 ) ENGINE = MergeTree()
-ORDER BY (expires_at, user_id);
+PARTITION BY toYYYYMMDD(expires_at)
+ORDER BY token;
 
 -- Create Correspondences Table
 CREATE TABLE IF NOT EXISTS moi.correspondences (
@@ -50,7 +51,9 @@ CREATE TABLE IF NOT EXISTS moi.correspondences (
     subject String NOT NULL,
     content String NOT NULL,
     from_entity String NOT NULL,
+    from_entity_id LowCardinality(String) DEFAULT '',
     received_by_entity Nullable(String),
+    received_by_entity_id LowCardinality(String) DEFAULT '',
     date DateTime DEFAULT now(),
     received_at Nullable(DateTime),
     received_by Nullable(UInt64),
@@ -71,6 +74,8 @@ CREATE TABLE IF NOT EXISTS moi.correspondences (
 ORDER BY (date, id);
 
 -- Create Correspondence Comments Table
+-- Edits and deletes are appended as new versions; the highest version of
+-- (correspondence_id, id) wins and is_deleted = 1 marks a tombstone
 CREATE TABLE IF NOT EXISTS moi.correspondence_comments (
     id String DEFAULT generateUUIDv4(),
     correspondence_id String NOT NULL,
@@ -82,9 +87,12 @@ CREATE TABLE IF NOT EXISTS moi.correspondence_comments (
     attachments Array(String) DEFAULT [],
     is_edited UInt8 DEFAULT 0,
     created_at DateTime DEFAULT now(),
-    updated_at DateTime DEFAULT now()
-) ENGINE = MergeTree()
-ORDER BY (correspondence_id, created_at);
+    updated_at DateTime DEFAULT now(),
+    version UInt64 DEFAULT toUnixTimestamp64Nano(now64(9)),
+    is_deleted UInt8 DEFAULT 0,
+    INDEX idx_comment_id id TYPE bloom_filter GRANULARITY 4
+) ENGINE = ReplacingMergeTree(version)
+ORDER BY (correspondence_id, id);
 
 -- Create Notifications Table
 CREATE TABLE IF NOT EXISTS moi.notifications (
@@ -102,7 +110,9 @@ CREATE TABLE IF NOT EXISTS moi.notifications (
     read_at Nullable(DateTime),
     created_at DateTime DEFAULT now()
 ) ENGINE = MergeTree()
-ORDER BY (user_id, created_at);
+PARTITION BY toYYYYMM(created_at)
+ORDER BY (user_id, created_at)
+TTL created_at + INTERVAL 365 DAY DELETE;  -- NOTIFICATION_RETENTION_DAYS
 
 -- Create Correspondence Templates Table
 CREATE TABLE IF NOT EXISTS moi.correspondence_templates (
@@ -159,7 +169,10 @@ CREATE TABLE IF NOT EXISTS moi.sync_log (
     error_message Nullable(String),
     created_at DateTime DEFAULT now()
 ) ENGINE = MergeTree()
-ORDER BY (created_at);
+PARTITION BY toYYYYMM(created_at)
+ORDER BY (created_at)
+TTL created_at + INTERVAL 180 DAY DELETE  -- SYNC_LOG_RETENTION_DAYS
+SETTINGS ttl_only_drop_parts = 1;
 
 -- Create Audit Log Table
 CREATE TABLE IF NOT EXISTS moi.audit_log (
@@ -175,7 +188,10 @@ CREATE TABLE IF NOT EXISTS moi.audit_log (
     user_agent Nullable(String),
     created_at DateTime DEFAULT now()
 ) ENGINE = MergeTree()
-ORDER BY (created_at, id);
+PARTITION BY toYYYYMM(created_at)
+ORDER BY (created_at, id)
+TTL created_at + INTERVAL 1095 DAY DELETE  -- AUDIT_RETENTION_DAYS
+SETTINGS ttl_only_drop_parts = 1;
 
 -- Create Rate Limits Table
 CREATE TABLE IF NOT EXISTS moi.rate_limits (
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Tuple
+from database import get_client
+from config import settings
+import sessions
+
+# flock marks a worker's spool as alive; without it (Windows) a worker only
+# recovers its own leftovers
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+AUDIT_COLUMNS = [
+    "id", "user_id", "action", "entity_type", "entity_id", "old_data",
+    "new_data", "description", "ip_address", "user_agent", "created_at"
+]
+
+# Values that must never reach the audit trail; a change is still recorded
+REDACTED_FIELDS = {"password", "password_hash", "signature_base64"}
+
+SPOOL_DIR = Path(settings.AUDIT_SPOOL_DIR)
+
+# Every record is appended to this worker's spool file before it is queued,
+# so a crash loses nothing: the file is rotated into a segment on each flush
+# and a segment is deleted only after its INSERT succeeded. Leftover segments
+# (failed flushes, crashed workers) are retried on the next flush.
+_pending: List[list] = []
+_spilled = False  # the queue was full: some rows exist only in the spool
+_lock = Lock()
+_flush_lock = Lock()  # the flusher thread and shutdown must not write a segment twice
+_flush_requested: Optional[asyncio.Event] = None
+_spool = None
+_lock_file = None
+
+_stats = {
+    "recorded": 0,
+    "written": 0,
+    "spilled": 0,
+    "failed_flushes": 0,
+    "last_flush_at": None,
+    "last_flush_rows": 0,
+    "last_error": None,
+}
+
+def _comparable(value):
+    return int(value) if isinstance(value, bool) else value
+
+def _redact(data: Optional[dict]) -> Optional[dict]:
+    if data is None:
+        return None
+    return {key: "***" if key in REDACTED_FIELDS else value for key, value in data.items()}
+
+def diff(old: Optional[dict], new: Optional[dict]) -> Tuple[Optional[dict], Optional[dict]]:
+    """Only the fields whose value changed, as ({field: old}, {field: new})"""
+    if old is None or new is None:
+        return _redact(old), _redact(new)
+    changed = [key for key, value in new.items() if _comparable(old.get(key)) != _comparable(value)]
+    return _redact({key: old.get(key) for key in changed}), _redact({key: new[key] for key in changed})
+
+def _current_path() -> Path:
+    return SPOOL_DIR / f"{os.getpid()}-current.jsonl"
+
+def _get_spool():
+    global _spool, _lock_file
+    if _spool is None:
+        SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        if fcntl is not None and _lock_file is None:
+            _lock_file = open(SPOOL_DIR / f"{os.getpid()}.lock", "w")
+            fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        _spool = open(_current_path(), "a", encoding="utf-8")
+    return _spool
+
+def record(
+    action: str,
+    entity_type: str,
+    entity_id,
+    old: Optional[dict] = None,
+    new: Optional[dict] = None,
+    user_id: Optional[int] = None,
+    description: Optional[str] = None,
+    request=None
+) -> bool:
+    """Queue an audit entry; the INSERT happens in the background flusher.
+
+    For updates only changed fields are kept, and an update that changed
+    nothing is not recorded. `request` supplies the IP, user agent and
+    (when the session is known) the acting user.
+    """
+    old_data, new_data = diff(old, new)
+    if old is not None and new is not None and not new_data:
+        return False
+
+    ip_address = user_agent = None
+    if request is not None:
+        ip_address = request.client.host if request.client else None
+        user_agent = request.headers.get("user-agent")
+        if user_id is None:
+            user_id = sessions.cached_user_id(request.headers.get("x-session-token"))
+
+    row = [
+        str(uuid.uuid4()),
+        user_id,
+        action,
+        entity_type,
+        str(entity_id),
+        json.dumps(old_data, ensure_ascii=False, default=str) if old_data is not None else None,
+        json.dumps(new_data, ensure_ascii=False, default=str) if new_data is not None else None,
+        description,
+        ip_address,
+        user_agent,
+        datetime.utcnow().replace(microsecond=0)
+    ]
+    line = json.dumps(row, ensure_ascii=False, default=str) + "\n"
+
+    global _spilled
+    try:
+        with _lock:
+            spool = _get_spool()
+            spool.write(line)
+            spool.flush()
+            if settings.AUDIT_SPOOL_FSYNC:
+                os.fsync(spool.fileno())
+            if len(_pending) < settings.AUDIT_QUEUE_SIZE:
+                _pending.append(row)
+            else:
+                _spilled = True
+                _stats["spilled"] += 1
+            _stats["recorded"] += 1
+            full = len(_pending) >= settings.AUDIT_BATCH_SIZE
+    except OSError as e:
+        # Auditing must not fail the change it describes
+        print(f"Audit spool error: {e}")
+        return False
+
+    if full and _flush_requested is not None:
+        _flush_requested.set()
+    return True
+
+def _rotate() -> Tuple[Optional[Path], List[list], bool]:
+    """Close the current spool file as a segment and take the queued rows"""
+    global _pending, _spilled, _spool
+    with _lock:
+        rows, spilled = _pending, _spilled
+        _pending, _spilled = [], False
+        if _spool is None or _spool.tell() == 0:
+            return None, rows, spilled
+        _spool.close()
+        _spool = None
+        segment = SPOOL_DIR / f"{os.getpid()}-{time.time_ns()}.jsonl"
+        os.replace(_current_path(), segment)
+    return segment, rows, spilled
+
+def _read_segment(path: Path) -> List[list]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Torn last line of a crashed worker
+                continue
+            row[-1] = datetime.fromisoformat(row[-1])
+            rows.append(row)
+    return rows
+
+def _adopt_orphans():
+    """Take over the spool files of workers that are gone"""
+    if fcntl is None or not SPOOL_DIR.exists():
+        return
+    own_pid = str(os.getpid())
+    for lock_path in SPOOL_DIR.glob("*.lock"):
+        pid = lock_path.stem
+        if pid == own_pid:
+            continue
+        try:
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                for path in SPOOL_DIR.glob(f"{pid}-*.jsonl"):
+                    os.replace(path, SPOOL_DIR / f"{own_pid}-{time.time_ns()}.jsonl")
+                lock_path.unlink()
+        except OSError:
+            # Locked: that worker is still running
+            continue
+
+def flush(client) -> int:
+    """Write all spooled audit rows of this worker, oldest segment first"""
+    with _flush_lock:
+        return _flush(client)
+
+def _flush(client) -> int:
+    segment, rows, spilled = _rotate()
+    _adopt_orphans()
+
+    written = 0
+    try:
+        for path in sorted(SPOOL_DIR.glob(f"{os.getpid()}-[0-9]*.jsonl")):
+            batch = rows if path == segment and not spilled else _read_segment(path)
+            if batch:
+                client.insert("audit_log", batch, column_names=AUDIT_COLUMNS)
+            path.unlink()
+            written += len(batch)
+    except Exception as e:
+        # Unwritten segments stay on disk for the next flush
+        _stats["failed_flushes"] += 1
+        _stats["last_error"] = str(e)
+        raise
+    finally:
+        _stats["written"] += written
+        if written:
+            _stats["last_flush_at"] = datetime.utcnow().replace(microsecond=0)
+            _stats["last_flush_rows"] = written
+    return written
+
+def metrics() -> dict:
+    segments = list(SPOOL_DIR.glob("*.jsonl")) if SPOOL_DIR.exists() else []
+    return {
+        "queue_depth": len(_pending),
+        "queue_capacity": settings.AUDIT_QUEUE_SIZE,
+        "spool_files": len(segments),
+        "spool_bytes": sum(path.stat().st_size for path in segments if path.exists()),
+        **_stats,
+    }
+
+def shutdown():
+    """Final flush; whatever cannot be written stays spooled for the next start"""
+    global _spool
+    try:
+        flush(get_client())
+    except Exception as e:
+        print(f"✗ Failed to flush audit log: {e}")
+    with _lock:
+        if _spool is not None:
+            _spool.close()
+            _spool = None
+
+async def run_flusher():
+    """Background loop bulk-inserting audit rows every AUDIT_FLUSH_SECONDS
+    (or as soon as AUDIT_BATCH_SIZE rows are queued)"""
+    global _flush_requested
+    _flush_requested = asyncio.Event()
+    client = get_client()
+    while True:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), timeout=settings.AUDIT_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+
+        try:
+            await asyncio.to_thread(flush, client)
+        except Exception as e:
+            print(f"Audit log flush error: {e}")
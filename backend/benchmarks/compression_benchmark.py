@@ -0,0 +1,112 @@
+"""Bytes-on-wire and CPU cost of response compression per endpoint.
+
+Usage:
+    python benchmarks/compression_benchmark.py
+    python benchmarks/compression_benchmark.py --base-url http://localhost:3001 --token <session>
+
+Without --base-url, synthetic payloads shaped like the real listing,
+statistics and notifications responses are used.
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compression import available_encodings, compress_bytes
+
+ENDPOINTS = {
+    "correspondences": "/api/correspondences",
+    "statistics.monthly": "/api/statistics/monthly-stats",
+    "statistics.entities": "/api/statistics/entity-stats",
+    "notifications": "/api/notifications",
+}
+
+ENTITIES = ["وزارة الداخلية", "وزارة المالية", "وزارة التخطيط", "ديوان الخدمة المدنية", "الأمانة العامة"]
+
+def synthetic_payloads() -> dict:
+    correspondences = [
+        {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "number": f"2025/{i}",
+            "type": "outgoing" if i % 2 else "incoming",
+            "subject": f"بشأن طلب رقم {i} المتعلق بالموارد البشرية",
+            "content": "نود إحاطتكم علماً بأنه تم استلام طلبكم وجاري العمل عليه. " * 8,
+            "from_entity": ENTITIES[i % len(ENTITIES)],
+            "received_by_entity": ENTITIES[(i + 1) % len(ENTITIES)],
+            "date": "2025-11-01T10:00:00",
+            "greeting": "السيد/",
+            "display_type": "content",
+            "attachments": [],
+            "status": "sent",
+        }
+        for i in range(500)
+    ]
+    monthly = [
+        {
+            "month": f"2025-{m:02d}-01",
+            "type": t,
+            "total_count": m * 13,
+            "from_entity": ENTITIES[m % len(ENTITIES)],
+            "received_by_entity": ENTITIES[(m + 2) % len(ENTITIES)],
+        }
+        for m in range(1, 13) for t in ("incoming", "outgoing")
+    ]
+    notifications = [
+        {
+            "id": f"n-{i}",
+            "user_id": 1,
+            "type": "new_correspondence",
+            "title": "مراسلة جديدة",
+            "message": f"تم استلام مراسلة جديدة من {ENTITIES[i % len(ENTITIES)]}",
+            "priority": "normal",
+            "read": i % 3 == 0,
+            "created_at": "2025-11-01T10:00:00",
+        }
+        for i in range(1000)
+    ]
+    return {
+        "correspondences": json.dumps(correspondences, ensure_ascii=False).encode("utf-8"),
+        "statistics.monthly": json.dumps(monthly, ensure_ascii=False).encode("utf-8"),
+        "notifications": json.dumps(notifications, ensure_ascii=False).encode("utf-8"),
+    }
+
+def fetch_payloads(base_url: str, token: str) -> dict:
+    payloads = {}
+    for name, path in ENDPOINTS.items():
+        request = urllib.request.Request(
+            base_url.rstrip("/") + path,
+            headers={"X-Session-Token": token, "Accept-Encoding": "identity"}
+        )
+        with urllib.request.urlopen(request) as response:
+            payloads[name] = response.read()
+    return payloads
+
+def measure(payload: bytes, encoding: str, rounds: int):
+    start = time.process_time()
+    for _ in range(rounds):
+        compressed = compress_bytes(payload, encoding)
+    cpu_ms = (time.process_time() - start) * 1000 / rounds
+    return len(compressed), cpu_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = fetch_payloads(args.base_url, args.token) if args.base_url else synthetic_payloads()
+
+    print(f"{'endpoint':<22}{'encoding':<10}{'bytes':>12}{'ratio':>8}{'cpu ms':>10}")
+    for name, payload in payloads.items():
+        print(f"{name:<22}{'identity':<10}{len(payload):>12}{1.0:>8.2f}{0.0:>10.2f}")
+        for encoding in available_encodings():
+            size, cpu_ms = measure(payload, encoding, args.rounds)
+            print(f"{'':<22}{encoding:<10}{size:>12}{len(payload) / size:>8.2f}{cpu_ms:>10.2f}")
+
+if __name__ == "__main__":
+    main()
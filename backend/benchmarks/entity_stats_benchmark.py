@@ -0,0 +1,74 @@
+"""Entity statistics query: name joins vs entity-id grouping.
+
+Runs the original /statistics/entity-stats query (entities joined to
+correspondences on name, twice) and the id-based aggregation it was replaced
+with, --rounds times each, and prints the best wall time and rows read.
+
+Run migrations/backfill_correspondence_entity_ids.py first.
+
+Usage:
+    python benchmarks/entity_stats_benchmark.py --rounds 10
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import get_client
+
+NAME_JOIN_SQL = """
+    SELECT 
+        e.id,
+        e.name,
+        e.type,
+        COUNT(DISTINCT c_sent.id) as sent_count,
+        COUNT(DISTINCT c_received.id) as received_count,
+        COUNT(DISTINCT c_sent.id) + COUNT(DISTINCT c_received.id) as total_correspondences
+    FROM entities e
+    LEFT JOIN correspondences c_sent ON e.name = c_sent.from_entity
+    LEFT JOIN correspondences c_received ON e.name = c_received.received_by_entity
+    GROUP BY e.id, e.name, e.type
+    ORDER BY total_correspondences DESC
+"""
+
+ENTITY_ID_SQL = """
+    SELECT entity_id, countIf(direction = 'sent'), countIf(direction = 'received')
+    FROM (
+        SELECT from_entity_id AS entity_id, 'sent' AS direction
+        FROM correspondences
+        WHERE from_entity_id != ''
+        UNION ALL
+        SELECT received_by_entity_id AS entity_id, 'received' AS direction
+        FROM correspondences
+        WHERE received_by_entity_id != ''
+    )
+    GROUP BY entity_id
+"""
+
+def measure(client, sql: str, rounds: int):
+    timings = []
+    rows_read = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = client.query(sql)
+        timings.append(time.perf_counter() - start)
+        rows_read = int(result.summary.get("read_rows", 0)) if result.summary else 0
+    return min(timings), rows_read
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    client = get_client()
+    total = client.query("SELECT count() FROM correspondences").result_rows[0][0]
+    print(f"correspondences: {total}")
+
+    for label, sql in (("name joins", NAME_JOIN_SQL), ("entity ids", ENTITY_ID_SQL)):
+        best, rows_read = measure(client, sql, args.rounds)
+        print(f"{label:<12} best {best * 1000:8.1f} ms   rows read {rows_read}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Local stand-in for an external correspondence system.
+
+Implements the endpoints the sync engine calls (/auth/login and
+PUT /user/correspondence/export|receive|return) with configurable latency,
+token lifetime and failure rates, and reports logins, request counts and
+the peak number of concurrent requests, so connection pooling, token
+caching, retries and per-connection concurrency limits can be checked
+without a real system.
+
+Usage:
+    python benchmarks/external_sync_stub.py --port 8765 --latency 0.2 --fail-rate 0.1
+
+Then point an external_connections row at it and queue jobs:
+    INSERT INTO moi.external_connections (id, name, base_url, username, password_encrypted)
+    VALUES ('stub', 'Stub', 'http://127.0.0.1:8765', 'user', 'secret');
+
+    curl -X POST http://localhost:3001/api/external-sync/jobs \\
+      -H "X-Session-Token: <token>" -H "Content-Type: application/json" \\
+      -d '{"connectionId": "stub", "action": "export", "correspondenceIds": ["..."]}'
+
+The peak concurrency reported should never exceed SYNC_CONNECTION_CONCURRENCY
+and logins should stay at one per token lifetime.
+"""
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.logins = 0
+        self.requests = 0
+        self.statuses = {}
+        self.active = 0
+        self.peak_active = 0
+
+    def count(self, status: int):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self) -> str:
+        with self.lock:
+            return (
+                f"logins={self.logins} requests={self.requests} peak_concurrency={self.peak_active} "
+                f"statuses={dict(sorted(self.statuses.items()))}"
+            )
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+            state.count(status)
+
+        def read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def do_POST(self):
+            body = self.read_body()
+            if self.path != "/auth/login":
+                self.reply(404, {"error": "not found"})
+                return
+            credentials = json.loads(body or b"{}")
+            if not credentials.get("userName") or not credentials.get("userPassword"):
+                self.reply(401, {"error": "invalid credentials"})
+                return
+            token = secrets.token_hex(16)
+            with state.lock:
+                state.tokens[token] = time.time() + state.args.token_ttl
+                state.logins += 1
+            self.reply(200, {"token": token, "expiresIn": state.args.token_ttl})
+
+        def do_PUT(self):
+            self.read_body()
+            action = self.path.rsplit("/", 1)[-1]
+            if not self.path.startswith("/user/correspondence/") or action not in ("export", "receive", "return"):
+                self.reply(404, {"error": "not found"})
+                return
+
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+            with state.lock:
+                expires_at = state.tokens.get(token, 0)
+            if expires_at < time.time():
+                self.reply(401, {"error": "token expired"})
+                return
+
+            with state.lock:
+                state.requests += 1
+                state.active += 1
+                state.peak_active = max(state.peak_active, state.active)
+            try:
+                time.sleep(state.args.latency * random.uniform(0.5, 1.5))
+                roll = random.random()
+                if roll < state.args.fail_rate:
+                    self.reply(503, {"error": "temporarily unavailable"})
+                elif roll < state.args.fail_rate + state.args.throttle_rate:
+                    self.reply(429, {"error": "slow down"}, {"Retry-After": "1"})
+                elif action == "export":
+                    self.reply(200, {"docId": str(uuid.uuid4())})
+                else:
+                    self.reply(200, {"status": "ok"})
+            finally:
+                with state.lock:
+                    state.active -= 1
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub external system for the sync engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean seconds per request")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="Token lifetime in seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument("--report-every", type=float, default=5.0)
+    args = parser.parse_args()
+
+    state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Stub external system on http://{args.host}:{args.port}")
+
+    try:
+        while True:
+            time.sleep(args.report_every)
+            print(state.summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(state.summary())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Notification fan-out cost for large recipient lists.
+
+Measures recipient resolution + row building for a correspondence addressed
+to an entity with --recipients users, and optionally the single batched
+INSERT into a scratch copy of the notifications table (--insert).
+
+Usage:
+    python benchmarks/fanout_benchmark.py --recipients 10000
+    python benchmarks/fanout_benchmark.py --recipients 10000 --insert
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from notification_fanout import NOTIFICATION_COLUMNS, build_rows
+
+def synthetic_directory(recipients: int) -> dict:
+    user_ids = list(range(1, recipients + 1))
+    return {
+        "by_entity_id": {"bench-entity": user_ids},
+        "by_entity_name": {"وزارة الداخلية": user_ids},
+        "user_ids": set(user_ids)
+    }
+
+def synthetic_job() -> dict:
+    return {
+        "type": "new_correspondence",
+        "title": "مراسلة جديدة",
+        "message": "بشأن طلب رقم 1 - وزارة المالية",
+        "entity": "وزارة الداخلية",
+        "user_ids": [],
+        "exclude_user_id": 1,
+        "correspondence_id": "bench",
+        "related_entity_type": "correspondence",
+        "related_entity_id": "bench",
+        "priority": "normal",
+        "action_url": "/correspondence/bench",
+        "created_at": datetime.utcnow().replace(microsecond=0)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--insert", action="store_true", help="also time the INSERT into notifications_fanout_bench")
+    args = parser.parse_args()
+
+    directory = synthetic_directory(args.recipients)
+    job = synthetic_job()
+
+    timings = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        rows = build_rows([job], directory)
+        timings.append(time.perf_counter() - start)
+    print(f"recipients:          {len(rows)}")
+    print(f"build rows (best):   {min(timings) * 1000:.1f} ms")
+
+    if args.insert:
+        from database import get_client
+        client = get_client()
+        client.command("CREATE TABLE IF NOT EXISTS notifications_fanout_bench AS notifications")
+        try:
+            timings = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                client.insert("notifications_fanout_bench", rows, column_names=NOTIFICATION_COLUMNS)
+                timings.append(time.perf_counter() - start)
+            print(f"batched INSERT (best): {min(timings) * 1000:.1f} ms ({len(rows) / min(timings):.0f} rows/s)")
+        finally:
+            client.command("DROP TABLE IF EXISTS notifications_fanout_bench")
+
+if __name__ == "__main__":
+    main()
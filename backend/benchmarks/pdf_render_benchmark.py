@@ -0,0 +1,75 @@
+"""Correspondence PDF rendering throughput (pages per second per core).
+
+Renders --letters synthetic Arabic correspondences of --paragraphs each
+through a process pool of --workers processes, the same way the API does,
+and reports pages/s overall and per worker.
+
+Usage:
+    python benchmarks/pdf_render_benchmark.py --font fonts/Amiri-Regular.ttf
+    python benchmarks/pdf_render_benchmark.py --font fonts/Amiri-Regular.ttf --workers 4 --letters 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf_renderer import render_correspondence
+
+PARAGRAPH = (
+    "نود إحاطتكم علماً بأنه تم استلام الطلب رقم 1234 بتاريخ اليوم، وسيتم دراسته "
+    "من قبل الجهات المختصة وإفادتكم بالنتيجة في أقرب وقت ممكن، مع خالص التقدير والاحترام."
+)
+
+def synthetic_letter(index: int, paragraphs: int) -> dict:
+    return {
+        "id": f"bench-{index}",
+        "number": f"{index}/2026",
+        "type": "outgoing",
+        "subject": "طلب معلومات بخصوص المشروع",
+        "content": "\n".join([PARAGRAPH] * paragraphs),
+        "from_entity": "وزارة المالية",
+        "date": datetime(2026, 1, 1),
+        "greeting": "السيد/ مدير عام الشؤون الإدارية المحترم",
+        "responsible_person": "مدير مكتب المكاتب",
+        "display_type": "content",
+        "attachments": [f"/uploads/attachments/file-{n}.pdf" for n in range(3)],
+        "updated_at": datetime(2026, 1, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--font", required=True, help="TTF font with Arabic glyphs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--letters", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Warm up: start the processes and register the font in each
+        list(pool.map(render_correspondence,
+                      [synthetic_letter(-n, 1) for n in range(args.workers)],
+                      [os.path.join(out_dir, f"warmup-{n}.pdf") for n in range(args.workers)],
+                      [args.font] * args.workers))
+
+        letters = [synthetic_letter(n, args.paragraphs) for n in range(args.letters)]
+        start = time.perf_counter()
+        pages = sum(pool.map(render_correspondence,
+                             letters,
+                             [os.path.join(out_dir, f"{n}.pdf") for n in range(args.letters)],
+                             [args.font] * args.letters))
+        elapsed = time.perf_counter() - start
+
+    print(f"workers:            {args.workers}")
+    print(f"letters / pages:    {args.letters} / {pages}")
+    print(f"elapsed:            {elapsed:.2f} s")
+    print(f"pages/s:            {pages / elapsed:.1f}")
+    print(f"pages/s per core:   {pages / elapsed / args.workers:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Sustained concurrent SSE connections per worker.
+
+Opens N long-lived connections to /api/notifications/stream and keeps them
+open for --duration seconds, reporting how many stayed connected, how many
+heartbeats/events arrived, and time-to-first-byte percentiles.
+
+Usage:
+    python benchmarks/sse_connections_benchmark.py --token <session> --connections 2000
+
+Run the API with a single worker (uvicorn main:app --workers 1) to get a
+per-worker figure, and raise the file descriptor limit (ulimit -n) first.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlparse
+
+async def hold_connection(host: str, port: int, path: str, token: str, duration: float, stats: dict):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        stats["failed"] += 1
+        return
+
+    writer.write(
+        f"GET {path}?token={token} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+
+    deadline = start + duration
+    first_byte = None
+    try:
+        while time.perf_counter() < deadline:
+            chunk = await asyncio.wait_for(reader.read(4096), timeout=max(deadline - time.perf_counter(), 0.01))
+            if not chunk:
+                stats["dropped"] += 1
+                return
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+                stats["ttfb"].append(first_byte)
+            stats["heartbeats"] += chunk.count(b": heartbeat")
+            stats["events"] += chunk.count(b"event: ")
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+
+    stats["held"] += 1
+
+async def run(args):
+    url = urlparse(args.base_url)
+    stats = {"held": 0, "dropped": 0, "failed": 0, "heartbeats": 0, "events": 0, "ttfb": []}
+    tasks = []
+    for _ in range(args.connections):
+        tasks.append(asyncio.create_task(
+            hold_connection(url.hostname, url.port or 80, "/api/notifications/stream", args.token, args.duration, stats)
+        ))
+        # Ramp up gradually so accept queues are not the bottleneck being measured
+        await asyncio.sleep(1 / args.ramp_rate)
+    await asyncio.gather(*tasks)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:3001")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--ramp-rate", type=float, default=200.0, help="new connections per second")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    ttfb = sorted(stats["ttfb"])
+    print(f"connections requested: {args.connections}")
+    print(f"held for {args.duration:.0f}s:      {stats['held']}")
+    print(f"dropped early:         {stats['dropped']}")
+    print(f"failed to connect:     {stats['failed']}")
+    print(f"events received:       {stats['events']}")
+    print(f"heartbeats received:   {stats['heartbeats']}")
+    if ttfb:
+        print(f"ttfb p50/p99 (ms):     {statistics.median(ttfb) * 1000:.1f} / {ttfb[int(len(ttfb) * 0.99) - 1] * 1000:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import zlib
+from typing import Optional
+from config import settings
+
+# Optional encoders: brotli and zstd are used when installed, gzip always works
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content types worth compressing (JSON, text, CSV exports, SVG)
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "text/",
+    "image/svg+xml",
+)
+
+# Streams that must reach the client unbuffered
+UNBUFFERED_TYPES = ("text/event-stream",)
+
+def available_encodings() -> list:
+    """Encodings this worker can produce, in server preference order"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best encoding accepted by the client (honours q=0)"""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+class _Compressor:
+    """Incremental compressor with a uniform compress/finish interface"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """One-shot compression (used for complete bodies and benchmarks)"""
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli/zstd response compression.
+
+    Works at the ASGI message level so StreamingResponse bodies are
+    compressed chunk by chunk without buffering the whole response.
+    Small single-chunk bodies below the size threshold are sent as-is.
+
+    Every compressible response carries Vary: Accept-Encoding, and its
+    ETag is weak whenever an encoding was negotiated, whether or not the
+    body ends up compressed, so a 304 carries the same validator as its 200.
+    """
+
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = settings.COMPRESSION_MINIMUM_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+
+        # Without an encoding the responder still adds Vary to compressible responses
+        responder = _CompressionResponder(send, choose_encoding(accept_encoding), self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+class _CompressionResponder:
+    def __init__(self, send, encoding: Optional[str], minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _compressible(self) -> bool:
+        content_type = ""
+        for name, value in self.start_message.get("headers", []):
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        if content_type.startswith(UNBUFFERED_TYPES):
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _should_skip(self) -> bool:
+        if self.encoding is None or self.start_message["status"] in (204, 206, 304):
+            return True
+        return not self._compressible()
+
+    def _negotiated_headers(self) -> list:
+        """Start headers with Vary added and, once an encoding is negotiated, a weak ETag.
+
+        An encoded body differs from the identity one, so the two must not
+        share a strong ETag (If-Range would splice ranges of different bytes).
+        """
+        headers = self.start_message.get("headers", [])
+        if not self._compressible():
+            return list(headers)
+
+        weak = self.encoding is not None and self.start_message["status"] in (200, 304)
+        result = []
+        vary = []
+        for name, value in headers:
+            if name == b"vary":
+                vary.append(value)
+                continue
+            if name == b"etag" and weak and not value.startswith(b"W/"):
+                value = b"W/" + value
+            result.append((name, value))
+        if not any(b"accept-encoding" in value.lower() or value.strip() == b"*" for value in vary):
+            vary.append(b"Accept-Encoding")
+        result.append((b"vary", b", ".join(vary)))
+        return result
+
+    def _compressed_headers(self, content_length: Optional[int]) -> list:
+        headers = [(name, value) for name, value in self._negotiated_headers() if name != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return headers
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Hold the start message until the first body chunk decides the strategy
+            self.start_message = message
+            return
+
+        if message_type == "http.response.zerocopysend" and not self.passthrough and self.compressor is None:
+            # Zero-copy file bodies go out untouched
+            self.passthrough = True
+            await self._send({**self.start_message, "headers": self._negotiated_headers()})
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if self._should_skip() or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self._send({**self.start_message, "headers": self._negotiated_headers()})
+                await self._send(message)
+                return
+
+            self.compressor = _Compressor(self.encoding)
+            if not more_body:
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                await self._send({**self.start_message, "headers": self._compressed_headers(len(compressed))})
+                await self._send({"type": "http.response.body", "body": compressed})
+                return
+
+            await self._send({**self.start_message, "headers": self._compressed_headers(None)})
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
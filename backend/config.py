@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import List
 
 class Settings(BaseSettings):
     # ClickHouse Configuration
@@ -15,6 +16,115 @@ class Settings(BaseSettings):
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
     SESSION_EXPIRE_DAYS: int = 30
+    SESSION_CACHE_TTL_SECONDS: int = 60
+    
+    # HTTP Caching (conditional GET)
+    ETAG_TOKEN_TTL_SECONDS: int = 5
+    ETAG_CACHE_CONTROL: str = "private, no-cache"
+    IMMUTABLE_CACHE_MAX_AGE_SECONDS: int = 31536000
+    
+    # Correspondence list badges (batch comment/attachment counts)
+    COUNTS_CACHE_TTL_SECONDS: int = 10
+    COUNTS_BATCH_MAX_IDS: int = 500
+    
+    # Upload serving: "" serves bytes from the API, "x-accel-redirect" (nginx)
+    # or "x-sendfile" (Apache/lighttpd) lets a local reverse proxy send them
+    UPLOADS_ACCEL_MODE: str = ""
+    UPLOADS_ACCEL_PREFIX: str = "/protected-uploads"
+    
+    # Attachment previews (0 workers = one per CPU)
+    PREVIEW_SIZES: List[int] = [160, 480, 1024]
+    PREVIEW_FORMAT: str = "WEBP"
+    PREVIEW_QUALITY: int = 80
+    PREVIEW_WORKERS: int = 2
+    
+    # Correspondence PDFs (the font must contain Arabic glyphs, e.g. Amiri or Noto Naskh)
+    PDF_FONT_PATH: str = "fonts/Amiri-Regular.ttf"
+    PDF_WORKERS: int = 2
+    
+    # Response Compression
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 5
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    
+    # Notifications
+    UNREAD_COUNTER_TTL_SECONDS: int = 10
+    SSE_HEARTBEAT_SECONDS: int = 15
+    SSE_QUEUE_SIZE: int = 100
+    SSE_REPLAY_LIMIT: int = 200
+    FANOUT_QUEUE_SIZE: int = 1000
+    FANOUT_BATCH_SIZE: int = 100
+    FANOUT_FLUSH_INTERVAL_SECONDS: float = 0.5
+    FANOUT_ENQUEUE_TIMEOUT_SECONDS: float = 2.0
+    USER_DIRECTORY_TTL_SECONDS: int = 300
+    # Notifications are kept this long, read or not (read state lives in
+    # notification_reads markers, which a TTL on notifications cannot see)
+    NOTIFICATION_RETENTION_DAYS: int = 365
+    
+    # Entities
+    ENTITY_DIRECTORY_CHECK_SECONDS: int = 10
+    
+    # Templates
+    TEMPLATE_CATALOG_CHECK_SECONDS: int = 30
+    TEMPLATE_BULK_RENDER_MAX_ITEMS: int = 1000
+    TEMPLATE_USAGE_FLUSH_SECONDS: float = 5.0
+    TEMPLATE_USAGE_BUFFER_SIZE: int = 1000
+    TEMPLATE_USAGE_CACHE_TTL_SECONDS: int = 30
+    
+    # Export
+    EXPORT_BATCH_SIZE: int = 200
+    EXPORT_CHUNK_SIZE: int = 1024 * 1024
+    EXPORT_MAX_RANGE_DAYS: int = 366
+    # URLs listed in manifest.json; missing_files_count still counts every one
+    EXPORT_MAX_MISSING_LISTED: int = 1000
+    
+    # Rate limiting (token buckets; a shared SQLite path makes limits per host instead of per worker)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_API_PER_MINUTE: int = 300
+    RATE_LIMIT_API_BURST: int = 100
+    RATE_LIMIT_IP_PER_MINUTE: int = 1200
+    RATE_LIMIT_LOGIN_ATTEMPTS: int = 5
+    RATE_LIMIT_LOGIN_WINDOW_SECONDS: int = 900
+    RATE_LIMIT_LOGIN_BLOCK_SECONDS: int = 1800
+    RATE_LIMIT_SHARED_PATH: str = ""
+    RATE_LIMIT_TRUST_FORWARDED: bool = False
+    
+    # Audit log (queued in memory, spooled to disk, bulk-inserted in the background)
+    AUDIT_SPOOL_DIR: str = "audit_spool"
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_SECONDS: float = 2.0
+    AUDIT_SPOOL_FSYNC: bool = False
+    AUDIT_RETENTION_DAYS: int = 1095  # TTL set by migrations/partition_logs.py (0 = keep forever)
+    
+    # External sync (jobs persisted in a local SQLite queue shared by the workers of a host)
+    SYNC_QUEUE_PATH: str = "sync_jobs.db"
+    SYNC_MAX_CONCURRENCY: int = 16
+    SYNC_CONNECTION_CONCURRENCY: int = 4
+    SYNC_MAX_JOBS_PER_REQUEST: int = 1000
+    SYNC_HTTP_TIMEOUT_SECONDS: float = 60.0
+    SYNC_TOKEN_TTL_SECONDS: int = 86400
+    SYNC_MAX_ATTEMPTS: int = 6
+    SYNC_RETRY_BASE_SECONDS: float = 5.0
+    SYNC_RETRY_MAX_SECONDS: float = 900.0
+    SYNC_JOB_LEASE_SECONDS: int = 300
+    SYNC_JOB_RETENTION_DAYS: int = 30
+    SYNC_POLL_SECONDS: float = 2.0
+    SYNC_LOG_FLUSH_SECONDS: float = 5.0
+    SYNC_LOG_BATCH_SIZE: int = 500
+    SYNC_LOG_RETENTION_DAYS: int = 180  # TTL set by migrations/partition_logs.py (0 = keep forever)
+    
+    # Scheduler (cluster-wide jobs run only in the worker holding the lock file)
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_LOCK_PATH: str = "scheduler.lock"
+    SCHEDULER_TICK_SECONDS: float = 30.0
+    SCHEDULER_SESSION_PURGE_SECONDS: int = 3600
+    SCHEDULER_RECONCILE_SECONDS: int = 3600
+    SCHEDULER_OPTIMIZE_SECONDS: int = 86400
+    SCHEDULER_WARM_CACHES_SECONDS: int = 60
+    # Only Replacing/Summing tables, where a merge collapses rows; others are skipped
+    SCHEDULER_OPTIMIZE_TABLES: List[str] = ["notification_reads", "notification_unread_counters", "template_usage"]
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,111 @@
+import time
+from threading import Lock
+from typing import Optional
+from config import settings
+import http_cache
+
+# In-process directory of all entities. Writes in this worker bump the local
+# version immediately; other workers' writes (including ALTER UPDATE renames,
+# which leave created_at untouched) are caught by probing a content hash of
+# the small entities table at most every ENTITY_DIRECTORY_CHECK_SECONDS.
+_directory: Optional[dict] = None
+_version = None
+_checked_at = 0.0
+_lock = Lock()
+
+DICTIONARIES = ("entities_dict",)
+
+def _probe_version(client):
+    result = client.query(
+        """
+        SELECT count(), groupBitXor(cityHash64(id, name, type))
+        FROM entities
+        """
+    )
+    return tuple(result.result_rows[0]) if result.result_rows else None
+
+def _load(client, version) -> dict:
+    result = client.query(
+        """
+        SELECT id, name, type, created_at
+        FROM entities
+        ORDER BY name ASC
+        """
+    )
+
+    entities = []
+    by_id = {}
+    by_name = {}
+    for row in result.result_rows:
+        if row[0] in by_id:
+            continue
+        entity = {
+            "id": row[0],
+            "name": row[1],
+            "type": row[2],
+            "created_at": row[3]
+        }
+        entities.append(entity)
+        by_id[entity["id"]] = entity
+        by_name.setdefault(entity["name"], entity)
+
+    return {
+        "entities": entities,
+        "by_id": by_id,
+        "by_name": by_name,
+        "etag": http_cache.make_etag("entities", *version) if version else None
+    }
+
+def get_directory(client) -> dict:
+    """Return the directory, reloading it if the entities table changed"""
+    global _directory, _version, _checked_at
+    with _lock:
+        if _directory is not None and time.monotonic() - _checked_at <= settings.ENTITY_DIRECTORY_CHECK_SECONDS:
+            return _directory
+
+    version = _probe_version(client)
+    with _lock:
+        if _directory is not None and version == _version:
+            _checked_at = time.monotonic()
+            return _directory
+
+    directory = _load(client, version)
+    with _lock:
+        _directory = directory
+        _version = version
+        _checked_at = time.monotonic()
+    return directory
+
+def invalidate(client=None):
+    """Drop the directory after an entity write and reload the ClickHouse dictionaries"""
+    global _directory
+    with _lock:
+        _directory = None
+
+    if client is not None:
+        for dictionary in DICTIONARIES:
+            try:
+                client.command(f"SYSTEM RELOAD DICTIONARY {dictionary}")
+            except Exception as e:
+                # The dictionaries refresh on their own LIFETIME anyway
+                print(f"Reload dictionary {dictionary} error: {e}")
+
+def entity_name_sql(id_column: str, fallback_column: str) -> str:
+    """SQL expression resolving an entity id to its current name through entities_dict.
+
+    Falls back to the denormalized name column (e.g. users.entity_name) when
+    the id is missing or unknown; an empty string means neither is set.
+    """
+    return (
+        f"dictGetOrDefault('entities_dict', 'name', tuple(ifNull({id_column}, '')), "
+        f"ifNull({fallback_column}, ''))"
+    )
+
+def list_entities(client) -> list:
+    return get_directory(client)["entities"]
+
+def get_entity(client, entity_id: str) -> Optional[dict]:
+    return get_directory(client)["by_id"].get(entity_id)
+
+def get_entity_by_name(client, name: str) -> Optional[dict]:
+    return get_directory(client)["by_name"].get(name)
@@ -0,0 +1,597 @@
+import asyncio
+import json
+import random
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, List, Optional
+from database import get_client
+from config import settings
+import http_cache
+import zip_export
+
+# Optional dependency: httpx provides the pooled async HTTP clients
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+ACTION_PATHS = {
+    "export": "/user/correspondence/export",
+    "receive": "/user/correspondence/receive",
+    "return": "/user/correspondence/return",
+}
+
+SYNC_LOG_COLUMNS = [
+    "id", "correspondence_id", "connection_id", "operation", "status",
+    "external_doc_id", "request_payload", "response_payload", "error_message",
+    "created_at"
+]
+
+class RetryableError(Exception):
+    """Transient failure (network, 5xx, 429): the job is retried with backoff"""
+
+    def __init__(self, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class PermanentError(Exception):
+    """The external system rejected the request; retrying will not help"""
+
+def available() -> bool:
+    return httpx is not None
+
+def backoff_seconds(attempts: int, retry_after: float = 0) -> float:
+    """Exponential backoff with jitter, never sooner than the server asked"""
+    delay = min(settings.SYNC_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), settings.SYNC_RETRY_MAX_SECONDS)
+    return max(delay * random.uniform(0.5, 1.0), retry_after)
+
+class JobQueue:
+    """Persistent sync jobs in a local SQLite file shared by the workers of a host.
+
+    A claim leases jobs for SYNC_JOB_LEASE_SECONDS; jobs of a worker that
+    died mid-send become claimable again when the lease runs out. Claims
+    never put more than SYNC_CONNECTION_CONCURRENCY jobs of one connection
+    in flight, across all workers.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                connection_id TEXT NOT NULL,
+                correspondence_id TEXT,
+                action TEXT NOT NULL,
+                data TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                locked_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                external_doc_id TEXT,
+                created_by INTEGER,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state_run_at ON jobs (state, run_at)")
+        self._lock = Lock()
+
+    def enqueue_many(self, jobs: List[dict]) -> List[str]:
+        now = time.time()
+        rows = [
+            (
+                str(uuid.uuid4()), job["connection_id"], job.get("correspondence_id"), job["action"],
+                json.dumps(job.get("data") or {}, ensure_ascii=False), "queued", now, job.get("created_by"), now, now
+            )
+            for job in jobs
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                """
+                INSERT INTO jobs (id, connection_id, correspondence_id, action, data, state, run_at, created_by, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            self._conn.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def claim(self, limit: int) -> List[dict]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Rank due jobs within their connection and take each connection's
+                # first jobs up to its free slots, round-robin across connections,
+                # so one connection's backlog cannot hide the jobs of another
+                rows = self._conn.execute(
+                    """
+                    SELECT jobs.*
+                    FROM (
+                        SELECT id, connection_id,
+                               row_number() OVER (PARTITION BY connection_id ORDER BY run_at) AS position
+                        FROM jobs
+                        WHERE (state = 'queued' AND run_at <= ?) OR (state = 'running' AND locked_until < ?)
+                    ) AS due
+                    JOIN jobs ON jobs.id = due.id
+                    LEFT JOIN (
+                        SELECT connection_id, count(*) AS running
+                        FROM jobs
+                        WHERE state = 'running' AND locked_until >= ?
+                        GROUP BY connection_id
+                    ) AS busy ON busy.connection_id = due.connection_id
+                    WHERE due.position <= ? - coalesce(busy.running, 0)
+                    ORDER BY due.position, jobs.run_at
+                    LIMIT ?
+                    """,
+                    (now, now, now, settings.SYNC_CONNECTION_CONCURRENCY, limit)
+                ).fetchall()
+                claimed = [{**dict(row), "data": json.loads(row["data"]), "attempts": row["attempts"] + 1} for row in rows]
+
+                if claimed:
+                    self._conn.executemany(
+                        "UPDATE jobs SET state = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                        [(now + settings.SYNC_JOB_LEASE_SECONDS, now, job["id"]) for job in claimed]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def _finish(self, job_id: str, state: str, run_at: float, error: Optional[str], external_doc_id: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE jobs
+                SET state = ?, run_at = ?, locked_until = 0, last_error = ?,
+                    external_doc_id = coalesce(?, external_doc_id), updated_at = ?
+                WHERE id = ?
+                """,
+                (state, run_at, error, external_doc_id, time.time(), job_id)
+            )
+
+    def complete(self, job_id: str, external_doc_id: Optional[str] = None):
+        self._finish(job_id, "done", time.time(), None, external_doc_id)
+
+    def retry(self, job_id: str, error: str, delay: float):
+        self._finish(job_id, "queued", time.time() + delay, error)
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, "failed", time.time(), error)
+
+    def get_many(self, job_ids: List[str]) -> List[dict]:
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT id, connection_id, correspondence_id, action, state, attempts,
+                       run_at, last_error, external_doc_id, created_at, updated_at
+                FROM jobs WHERE id IN ({placeholders})
+                """,
+                job_ids
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, count(*) FROM jobs GROUP BY state").fetchall())
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - older_than_seconds,)
+            )
+        return cursor.rowcount
+
+class _Connection:
+    """One external system: pooled HTTP client and its cached auth token"""
+
+    def __init__(self, row: dict):
+        self.row = row
+        self.token = row.get("api_token")
+        expires_at = row.get("token_expires_at")
+        self.token_expires_at = expires_at.timestamp() if isinstance(expires_at, datetime) else 0.0
+        self.auth_lock = asyncio.Lock()
+        # Jobs using this client; a replaced connection is closed when the last one ends
+        self.in_flight = 0
+        self.retired = False
+        self.http = httpx.AsyncClient(
+            base_url=row["base_url"].rstrip("/"),
+            timeout=settings.SYNC_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=settings.SYNC_CONNECTION_CONCURRENCY,
+                max_keepalive_connections=settings.SYNC_CONNECTION_CONCURRENCY
+            )
+        )
+
+    def token_valid(self) -> bool:
+        # Refresh a minute early so a token never expires mid-request
+        return bool(self.token) and self.token_expires_at - 60 > time.time()
+
+    async def retire(self):
+        """Close the HTTP client now or, if jobs still use it, once they end"""
+        self.retired = True
+        if self.in_flight == 0:
+            await self.http.aclose()
+
+    async def release(self):
+        self.in_flight -= 1
+        if self.retired and self.in_flight == 0:
+            await self.http.aclose()
+
+_queue: Optional[JobQueue] = None
+_connections: Dict[str, _Connection] = {}
+_db_lock = Lock()  # one ClickHouse session: engine queries must not overlap
+_wakeup: Optional[asyncio.Event] = None
+_running: set = set()
+
+# sync_log rows and external doc ids awaiting the next batched write
+_log_rows: List[list] = []
+_doc_ids: Dict[str, tuple] = {}
+_log_lock = Lock()
+
+_stats = {"logins": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+def _get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(settings.SYNC_QUEUE_PATH)
+    return _queue
+
+async def enqueue(jobs: List[dict]) -> List[str]:
+    """Persist jobs ({connection_id, action, correspondence_id, data, created_by}) and wake the engine"""
+    job_ids = await asyncio.to_thread(_get_queue().enqueue_many, jobs)
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_ids
+
+def get_jobs(job_ids: List[str]) -> List[dict]:
+    return _get_queue().get_many(job_ids)
+
+def _db(fn, *args, **kwargs):
+    with _db_lock:
+        return fn(*args, **kwargs)
+
+def _load_connection_rows(client, connection_ids: List[str]) -> Dict[str, dict]:
+    result = _db(
+        client.query,
+        """
+        SELECT id, name, base_url, username, password_encrypted, api_token, token_expires_at, is_active, updated_at
+        FROM external_connections
+        WHERE id IN %(ids)s
+        """,
+        parameters={"ids": connection_ids}
+    )
+    return {row[0]: dict(zip(result.column_names, row)) for row in result.result_rows}
+
+def _load_correspondences(client, correspondence_ids: List[str]) -> Dict[str, dict]:
+    if not correspondence_ids:
+        return {}
+    result = _db(
+        client.query,
+        """
+        SELECT id, number, date, subject, from_entity, received_by_entity, content, pdf_url
+        FROM correspondences
+        WHERE id IN %(ids)s
+        """,
+        parameters={"ids": correspondence_ids}
+    )
+    return {row[0]: dict(zip(result.column_names, row)) for row in result.result_rows}
+
+async def _connections_for(client, jobs: List[dict]) -> Dict[str, Optional[_Connection]]:
+    """Connection objects for a claimed batch, rebuilt when the row changed"""
+    ids = list({job["connection_id"] for job in jobs})
+    rows = await asyncio.to_thread(_load_connection_rows, client, ids)
+    connections = {}
+    for connection_id in ids:
+        row = rows.get(connection_id)
+        current = _connections.get(connection_id)
+        if row is None or not row["is_active"]:
+            connections[connection_id] = None
+            continue
+        if current is None or current.row["base_url"] != row["base_url"] or current.row["updated_at"] != row["updated_at"]:
+            if current is not None:
+                await current.retire()
+            current = _Connection(row)
+            _connections[connection_id] = current
+        connections[connection_id] = current
+    return connections
+
+async def _get_token(client, connection: _Connection) -> str:
+    if connection.token_valid():
+        return connection.token
+
+    async with connection.auth_lock:
+        # Another job of this connection may have logged in while we waited
+        if connection.token_valid():
+            return connection.token
+
+        try:
+            response = await connection.http.post(
+                "/auth/login",
+                json={"userName": connection.row["username"], "userPassword": connection.row["password_encrypted"]}
+            )
+        except httpx.TransportError as e:
+            raise RetryableError(f"Login failed: {e}")
+        except RuntimeError as e:
+            if connection.http.is_closed:
+                raise RetryableError(f"Login failed: {e}")
+            raise
+        if response.status_code >= 500 or response.status_code == 429:
+            raise RetryableError(f"Login failed: HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise PermanentError(f"Login rejected: HTTP {response.status_code}")
+
+        body = response.json()
+        ttl = body.get("expiresIn") or settings.SYNC_TOKEN_TTL_SECONDS
+        connection.token = body["token"]
+        connection.token_expires_at = time.time() + ttl
+        _stats["logins"] += 1
+
+        # Persist, so other workers (and restarts) reuse the token
+        expires_at = datetime.utcnow().replace(microsecond=0) + timedelta(seconds=ttl)
+        try:
+            await asyncio.to_thread(
+                _db, client.command,
+                """
+                ALTER TABLE external_connections
+                UPDATE api_token = %(token)s, token_expires_at = %(expires_at)s
+                WHERE id = %(id)s
+                """,
+                parameters={"token": connection.token, "expires_at": expires_at, "id": connection.row["id"]}
+            )
+        except Exception as e:
+            print(f"External sync token persist error: {e}")
+        return connection.token
+
+async def _build_request(job: dict, correspondence: Optional[dict]):
+    """(form fields, files, payload to log) for a job"""
+    data = job["data"]
+    if job["action"] == "export":
+        if correspondence is None:
+            raise PermanentError("Correspondence not found")
+        metadata = json.dumps({
+            "number": correspondence["number"],
+            "date": correspondence["date"],
+            "subject": correspondence["subject"],
+            "from_entity": correspondence["from_entity"],
+            "to_entity": correspondence["received_by_entity"],
+            "content": correspondence["content"],
+        }, ensure_ascii=False, default=str)
+        files = None
+        pdf_path = zip_export.local_path(correspondence.get("pdf_url"))
+        if pdf_path is not None:
+            contents = await asyncio.to_thread(pdf_path.read_bytes)
+            files = {"file": (pdf_path.name, contents, "application/pdf")}
+        return {"metadata": metadata}, files, {"metadata": metadata}
+
+    fields = {"docId": data.get("externalDocId"), "messagingHistoryId": data.get("messagingHistoryId")}
+    if job["action"] == "receive":
+        fields.update({
+            "comments": data.get("comments") or "",
+            "receivedByName": data.get("receivedByName"),
+            "receiveByOuName": data.get("receiveByOuName"),
+        })
+    fields = {key: "" if value is None else str(value) for key, value in fields.items()}
+    return fields, None, fields
+
+async def _send(client, connection: _Connection, job: dict, correspondence: Optional[dict]):
+    fields, files, payload = await _build_request(job, correspondence)
+    path = ACTION_PATHS[job["action"]]
+
+    for attempt in (1, 2):
+        token = await _get_token(client, connection)
+        try:
+            response = await connection.http.put(
+                path, data=fields, files=files, headers={"Authorization": f"Bearer {token}"}
+            )
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+        except RuntimeError as e:
+            # The connection row changed and its client was closed under us
+            if connection.http.is_closed:
+                raise RetryableError(f"Client closed: {e}")
+            raise
+        if response.status_code == 401 and attempt == 1:
+            # Token revoked or expired early: log in again once
+            connection.token = None
+            continue
+        break
+
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get("retry-after", "")
+        raise RetryableError(f"HTTP {response.status_code}", float(retry_after) if retry_after.isdigit() else 0)
+    if response.status_code >= 400:
+        raise PermanentError(f"HTTP {response.status_code}: {response.text[:500]}")
+
+    try:
+        result = response.json()
+    except ValueError:
+        result = {}
+    return payload, result
+
+def _log(job: dict, status: str, payload=None, result=None, error: Optional[str] = None, external_doc_id: Optional[str] = None):
+    row = [
+        str(uuid.uuid4()),
+        job.get("correspondence_id"),
+        job["connection_id"],
+        job["action"],
+        status,
+        external_doc_id or job["data"].get("externalDocId"),
+        json.dumps(payload, ensure_ascii=False, default=str) if payload is not None else None,
+        json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+        error,
+        datetime.utcnow().replace(microsecond=0)
+    ]
+    with _log_lock:
+        _log_rows.append(row)
+        if external_doc_id and job["action"] == "export" and job.get("correspondence_id"):
+            _doc_ids[job["correspondence_id"]] = (external_doc_id, job["connection_id"])
+
+def flush_log(client) -> int:
+    """One INSERT into sync_log and one mutation for all new external doc ids"""
+    global _log_rows, _doc_ids
+    with _log_lock:
+        rows, doc_ids = _log_rows, _doc_ids
+        _log_rows, _doc_ids = [], {}
+    if not rows and not doc_ids:
+        return 0
+
+    written = len(rows)
+    try:
+        if rows:
+            _db(client.insert, "sync_log", rows, column_names=SYNC_LOG_COLUMNS)
+            rows = []
+        if doc_ids:
+            ids = list(doc_ids)
+            _db(
+                client.command,
+                """
+                ALTER TABLE correspondences
+                UPDATE external_doc_id = transform(id, %(ids)s, %(doc_ids)s, external_doc_id),
+                       external_connection_id = transform(id, %(ids)s, %(connection_ids)s, external_connection_id),
+                       updated_at = now()
+                WHERE id IN %(ids)s
+                """,
+                parameters={
+                    "ids": ids,
+                    "doc_ids": [doc_ids[i][0] for i in ids],
+                    "connection_ids": [doc_ids[i][1] for i in ids],
+                }
+            )
+            # updated_at moved: list and record ETags must be recomputed
+            from routes.correspondences import LIST_CACHE_KEY, record_cache_key
+            http_cache.invalidate(LIST_CACHE_KEY, *(record_cache_key(i) for i in ids))
+    except Exception:
+        # Put back whatever was not written for the next flush
+        with _log_lock:
+            _log_rows[:0] = rows
+            for correspondence_id, value in doc_ids.items():
+                _doc_ids.setdefault(correspondence_id, value)
+        raise
+    return written
+
+async def _run_job(client, job: dict, connection: Optional[_Connection], correspondence: Optional[dict]):
+    queue = _get_queue()
+    try:
+        if connection is None:
+            raise PermanentError("Connection not found or inactive")
+        payload, result = await _send(client, connection, job, correspondence)
+    except RetryableError as e:
+        if job["attempts"] >= settings.SYNC_MAX_ATTEMPTS:
+            await asyncio.to_thread(queue.fail, job["id"], str(e))
+            _log(job, "failed", error=str(e))
+            _stats["failed"] += 1
+        else:
+            await asyncio.to_thread(queue.retry, job["id"], str(e), backoff_seconds(job["attempts"], e.retry_after))
+            _log(job, "retrying", error=str(e))
+            _stats["retried"] += 1
+    except Exception as e:
+        await asyncio.to_thread(queue.fail, job["id"], str(e))
+        _log(job, "failed", error=str(e))
+        _stats["failed"] += 1
+    else:
+        external_doc_id = result.get("docId") if isinstance(result, dict) else None
+        await asyncio.to_thread(queue.complete, job["id"], external_doc_id)
+        _log(job, "success", payload, result, external_doc_id=external_doc_id)
+        _stats["succeeded"] += 1
+    finally:
+        if connection is not None:
+            await connection.release()
+
+async def _dispatch(client, jobs: List[dict]):
+    connections = await _connections_for(client, jobs)
+    correspondences = await asyncio.to_thread(
+        _load_correspondences, client,
+        [job["correspondence_id"] for job in jobs if job["action"] == "export" and job["correspondence_id"]]
+    )
+    for job in jobs:
+        connection = connections.get(job["connection_id"])
+        if connection is not None:
+            connection.in_flight += 1
+        task = asyncio.create_task(_run_job(
+            client, job, connection, correspondences.get(job["correspondence_id"])
+        ))
+        _running.add(task)
+        task.add_done_callback(_job_done)
+
+def _job_done(task: asyncio.Task):
+    _running.discard(task)
+    if _wakeup is not None:
+        _wakeup.set()
+
+def metrics() -> dict:
+    return {
+        "jobs": _get_queue().counts(),
+        "in_flight": len(_running),
+        "log_buffer": len(_log_rows),
+        "connections": {
+            connection_id: {"token_valid": connection.token_valid()}
+            for connection_id, connection in _connections.items()
+        },
+        **_stats,
+    }
+
+async def run_engine():
+    """Claim due jobs up to SYNC_MAX_CONCURRENCY and send them in parallel"""
+    global _wakeup
+    if not available():
+        print("External sync disabled: httpx is not installed")
+        return
+    _wakeup = asyncio.Event()
+    client = get_client()
+    queue = _get_queue()
+    loop = asyncio.get_running_loop()
+    flushed_at = purged_at = loop.time()
+
+    while True:
+        free = settings.SYNC_MAX_CONCURRENCY - len(_running)
+        if free > 0:
+            try:
+                jobs = await asyncio.to_thread(queue.claim, free)
+                if jobs:
+                    await _dispatch(client, jobs)
+            except Exception as e:
+                print(f"External sync claim error: {e}")
+
+        if loop.time() - flushed_at >= settings.SYNC_LOG_FLUSH_SECONDS or len(_log_rows) >= settings.SYNC_LOG_BATCH_SIZE:
+            flushed_at = loop.time()
+            try:
+                await asyncio.to_thread(flush_log, client)
+            except Exception as e:
+                print(f"Sync log flush error: {e}")
+
+        if loop.time() - purged_at >= 3600:
+            purged_at = loop.time()
+            try:
+                await asyncio.to_thread(queue.purge_finished, settings.SYNC_JOB_RETENTION_DAYS * 86400)
+            except Exception as e:
+                print(f"Sync queue purge error: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.SYNC_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+async def shutdown():
+    """Write buffered sync_log rows and close the HTTP pools; leased jobs
+    of this worker are picked up again when their lease expires"""
+    try:
+        await asyncio.to_thread(flush_log, get_client())
+    except Exception as e:
+        print(f"✗ Failed to flush sync log: {e}")
+    for connection in _connections.values():
+        await connection.http.aclose()
+    _connections.clear()
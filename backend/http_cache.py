@@ -0,0 +1,70 @@
+import hashlib
+import time
+from threading import Lock
+from typing import Optional, Dict, Tuple
+from fastapi import Response
+from config import settings
+
+# Version tokens (ETags) known to this worker, keyed by resource.
+# A token is trusted without re-querying ClickHouse for ETAG_TOKEN_TTL_SECONDS,
+# which bounds how long another worker's write can go unnoticed.
+_tokens: Dict[str, Tuple[str, float]] = {}
+_lock = Lock()
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from version parts (ids, updated_at, counts)"""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+def _opaque(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check an If-None-Match header value against an ETag.
+
+    Uses the weak comparison If-None-Match calls for, so the W/ form sent
+    for compressed responses still validates.
+    """
+    if not if_none_match or not etag:
+        return False
+    candidates = [_opaque(value.strip()) for value in if_none_match.split(",")]
+    return "*" in candidates or _opaque(etag) in candidates
+
+def get_token(key: str) -> Optional[str]:
+    """Return a cached version token if it is still fresh"""
+    with _lock:
+        entry = _tokens.get(key)
+        if entry is None:
+            return None
+        etag, stored_at = entry
+        if time.monotonic() - stored_at > settings.ETAG_TOKEN_TTL_SECONDS:
+            del _tokens[key]
+            return None
+        return etag
+
+def set_token(key: str, etag: str):
+    """Remember the current version token for a resource"""
+    with _lock:
+        _tokens[key] = (etag, time.monotonic())
+
+def invalidate(*keys: str):
+    """Forget version tokens after a write"""
+    with _lock:
+        for key in keys:
+            _tokens.pop(key, None)
+
+def set_cache_headers(response: Response, etag: str):
+    """Attach ETag and revalidation headers to a response"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = settings.ETAG_CACHE_CONTROL
+
+def not_modified(etag: str) -> Response:
+    """Build an empty 304 response for a matching ETag.
+
+    Content-Type lets CompressionMiddleware give the 304 the same ETag form
+    and Vary as the JSON 200 it stands for.
+    """
+    response = Response(status_code=304)
+    set_cache_headers(response, etag)
+    response.headers["Content-Type"] = "application/json"
+    return response
@@ -1,12 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from typing import Optional
+import asyncio
 import uvicorn
 
 from config import settings
-from database import init_database
-from routes import auth, correspondences, entities, templates, comments, notifications, upload, statistics, users
+from database import init_database, get_client
+from compression import CompressionMiddleware
+from rate_limit import RateLimitMiddleware
+from static_files import UploadFiles
+import notification_fanout
+import template_usage
+import audit_log
+import external_sync
+import scheduler
+import previews
+import pdf_renderer
+from routes import auth, correspondences, entities, templates, comments, notifications, upload, statistics, users, external_sync as external_sync_routes
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -15,6 +26,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Per-client rate limits; added before CORS so 429 responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -22,12 +36,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Retry-After"],
 )
 
-# Mount static files for uploads
+# Response compression (gzip/brotli/zstd, negotiated per request)
+app.add_middleware(CompressionMiddleware)
+
+# Serve uploaded files (ETags, Range, immutable caching, optional proxy offload)
 uploads_path = Path("uploads")
 uploads_path.mkdir(exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/uploads", UploadFiles(directory="uploads"), name="uploads")
 
 # Include routers
 app.include_router(auth.router, prefix="/api")
@@ -39,6 +57,7 @@ app.include_router(comments.router, prefix="/api")
 app.include_router(notifications.router, prefix="/api")
 app.include_router(upload.router, prefix="/api")
 app.include_router(statistics.router, prefix="/api")
+app.include_router(external_sync_routes.router, prefix="/api")
 
 @app.on_event("startup")
 async def startup_event():
@@ -49,6 +68,26 @@ async def startup_event():
     except Exception as e:
         print(f"✗ Failed to initialize database: {e}")
         raise
+    
+    # Background jobs
+    asyncio.create_task(notification_fanout.run_worker())
+    asyncio.create_task(template_usage.run_flusher())
+    asyncio.create_task(audit_log.run_flusher())
+    asyncio.create_task(external_sync.run_engine())
+    asyncio.create_task(scheduler.run_scheduler())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered counters and stop worker pools before the worker exits"""
+    try:
+        template_usage.flush(get_client())
+    except Exception as e:
+        print(f"✗ Failed to flush template usage: {e}")
+    audit_log.shutdown()
+    await external_sync.shutdown()
+    
+    previews.shutdown()
+    pdf_renderer.shutdown()
 
 @app.get("/health")
 async def health_check():
@@ -59,6 +98,19 @@ async def health_check():
         "version": "1.0.0"
     }
 
+# Under /api so the rate limiter applies; the payload names connections and
+# carries raw error messages, so it is for admins only
+@app.get("/api/metrics")
+async def metrics(x_session_token: Optional[str] = Header(None)):
+    """Queue depths, flush counters and scheduled job runs of this worker (admin only)"""
+    await users.verify_admin_session(x_session_token)
+    return {
+        "audit_log": audit_log.metrics(),
+        "notification_fanout": {"queue_depth": notification_fanout.queue_depth()},
+        "external_sync": external_sync.metrics(),
+        "scheduler": scheduler.metrics()
+    }
+
 @app.get("/")
 async def root():
     """Root endpoint"""
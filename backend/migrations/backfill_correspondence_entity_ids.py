@@ -0,0 +1,100 @@
+"""Add entity-id columns to moi.correspondences and backfill them from names.
+
+correspondences.from_entity / received_by_entity hold entity names, so a
+rename in the entities table used to orphan history. This adds
+from_entity_id / received_by_entity_id (LowCardinality(String), '' when the
+name is not a known entity), then fills them with one mutation per column
+mapping every current entity name to its id.
+
+Usage:
+    python migrations/backfill_correspondence_entity_ids.py --dry-run
+    python migrations/backfill_correspondence_entity_ids.py
+
+Safe to re-run: only rows whose id is still '' are updated. Names that match
+no entity are listed at the end so they can be fixed by hand.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import get_client
+
+ID_COLUMNS = (
+    ("from_entity", "from_entity_id"),
+    ("received_by_entity", "received_by_entity_id")
+)
+
+def add_columns_sql() -> list:
+    return [
+        f"ALTER TABLE correspondences ADD COLUMN IF NOT EXISTS {id_column} LowCardinality(String) DEFAULT '' AFTER {name_column}"
+        for name_column, id_column in ID_COLUMNS
+    ]
+
+def quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def backfill_sql(name_column: str, id_column: str, names: list, ids: list) -> str:
+    """One mutation mapping names to ids with transform() (deterministic, no dictGet)"""
+    names_array = "[" + ", ".join(quote(name) for name in names) + "]"
+    ids_array = "[" + ", ".join(quote(entity_id) for entity_id in ids) + "]"
+    return f"""
+        ALTER TABLE correspondences
+        UPDATE {id_column} = transform(ifNull({name_column}, ''), {names_array}, {ids_array}, '')
+        WHERE {id_column} = '' AND ifNull({name_column}, '') IN {names_array}
+    """
+
+def load_entities(client):
+    # First id per name, matching the API's entity directory
+    result = client.query("SELECT name, any(id) FROM entities GROUP BY name ORDER BY name")
+    names = [row[0] for row in result.result_rows]
+    ids = [row[1] for row in result.result_rows]
+    return names, ids
+
+def report_unmatched(client):
+    for name_column, id_column in ID_COLUMNS:
+        result = client.query(
+            f"""
+            SELECT {name_column}, count()
+            FROM correspondences
+            WHERE {id_column} = '' AND ifNull({name_column}, '') != ''
+            GROUP BY {name_column}
+            ORDER BY count() DESC
+            """
+        )
+        for name, count in result.result_rows:
+            print(f"  unmatched {name_column}: {name!r} ({count} rows)")
+
+def run(client, dry_run: bool):
+    def execute(sql: str):
+        if dry_run:
+            print(sql.strip() + ";\n")
+        else:
+            client.command(sql, settings={"mutations_sync": 1})
+
+    for sql in add_columns_sql():
+        execute(sql)
+    print("✓ Entity id columns added")
+
+    names, ids = load_entities(client)
+    if not names:
+        print("No entities, nothing to backfill")
+        return
+
+    for name_column, id_column in ID_COLUMNS:
+        execute(backfill_sql(name_column, id_column, names, ids))
+        print(f"✓ Backfilled {id_column}")
+
+    if not dry_run:
+        report_unmatched(client)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    run(get_client(), args.dry_run)
+
+if __name__ == "__main__":
+    main()
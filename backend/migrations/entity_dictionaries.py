@@ -0,0 +1,61 @@
+"""(Re)create the entity dictionary with the API's ClickHouse credentials.
+
+A dictionary with a CLICKHOUSE source connects as `default` unless USER and
+PASSWORD are given, which fails wherever `default` is password-protected.
+This replaces moi.entities_dict with one that authenticates as
+CLICKHOUSE_USERNAME, and drops moi.entity_ids_by_name, which nothing reads
+any more.
+
+Usage:
+    python migrations/entity_dictionaries.py --dry-run
+    python migrations/entity_dictionaries.py
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import settings
+from database import get_client
+
+def quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def create_dictionary_sql(password: str) -> str:
+    return f"""
+        CREATE OR REPLACE DICTIONARY entities_dict (
+            id String,
+            name String,
+            type String
+        )
+        PRIMARY KEY id
+        SOURCE(CLICKHOUSE(
+            DB {quote(settings.CLICKHOUSE_DATABASE)} TABLE 'entities'
+            USER {quote(settings.CLICKHOUSE_USERNAME)} PASSWORD {password}
+        ))
+        LAYOUT(COMPLEX_KEY_HASHED())
+        LIFETIME(MIN 60 MAX 300)
+    """
+
+def run(client, dry_run: bool):
+    if dry_run:
+        print(create_dictionary_sql("'***'").strip() + ";\n")
+        print("DROP DICTIONARY IF EXISTS entity_ids_by_name;")
+        return
+
+    client.command(create_dictionary_sql(quote(settings.CLICKHOUSE_PASSWORD)))
+    print("✓ entities_dict created")
+
+    client.command("DROP DICTIONARY IF EXISTS entity_ids_by_name")
+    print("✓ entity_ids_by_name dropped")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    run(get_client(), args.dry_run)
+
+if __name__ == "__main__":
+    main()
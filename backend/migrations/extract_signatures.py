@@ -0,0 +1,122 @@
+"""Move signature images out of moi.users into the upload store.
+
+users.signature_base64 kept each signature inline, so every users part
+carried the image bytes. This writes each signature to
+uploads/signatures/<md5>.<ext> (the same content-addressed naming as
+POST /upload/signature), stores the URL in users.signature_url and clears
+signature_base64, in one mutation per --batch-size users.
+
+Run from the backend directory (uploads/ is relative to it):
+    python migrations/extract_signatures.py --dry-run
+    python migrations/extract_signatures.py
+    python migrations/extract_signatures.py --drop-column   # once verified
+
+Safe to re-run: users that already have a signature_url are skipped.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import get_client
+from routes.upload import decode_data_url, store_signature
+
+def add_column_sql() -> str:
+    return "ALTER TABLE users ADD COLUMN IF NOT EXISTS signature_url Nullable(String) AFTER entity_name"
+
+def quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def update_batch_sql(urls: dict) -> str:
+    """One mutation setting signature_url for a batch of users and clearing the blob"""
+    ids = "[" + ", ".join(str(user_id) for user_id in urls) + "]"
+    values = "[" + ", ".join(quote(url) for url in urls.values()) + "]"
+    return f"""
+        ALTER TABLE users
+        UPDATE signature_url = transform(id, {ids}, {values}, signature_url),
+               signature_base64 = NULL
+        WHERE has({ids}, id)
+    """
+
+def has_url_column(client) -> bool:
+    result = client.query(
+        """
+        SELECT count()
+        FROM system.columns
+        WHERE database = currentDatabase() AND table = 'users' AND name = 'signature_url'
+        """
+    )
+    return result.result_rows[0][0] > 0
+
+def pending_signatures(client, url_column: bool):
+    # Before the column exists (--dry-run on a fresh table) every signature is pending
+    url_filter = " AND ifNull(signature_url, '') = ''" if url_column else ""
+    result = client.query(
+        f"""
+        SELECT id, signature_base64
+        FROM users
+        WHERE ifNull(signature_base64, '') != ''{url_filter}
+        ORDER BY id
+        """
+    )
+    return result.result_rows
+
+def run(client, dry_run: bool, batch_size: int):
+    def execute(sql: str):
+        if dry_run:
+            print(sql.strip() + ";\n")
+        else:
+            client.command(sql, settings={"mutations_sync": 1})
+
+    execute(add_column_sql())
+    print("✓ signature_url column added")
+
+    batch = {}
+    extracted = failed = 0
+    for user_id, value in pending_signatures(client, has_url_column(client)):
+        try:
+            contents, file_ext = decode_data_url(value)
+        except ValueError as e:
+            print(f"  skipped user {user_id}: {e}")
+            failed += 1
+            continue
+
+        if dry_run:
+            batch[user_id] = f"/uploads/signatures/<md5 of {len(contents)} bytes>{file_ext}"
+        else:
+            batch[user_id] = store_signature(contents, file_ext)
+        extracted += 1
+
+        if len(batch) >= batch_size:
+            execute(update_batch_sql(batch))
+            batch = {}
+
+    if batch:
+        execute(update_batch_sql(batch))
+
+    print(f"✓ Extracted {extracted} signatures ({failed} skipped)")
+
+def drop_column(client, dry_run: bool):
+    sql = "ALTER TABLE users DROP COLUMN IF EXISTS signature_base64"
+    if dry_run:
+        print(sql + ";")
+    else:
+        client.command(sql)
+        print("✓ signature_base64 dropped")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    parser.add_argument("--batch-size", type=int, default=500, help="users per mutation")
+    parser.add_argument("--drop-column", action="store_true", help="drop users.signature_base64 after extraction")
+    args = parser.parse_args()
+
+    client = get_client()
+    if args.drop_column:
+        drop_column(client, args.dry_run)
+    else:
+        run(client, args.dry_run, args.batch_size)
+
+if __name__ == "__main__":
+    main()
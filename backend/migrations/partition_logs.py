@@ -0,0 +1,166 @@
+"""Move moi.audit_log and moi.sync_log to month-partitioned tables with a retention TTL.
+
+Both tables are append-only and grow without bound. Partitioned by month,
+with ttl_only_drop_parts, expired months are dropped as whole parts instead
+of being rewritten by merges or OPTIMIZE.
+
+Steps per table (all online, the API keeps serving):
+  1. create <table>_partitioned (PARTITION BY toYYYYMM(created_at) + TTL)
+  2. copy existing rows month by month (expired months are skipped)
+  3. EXCHANGE the two tables
+  4. copy rows that arrived during the backfill from the old table
+  5. keep the old table as <table>_unpartitioned for manual DROP
+
+Usage:
+    python migrations/partition_logs.py --dry-run
+    python migrations/partition_logs.py
+    python migrations/partition_logs.py --apply-ttl   # after changing the retention settings
+
+Retention comes from AUDIT_RETENTION_DAYS / SYNC_LOG_RETENTION_DAYS
+(0 keeps rows forever; old months can still be dropped by hand).
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import settings
+from database import get_client
+
+TABLES = {
+    "audit_log": {
+        "columns": (
+            "id, user_id, action, entity_type, entity_id, old_data, new_data, "
+            "description, ip_address, user_agent, created_at"
+        ),
+        "definition": """
+            id String DEFAULT generateUUIDv4(),
+            user_id Nullable(UInt64),
+            action String NOT NULL,
+            entity_type String NOT NULL,
+            entity_id String NOT NULL,
+            old_data Nullable(String),
+            new_data Nullable(String),
+            description Nullable(String),
+            ip_address Nullable(String),
+            user_agent Nullable(String),
+            created_at DateTime DEFAULT now()
+        """,
+        "order_by": "(created_at, id)",
+    },
+    "sync_log": {
+        "columns": (
+            "id, correspondence_id, connection_id, operation, status, external_doc_id, "
+            "request_payload, response_payload, error_message, created_at"
+        ),
+        "definition": """
+            id String DEFAULT generateUUIDv4(),
+            correspondence_id Nullable(String),
+            connection_id Nullable(String),
+            operation String NOT NULL,
+            status String NOT NULL,
+            external_doc_id Nullable(String),
+            request_payload Nullable(String),
+            response_payload Nullable(String),
+            error_message Nullable(String),
+            created_at DateTime DEFAULT now()
+        """,
+        "order_by": "(created_at)",
+    },
+}
+
+def retention_days(table: str) -> int:
+    return settings.AUDIT_RETENTION_DAYS if table == "audit_log" else settings.SYNC_LOG_RETENTION_DAYS
+
+def ttl_clause(table: str) -> str:
+    days = retention_days(table)
+    return f"TTL created_at + INTERVAL {days} DAY DELETE" if days else ""
+
+def create_table_sql(table: str) -> str:
+    spec = TABLES[table]
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}_partitioned ({spec["definition"]})
+        ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(created_at)
+        ORDER BY {spec["order_by"]}
+        {ttl_clause(table)}
+        SETTINGS ttl_only_drop_parts = 1
+    """
+
+def copy_month_sql(table: str, month: int, cutoff: str) -> str:
+    columns = TABLES[table]["columns"]
+    return f"""
+        INSERT INTO {table}_partitioned ({columns})
+        SELECT {columns}
+        FROM {table}
+        WHERE toYYYYMM(created_at) = {month} AND created_at < '{cutoff}'
+    """
+
+def catch_up_sql(table: str, cutoff: str) -> str:
+    """Rows written to the old table while the backfill ran (after the EXCHANGE it is <table>_partitioned)"""
+    columns = TABLES[table]["columns"]
+    return f"""
+        INSERT INTO {table} ({columns})
+        SELECT {columns}
+        FROM {table}_partitioned
+        WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          AND id NOT IN (
+              SELECT id FROM {table}
+              WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          )
+    """
+
+def run(client, table: str, dry_run: bool):
+    def execute(sql: str):
+        if dry_run:
+            print(sql.strip() + ";\n")
+        else:
+            client.command(sql)
+
+    cutoff = datetime.utcnow().replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+
+    execute(create_table_sql(table))
+    print(f"✓ {table}_partitioned created")
+
+    months_query = f"SELECT DISTINCT toYYYYMM(created_at) AS month FROM {table}"
+    if retention_days(table):
+        months_query += f" WHERE created_at >= now() - INTERVAL {retention_days(table)} DAY"
+    for (month,) in client.query(months_query + " ORDER BY month").result_rows:
+        execute(copy_month_sql(table, month, cutoff))
+        print(f"✓ Copied {table} {month}")
+
+    execute(f"EXCHANGE TABLES {table} AND {table}_partitioned")
+    print(f"✓ {table} exchanged")
+
+    execute(catch_up_sql(table, cutoff))
+    print(f"✓ Caught up {table} rows written during backfill")
+
+    execute(f"RENAME TABLE {table}_partitioned TO {table}_unpartitioned")
+    print(f"✓ Old table kept as {table}_unpartitioned (DROP it once verified)")
+
+def apply_ttl(client, table: str, dry_run: bool):
+    sql = f"ALTER TABLE {table} MODIFY {ttl_clause(table)}" if retention_days(table) else f"ALTER TABLE {table} REMOVE TTL"
+    if dry_run:
+        print(sql + ";")
+    else:
+        client.command(sql)
+        print(f"✓ {table} TTL updated")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    parser.add_argument("--apply-ttl", action="store_true", help="only update the TTL of the partitioned tables")
+    parser.add_argument("--table", choices=sorted(TABLES), help="migrate one table only")
+    args = parser.parse_args()
+
+    client = get_client()
+    for table in [args.table] if args.table else list(TABLES):
+        if args.apply_ttl:
+            apply_ttl(client, table, args.dry_run)
+        else:
+            run(client, table, args.dry_run)
+
+if __name__ == "__main__":
+    main()
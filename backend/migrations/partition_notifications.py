@@ -0,0 +1,154 @@
+"""Move moi.notifications to a month-partitioned table with a retention TTL.
+
+Steps (all online, the API keeps serving):
+  1. create notifications_partitioned (PARTITION BY toYYYYMM(created_at) + TTL)
+  2. copy existing rows month by month, folding the read markers from
+     notification_reads into the legacy read flag
+  3. EXCHANGE the two tables
+  4. copy rows that arrived during the backfill from the old table
+  5. keep the old table as notifications_unpartitioned for manual DROP
+
+Usage:
+    python migrations/partition_notifications.py --dry-run
+    python migrations/partition_notifications.py
+    python migrations/partition_notifications.py --apply-ttl   # after changing the TTL settings
+
+Notifications are removed NOTIFICATION_RETENTION_DAYS after creation, read
+or not. Reads are recorded as markers in notification_reads, which a TTL on
+this table cannot see, so there is no separate (shorter) TTL for read rows.
+Tables migrated with the earlier read/unread TTL pair: run --apply-ttl to
+replace it.
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import settings
+from database import get_client
+
+NEW_TABLE = "notifications_partitioned"
+BACKUP_TABLE = "notifications_unpartitioned"
+
+COLUMNS = (
+    "id, user_id, type, title, message, correspondence_id, "
+    "related_entity_type, related_entity_id, priority, action_url, read, read_at, created_at"
+)
+
+def ttl_clause() -> str:
+    return f"created_at + INTERVAL {settings.NOTIFICATION_RETENTION_DAYS} DAY DELETE"
+
+def create_table_sql() -> str:
+    return f"""
+        CREATE TABLE IF NOT EXISTS {NEW_TABLE} (
+            id String DEFAULT generateUUIDv4(),
+            user_id UInt64 NOT NULL,
+            type String NOT NULL,
+            title String NOT NULL,
+            message String NOT NULL,
+            correspondence_id Nullable(String),
+            related_entity_type Nullable(String),
+            related_entity_id Nullable(String),
+            priority String DEFAULT 'normal',
+            action_url Nullable(String),
+            read UInt8 DEFAULT 0,
+            read_at Nullable(DateTime),
+            created_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(created_at)
+        ORDER BY (user_id, created_at)
+        TTL {ttl_clause()}
+    """
+
+def copy_month_sql(month: int, cutoff: str) -> str:
+    """Copy one month, folding read markers and the read-all watermark into read"""
+    return f"""
+        INSERT INTO {NEW_TABLE} ({COLUMNS})
+        SELECT
+            n.id, n.user_id, n.type, n.title, n.message, n.correspondence_id,
+            n.related_entity_type, n.related_entity_id, n.priority, n.action_url,
+            if(m.notification_id != '' AND m.marker_at >= w.read_until,
+               m.marker_read,
+               n.read = 1 OR n.created_at <= w.read_until) AS folded_read,
+            n.read_at, n.created_at
+        FROM notifications AS n
+        LEFT JOIN (
+            SELECT user_id, notification_id, argMax(read, version) AS marker_read, max(read_at) AS marker_at
+            FROM notification_reads
+            WHERE notification_id != ''
+            GROUP BY user_id, notification_id
+        ) AS m ON m.user_id = n.user_id AND m.notification_id = n.id
+        LEFT JOIN (
+            SELECT user_id, max(read_until) AS read_until
+            FROM notification_reads
+            WHERE notification_id = ''
+            GROUP BY user_id
+        ) AS w ON w.user_id = n.user_id
+        WHERE toYYYYMM(n.created_at) = {month} AND n.created_at < '{cutoff}'
+    """
+
+def catch_up_sql(cutoff: str) -> str:
+    """Rows written to the old table while the backfill ran (after the EXCHANGE it is NEW_TABLE)"""
+    return f"""
+        INSERT INTO notifications ({COLUMNS})
+        SELECT {COLUMNS}
+        FROM {NEW_TABLE}
+        WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          AND id NOT IN (
+              SELECT id FROM notifications
+              WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          )
+    """
+
+def run(client, dry_run: bool):
+    def execute(sql: str):
+        if dry_run:
+            print(sql.strip() + ";\n")
+        else:
+            client.command(sql)
+
+    cutoff = datetime.utcnow().replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+
+    execute(create_table_sql())
+    print(f"✓ {NEW_TABLE} created")
+
+    months = client.query(
+        "SELECT DISTINCT toYYYYMM(created_at) AS month FROM notifications ORDER BY month"
+    ).result_rows
+    for (month,) in months:
+        execute(copy_month_sql(month, cutoff))
+        print(f"✓ Copied {month}")
+
+    execute(f"EXCHANGE TABLES notifications AND {NEW_TABLE}")
+    print("✓ Tables exchanged")
+
+    execute(catch_up_sql(cutoff))
+    print("✓ Caught up rows written during backfill")
+
+    execute(f"RENAME TABLE {NEW_TABLE} TO {BACKUP_TABLE}")
+    print(f"✓ Old table kept as {BACKUP_TABLE} (DROP it once verified)")
+
+def apply_ttl(client, dry_run: bool):
+    sql = f"ALTER TABLE notifications MODIFY TTL {ttl_clause()}"
+    if dry_run:
+        print(sql + ";")
+    else:
+        client.command(sql)
+        print("✓ TTL updated")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    parser.add_argument("--apply-ttl", action="store_true", help="only update the TTL of the partitioned table")
+    args = parser.parse_args()
+
+    client = get_client()
+    if args.apply_ttl:
+        apply_ttl(client, args.dry_run)
+    else:
+        run(client, args.dry_run)
+
+if __name__ == "__main__":
+    main()
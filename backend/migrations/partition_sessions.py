@@ -0,0 +1,99 @@
+"""Move moi.sessions to a table partitioned by expiry day.
+
+Expired sessions are then removed by the scheduler's purge_sessions job with
+DROP PARTITION (no DELETE mutation rewriting the table), and the table is
+ordered by token, which is how every request looks a session up.
+
+Steps (all online, the API keeps serving):
+  1. create sessions_partitioned (PARTITION BY toYYYYMMDD(expires_at), ORDER BY token)
+  2. copy the sessions that have not expired yet
+  3. EXCHANGE the two tables
+  4. copy sessions created during the copy from the old table
+  5. keep the old table as sessions_unpartitioned for manual DROP
+
+Usage:
+    python migrations/partition_sessions.py --dry-run
+    python migrations/partition_sessions.py
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import get_client
+
+NEW_TABLE = "sessions_partitioned"
+BACKUP_TABLE = "sessions_unpartitioned"
+
+COLUMNS = "id, user_id, token, expires_at, created_at"
+
+def create_table_sql() -> str:
+    return f"""
+        CREATE TABLE IF NOT EXISTS {NEW_TABLE} (
+            id String DEFAULT generateUUIDv4(),
+            user_id UInt64 NOT NULL,
+            token String NOT NULL,
+            expires_at DateTime NOT NULL,
+            created_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMMDD(expires_at)
+        ORDER BY token
+    """
+
+def copy_sql(cutoff: str) -> str:
+    return f"""
+        INSERT INTO {NEW_TABLE} ({COLUMNS})
+        SELECT {COLUMNS}
+        FROM sessions
+        WHERE expires_at > now() AND created_at < '{cutoff}'
+    """
+
+def catch_up_sql(cutoff: str) -> str:
+    """Logins during the copy (after the EXCHANGE the old table is NEW_TABLE)"""
+    return f"""
+        INSERT INTO sessions ({COLUMNS})
+        SELECT {COLUMNS}
+        FROM {NEW_TABLE}
+        WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          AND expires_at > now()
+          AND token NOT IN (
+              SELECT token FROM sessions
+              WHERE created_at >= toDateTime('{cutoff}') - INTERVAL 5 MINUTE
+          )
+    """
+
+def run(client, dry_run: bool):
+    def execute(sql: str):
+        if dry_run:
+            print(sql.strip() + ";\n")
+        else:
+            client.command(sql)
+
+    cutoff = datetime.utcnow().replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+
+    execute(create_table_sql())
+    print(f"✓ {NEW_TABLE} created")
+
+    execute(copy_sql(cutoff))
+    print("✓ Copied active sessions")
+
+    execute(f"EXCHANGE TABLES sessions AND {NEW_TABLE}")
+    print("✓ Tables exchanged")
+
+    execute(catch_up_sql(cutoff))
+    print("✓ Caught up sessions created during the copy")
+
+    execute(f"RENAME TABLE {NEW_TABLE} TO {BACKUP_TABLE}")
+    print(f"✓ Old table kept as {BACKUP_TABLE} (DROP it once verified)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    run(get_client(), args.dry_run)
+
+if __name__ == "__main__":
+    main()
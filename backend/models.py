@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, Optional, List, Dict
 from datetime import datetime
 
 # Auth Models
@@ -30,6 +30,11 @@ class UserUpdate(BaseModel):
 
 class UserListRequest(BaseModel):
     sessionToken: str
+    limit: int = Field(100, ge=1, le=500)
+    cursor: Optional[str] = None
+    search: Optional[str] = None
+    entityId: Optional[str] = None
+    role: Optional[str] = None
 
 # Correspondence Models
 class CorrespondenceBase(BaseModel):
@@ -52,6 +57,9 @@ class CorrespondenceCreate(CorrespondenceBase):
 class CorrespondenceUpdate(CorrespondenceBase):
     pass
 
+class CorrespondenceCountsRequest(BaseModel):
+    ids: List[str]
+
 # Entity Models
 class EntityBase(BaseModel):
     name: str
@@ -71,3 +79,19 @@ class TemplateBase(BaseModel):
 
 class TemplateCreate(TemplateBase):
     pass
+
+class TemplateRenderRequest(BaseModel):
+    values: Dict[str, str] = {}
+
+class TemplateBulkRenderRequest(BaseModel):
+    items: List[Dict[str, str]]
+
+# External Sync Models
+class ExternalSyncRequest(BaseModel):
+    connectionId: str
+    action: str
+    correspondenceIds: List[str] = []
+    data: Dict[str, Any] = {}
+
+class ExternalSyncStatusRequest(BaseModel):
+    jobIds: List[str]
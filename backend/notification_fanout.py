@@ -0,0 +1,150 @@
+import asyncio
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+from database import get_client
+from config import settings
+import notification_hub
+import unread_counters
+import user_directory
+
+NOTIFICATION_COLUMNS = [
+    "id", "user_id", "type", "title", "message", "correspondence_id",
+    "related_entity_type", "related_entity_id", "priority", "action_url",
+    "read", "created_at"
+]
+
+# Pending fan-out jobs. The queue is bounded: when the writer falls behind,
+# enqueue() waits (back-pressure on the request) up to FANOUT_ENQUEUE_TIMEOUT_SECONDS.
+_queue: Optional[asyncio.Queue] = None
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=settings.FANOUT_QUEUE_SIZE)
+    return _queue
+
+def queue_depth() -> int:
+    return _queue.qsize() if _queue is not None else 0
+
+async def enqueue(
+    type: str,
+    title: str,
+    message: str,
+    entity: Optional[str] = None,
+    user_ids: Optional[List[int]] = None,
+    exclude_user_id: Optional[int] = None,
+    correspondence_id: Optional[str] = None,
+    related_entity_type: Optional[str] = None,
+    related_entity_id: Optional[str] = None,
+    priority: str = "normal",
+    action_url: Optional[str] = None
+) -> bool:
+    """Queue a notification for every user of an entity and/or explicit users.
+
+    Recipients are resolved by the background writer, so the calling
+    request only pays for the enqueue.
+    """
+    job = {
+        "type": type,
+        "title": title,
+        "message": message,
+        "entity": entity,
+        "user_ids": list(user_ids or []),
+        "exclude_user_id": exclude_user_id,
+        "correspondence_id": correspondence_id,
+        "related_entity_type": related_entity_type,
+        "related_entity_id": related_entity_id,
+        "priority": priority,
+        "action_url": action_url,
+        "created_at": datetime.utcnow().replace(microsecond=0)
+    }
+
+    try:
+        await asyncio.wait_for(_get_queue().put(job), timeout=settings.FANOUT_ENQUEUE_TIMEOUT_SECONDS)
+        return True
+    except asyncio.TimeoutError:
+        print(f"Notification fan-out queue full, dropped '{type}' notification")
+        return False
+
+def resolve_recipients(job: dict, directory: dict) -> List[int]:
+    """Expand a job's entity and explicit users into a de-duplicated recipient list"""
+    recipients = []
+    entity = job.get("entity")
+    if entity:
+        recipients.extend(directory["by_entity_id"].get(entity) or directory["by_entity_name"].get(entity, []))
+    recipients.extend(user_id for user_id in job.get("user_ids", []) if user_id in directory["user_ids"])
+
+    exclude = job.get("exclude_user_id")
+    seen = set()
+    unique = []
+    for user_id in recipients:
+        if user_id != exclude and user_id not in seen:
+            seen.add(user_id)
+            unique.append(user_id)
+    return unique
+
+def build_rows(jobs: List[dict], directory: dict) -> List[list]:
+    """Turn queued jobs into notification rows for a single batched INSERT"""
+    rows = []
+    for job in jobs:
+        for user_id in resolve_recipients(job, directory):
+            rows.append([
+                str(uuid.uuid4()),
+                user_id,
+                job["type"],
+                job["title"],
+                job["message"],
+                job["correspondence_id"],
+                job["related_entity_type"],
+                job["related_entity_id"],
+                job["priority"],
+                job["action_url"],
+                0,
+                job["created_at"]
+            ])
+    return rows
+
+def write_batch(client, jobs: List[dict]) -> int:
+    """Insert all notifications for a batch of jobs and update counters"""
+    rows = build_rows(jobs, user_directory.get_directory(client))
+    if not rows:
+        return 0
+
+    client.insert("notifications", rows, column_names=NOTIFICATION_COLUMNS)
+    unread_counters.apply_deltas(client, Counter(row[1] for row in rows))
+
+    for row in rows:
+        if notification_hub.has_subscribers(row[1]):
+            notification = dict(zip(NOTIFICATION_COLUMNS, row))
+            notification["read"] = False
+            notification["read_at"] = None
+            notification_hub.publish_notification(notification)
+
+    return len(rows)
+
+async def run_worker():
+    """Drain the queue, writing up to FANOUT_BATCH_SIZE jobs per INSERT"""
+    queue = _get_queue()
+    client = get_client()
+    while True:
+        jobs = [await queue.get()]
+        # Gather whatever arrives within the flush window into the same INSERT
+        deadline = asyncio.get_running_loop().time() + settings.FANOUT_FLUSH_INTERVAL_SECONDS
+        while len(jobs) < settings.FANOUT_BATCH_SIZE:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            await asyncio.to_thread(write_batch, client, jobs)
+        except Exception as e:
+            print(f"Notification fan-out error ({len(jobs)} jobs): {e}")
+        finally:
+            for _ in jobs:
+                queue.task_done()
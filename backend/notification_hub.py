@@ -0,0 +1,105 @@
+import asyncio
+import calendar
+import json
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+from config import settings
+
+# In-process pub/sub for pushing notification events to connected clients.
+# Each subscriber is an asyncio.Queue of pre-formatted SSE messages.
+_subscribers: Dict[int, Set[asyncio.Queue]] = {}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+def format_event(event: str, data, event_id: Optional[str] = None) -> str:
+    """Format a Server-Sent Events message"""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+def notification_event_id(created_at: datetime, notification_id: str) -> str:
+    """Event id for a notification, ordered like (created_at, id) for replay"""
+    return f"{calendar.timegm(created_at.timetuple())}:{notification_id}"
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[int, str]]:
+    """Split a Last-Event-ID header into (epoch seconds, notification id)"""
+    if not event_id:
+        return None
+    timestamp, _, notification_id = event_id.partition(":")
+    try:
+        return int(timestamp), notification_id
+    except ValueError:
+        return None
+
+def subscribe(user_id: int) -> asyncio.Queue:
+    """Register a connection for a user and return its message queue"""
+    global _loop
+    queue = asyncio.Queue(maxsize=settings.SSE_QUEUE_SIZE)
+    with _lock:
+        _loop = asyncio.get_running_loop()
+        _subscribers.setdefault(user_id, set()).add(queue)
+    return queue
+
+def unsubscribe(user_id: int, queue: asyncio.Queue):
+    with _lock:
+        queues = _subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del _subscribers[user_id]
+
+def connection_count() -> int:
+    with _lock:
+        return sum(len(queues) for queues in _subscribers.values())
+
+def has_subscribers(user_id: int) -> bool:
+    with _lock:
+        return user_id in _subscribers
+
+def _deliver(user_id: int, message: str):
+    with _lock:
+        queues = list(_subscribers.get(user_id, ()))
+    for queue in queues:
+        if queue.full():
+            # Slow consumer: drop its oldest message, it will catch up via Last-Event-ID replay
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(message)
+
+def publish(user_id: int, event: str, data, event_id: Optional[str] = None):
+    """Push an event to every connection of a user (safe to call from any thread)"""
+    if not has_subscribers(user_id):
+        return
+
+    message = format_event(event, data, event_id)
+    loop = _loop
+    if loop is None:
+        return
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    if running is loop:
+        _deliver(user_id, message)
+    else:
+        loop.call_soon_threadsafe(_deliver, user_id, message)
+
+def publish_notification(notification: dict):
+    """Push a newly created notification to its recipient"""
+    publish(
+        notification["user_id"],
+        "notification",
+        notification,
+        notification_event_id(notification["created_at"], notification["id"])
+    )
+
+def publish_unread_count(user_id: int, count: int):
+    publish(user_id, "unread_count", {"count": count})
@@ -0,0 +1,251 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from config import settings
+
+# Optional dependencies: reportlab draws the PDF, arabic_reshaper + python-bidi
+# turn logical Arabic text into shaped glyphs in visual (RTL) order
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+
+GENERATED_DIR = Path("uploads") / "pdfs" / "generated"
+FONT_NAME = "CorrespondenceFont"
+
+# Renders in progress in this worker, keyed by output file (single flight)
+_inflight: Dict[str, asyncio.Future] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Per pool process: registered font and measured word widths
+_font_path: Optional[str] = None
+_word_widths: Dict[tuple, float] = {}
+
+def available() -> bool:
+    return canvas is not None and arabic_reshaper is not None and os.path.isfile(settings.PDF_FONT_PATH)
+
+def shape(text: str) -> str:
+    """Logical Arabic text -> shaped glyphs in display order"""
+    return get_display(arabic_reshaper.reshape(text))
+
+def _register_font(font_path: str):
+    global _font_path
+    if _font_path != font_path:
+        pdfmetrics.registerFont(TTFont(FONT_NAME, font_path))
+        _font_path = font_path
+        _word_widths.clear()
+
+def _word_width(word: str, size: float) -> float:
+    # Arabic letters only join within a word, so words can be measured once
+    key = (word, size)
+    width = _word_widths.get(key)
+    if width is None:
+        width = pdfmetrics.stringWidth(shape(word), FONT_NAME, size)
+        _word_widths[key] = width
+    return width
+
+def wrap(text: str, size: float, max_width: float) -> List[str]:
+    """Greedy word wrap of logical text; each paragraph starts a new line"""
+    space = pdfmetrics.stringWidth(" ", FONT_NAME, size)
+    lines = []
+    for paragraph in (text or "").split("\n"):
+        line, width = [], 0.0
+        for word in paragraph.split():
+            word_width = _word_width(word, size)
+            if line and width + space + word_width > max_width:
+                lines.append(" ".join(line))
+                line, width = [], 0.0
+            width += (space if line else 0) + word_width
+            line.append(word)
+        lines.append(" ".join(line))
+    return lines
+
+class _RtlPage:
+    """Right-to-left text flow over A4 pages with automatic page breaks"""
+
+    def __init__(self, pdf):
+        # reportlab units are only bound once available() holds
+        self.margin = 20 * mm
+        self.pdf = pdf
+        self.width, self.height = A4
+        self.right = self.width - self.margin
+        self.text_width = self.width - 2 * self.margin
+        self.pages = 1
+        self.y = self.height - self.margin
+
+    def ensure(self, height: float):
+        if self.y - height < self.margin + 12 * mm:
+            self.footer()
+            self.pdf.showPage()
+            self.pages += 1
+            self.y = self.height - self.margin
+
+    def footer(self):
+        self.pdf.setFont(FONT_NAME, 8)
+        self.pdf.setFillGray(0.45)
+        self.pdf.drawCentredString(self.width / 2, self.margin / 2, shape("تم إنشاء هذه المراسلة بواسطة نظام إدارة المراسلات"))
+        self.pdf.drawString(self.margin, self.margin / 2, str(self.pages))
+        self.pdf.setFillGray(0)
+
+    def text(self, text: str, size: float = 11, leading: float = 1.8, centred: bool = False):
+        for line in wrap(text, size, self.text_width):
+            self.ensure(size * leading)
+            self.y -= size * leading
+            self.pdf.setFont(FONT_NAME, size)
+            if centred:
+                self.pdf.drawCentredString(self.width / 2, self.y, shape(line))
+            else:
+                self.pdf.drawRightString(self.right, self.y, shape(line))
+
+    def gap(self, height: float):
+        self.y -= height
+
+    def rule(self):
+        self.ensure(6)
+        self.y -= 6
+        self.pdf.setStrokeGray(0.8)
+        self.pdf.line(self.margin, self.y, self.right, self.y)
+
+    def image(self, source, max_width: float, max_height: float):
+        reader = ImageReader(source)
+        image_width, image_height = reader.getSize()
+        scale = min(max_width / image_width, max_height / image_height, 1)
+        width, height = image_width * scale, image_height * scale
+        self.ensure(height + 6)
+        self.y -= height + 6
+        self.pdf.drawImage(reader, (self.width - width) / 2, self.y, width, height, mask="auto")
+
+def render_correspondence(data: dict, dest: str, font_path: str, signature: Union[str, bytes, None] = None) -> int:
+    """Write a correspondence PDF to dest and return its page count (runs in a pool process)"""
+    _register_font(font_path)
+
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    pdf = canvas.Canvas(tmp_path, pagesize=A4, pageCompression=1)
+    pdf.setTitle(f"مراسلة {data.get('number', '')}")
+    page = _RtlPage(pdf)
+
+    incoming = data.get("type") == "incoming"
+    page.text("نظام إدارة المراسلات", size=18, centred=True)
+    page.text("مراسلة واردة" if incoming else "مراسلة صادرة", size=12, centred=True)
+    page.rule()
+    page.gap(4)
+
+    date = data.get("date")
+    if isinstance(date, datetime):
+        date = date.strftime("%Y/%m/%d")
+    page.text(f"رقم المراسلة: {data.get('number', '')}")
+    page.text(f"التاريخ: {date or ''}")
+    page.text(f"{'من' if incoming else 'إلى'}: {data.get('from_entity') or ''}")
+    page.text(f"النوع: {'وارد' if incoming else 'صادر'}")
+    page.rule()
+
+    if data.get("display_type", "content") == "content":
+        page.gap(6)
+        page.text(f"الموضوع: {data.get('subject', '')}", size=13)
+        if data.get("greeting"):
+            page.gap(6)
+            page.text(data["greeting"], size=12)
+        if data.get("content"):
+            page.gap(6)
+            page.text(data["content"], size=12, leading=2.0)
+        if data.get("responsible_person"):
+            page.gap(12)
+            if signature:
+                try:
+                    page.image(io.BytesIO(signature) if isinstance(signature, bytes) else signature, 70 * mm, 35 * mm)
+                except Exception as e:
+                    # A broken signature image must not fail the whole letter
+                    print(f"Signature image skipped: {e}")
+            page.text(data["responsible_person"], size=12, centred=True)
+
+    attachments = data.get("attachments") or []
+    if attachments:
+        page.gap(10)
+        page.text("المرفقات", size=13)
+        for index, url in enumerate(attachments, start=1):
+            page.text(f"{index}. {url.rsplit('/', 1)[-1]}", size=10)
+
+    page.footer()
+    pdf.save()
+    os.replace(tmp_path, dest)
+    return page.pages
+
+def signature_source(signature_url: Optional[str]) -> Union[str, bytes, None]:
+    """Local file path (or decoded bytes for legacy data: URLs) of a signature"""
+    if not signature_url:
+        return None
+    if signature_url.startswith("data:"):
+        try:
+            return base64.b64decode(signature_url.partition(",")[2])
+        except ValueError:
+            return None
+    marker = "/uploads/"
+    if marker in signature_url:
+        path = Path("uploads") / signature_url.split(marker, 1)[1]
+        return str(path) if path.is_file() else None
+    return None
+
+# Columns drawn on the page. The cache key hashes these rather than
+# updated_at, which also moves when pdf_url or sync ids are written back.
+RENDERED_FIELDS = (
+    "number", "type", "subject", "content", "from_entity", "date", "greeting",
+    "responsible_person", "signature_url", "display_type", "attachments"
+)
+
+def output_path(data: dict) -> Path:
+    """Cache key: a new file whenever the rendered content changes"""
+    safe_id = "".join(ch for ch in data["id"] if ch.isalnum() or ch == "-")
+    content = json.dumps([data.get(field) for field in RENDERED_FIELDS], ensure_ascii=False, default=str)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+    return GENERATED_DIR / f"{safe_id}-{digest}.pdf"
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.PDF_WORKERS or None)
+    return _pool
+
+async def get_pdf(data: dict) -> str:
+    """URL of the PDF for this version of a correspondence, rendering it if needed"""
+    dest = output_path(data)
+    url = "/" + dest.as_posix()
+    if dest.exists():
+        return url
+
+    key = str(dest)
+    future = _inflight.get(key)
+    if future is None:
+        GENERATED_DIR.mkdir(parents=True, exist_ok=True)
+        future = asyncio.get_running_loop().run_in_executor(
+            _get_pool(), render_correspondence, data, key, settings.PDF_FONT_PATH,
+            signature_source(data.get("signature_url"))
+        )
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    await asyncio.shield(future)
+    return url
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
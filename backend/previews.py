@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+from config import settings
+from ttl_cache import TTLCache
+
+# Optional renderers: Pillow for images (and for saving), pypdfium2 for PDF pages
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+PREVIEWS_DIR = Path("uploads") / "previews"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+PDF_EXTENSIONS = {".pdf"}
+
+# Source file -> MD5, so repeat requests don't re-hash 10 MB files.
+# Upload names are never reused, so entries never go stale.
+_md5_cache = TTLCache(24 * 3600)
+
+# Renders in progress in this worker, keyed by output file; concurrent
+# requests for the same preview await the same future (single flight)
+_inflight: Dict[str, asyncio.Future] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+
+def source_kind(path: Path) -> Optional[str]:
+    ext = path.suffix.lower()
+    if ext in IMAGE_EXTENSIONS:
+        return "image" if Image is not None else None
+    if ext in PDF_EXTENSIONS:
+        return "pdf" if Image is not None and pypdfium2 is not None else None
+    return None
+
+def _file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def render_preview(source: str, dest: str, size: int, kind: str):
+    """Render a preview no larger than size x size (runs in a pool process)"""
+    if kind == "pdf":
+        document = pypdfium2.PdfDocument(source)
+        try:
+            page = document[0]
+            width, height = page.get_size()
+            image = page.render(scale=size / max(width, height, 1)).to_pil()
+        finally:
+            document.close()
+    else:
+        image = Image.open(source)
+        # JPEG decoders can downscale while decoding, far cheaper than a full decode
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+
+    image.thumbnail((size, size))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    # Write then rename, so readers (and other workers) never see a partial file
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    image.save(tmp_path, format=settings.PREVIEW_FORMAT, quality=settings.PREVIEW_QUALITY)
+    os.replace(tmp_path, dest)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.PREVIEW_WORKERS or None)
+    return _pool
+
+def preview_path(md5: str, size: int) -> Path:
+    return PREVIEWS_DIR / f"{md5}_{size}.{settings.PREVIEW_FORMAT.lower()}"
+
+async def get_preview(source: Path, size: int) -> Optional[Path]:
+    """Path of the cached preview for a source file, rendering it on first use.
+
+    Returns None when the file type has no renderer installed.
+    """
+    kind = source_kind(source)
+    if kind is None:
+        return None
+
+    md5 = _md5_cache.get(str(source))
+    if md5 is None:
+        md5 = await asyncio.to_thread(_file_md5, source)
+        _md5_cache.set(str(source), md5)
+
+    dest = preview_path(md5, size)
+    if dest.exists():
+        return dest
+
+    key = str(dest)
+    future = _inflight.get(key)
+    if future is None:
+        PREVIEWS_DIR.mkdir(parents=True, exist_ok=True)
+        future = asyncio.get_running_loop().run_in_executor(
+            _get_pool(), render_preview, str(source), key, size, kind
+        )
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    # shield: a cancelled request must not cancel the render others wait on
+    await asyncio.shield(future)
+    return dest
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
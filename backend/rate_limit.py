@@ -0,0 +1,321 @@
+import asyncio
+import ipaddress
+import json
+import math
+import sqlite3
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from config import settings
+import sessions
+
+@dataclass(frozen=True)
+class Rule:
+    """Token bucket: `capacity` requests at once, refilled at `rate` per second.
+
+    With block_seconds set, emptying the bucket blocks the key for that long
+    (the login rule: a handful of attempts, then a cool-down).
+    """
+    name: str
+    capacity: float
+    rate: float
+    block_seconds: float = 0
+
+def take(state: Optional[Tuple[float, float, float]], rule: Rule, now: float) -> Tuple[Tuple[float, float, float], float]:
+    """Spend one token. Returns the new (tokens, updated_at, blocked_until)
+    state and the seconds to wait (0 when the request is allowed)."""
+    tokens, updated_at, blocked_until = state or (rule.capacity, now, 0.0)
+    if blocked_until > now:
+        return (tokens, updated_at, blocked_until), blocked_until - now
+
+    tokens = min(rule.capacity, tokens + (now - updated_at) * rule.rate)
+    if tokens >= 1:
+        return (tokens - 1, now, 0.0), 0.0
+    if rule.block_seconds:
+        return (tokens, now, now + rule.block_seconds), rule.block_seconds
+    return (tokens, now, 0.0), (1 - tokens) / rule.rate
+
+class MemoryStore:
+    """Buckets of this worker only (limits are per worker process)"""
+
+    PRUNE_INTERVAL_SECONDS = 60
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = Lock()
+        self._pruned_at = time.time()
+
+    def hit(self, key: str, rule: Rule, now: float) -> float:
+        with self._lock:
+            state, wait = take(self._buckets.get(key), rule, now)
+            self._buckets[key] = state
+            if now - self._pruned_at > self.PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+        return wait
+
+    def refund(self, key: str, rule: Rule, now: float):
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is not None and state[2] <= now:
+                self._buckets[key] = (min(rule.capacity, state[0] + 1), state[1], state[2])
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket
+        self._pruned_at = now
+        for key, (tokens, updated_at, blocked_until) in list(self._buckets.items()):
+            if blocked_until <= now and now - updated_at > 3600:
+                del self._buckets[key]
+
+class SQLiteStore:
+    """Buckets in a local SQLite file shared by all workers on the host.
+
+    A stand-in for a shared key-value store: each hit is one short
+    BEGIN IMMEDIATE transaction, so concurrent workers never double-spend.
+    """
+
+    PRUNE_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            )
+            """
+        )
+        self._lock = Lock()
+        self._pruned_at = time.time()
+
+    def hit(self, key: str, rule: Rule, now: float) -> float:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                state, wait = take(row, rule, now)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+                    (key, *state)
+                )
+                if now - self._pruned_at > self.PRUNE_INTERVAL_SECONDS:
+                    self._pruned_at = now
+                    self._conn.execute(
+                        "DELETE FROM buckets WHERE blocked_until <= ? AND updated_at < ?", (now, now - 3600)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def refund(self, key: str, rule: Rule, now: float):
+        """Give back the token of a request that should not have counted"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE buckets SET tokens = MIN(?, tokens + 1) WHERE key = ? AND blocked_until <= ?",
+                (rule.capacity, key, now)
+            )
+
+def default_rules() -> Dict[str, Rule]:
+    per_minute = settings.RATE_LIMIT_API_PER_MINUTE
+    return {
+        "api": Rule("api", settings.RATE_LIMIT_API_BURST, per_minute / 60),
+        "ip": Rule("ip", settings.RATE_LIMIT_IP_PER_MINUTE, settings.RATE_LIMIT_IP_PER_MINUTE / 60),
+        "login": Rule(
+            "login",
+            settings.RATE_LIMIT_LOGIN_ATTEMPTS,
+            settings.RATE_LIMIT_LOGIN_ATTEMPTS / settings.RATE_LIMIT_LOGIN_WINDOW_SECONDS,
+            settings.RATE_LIMIT_LOGIN_BLOCK_SECONDS
+        ),
+    }
+
+def client_ip(scope) -> str:
+    if settings.RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _is_private(ip: str) -> bool:
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback
+
+def login_username(body: bytes) -> str:
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return ""
+    username = data.get("username") if isinstance(data, dict) else None
+    return str(username or "").strip().lower()[:128]
+
+class RateLimitMiddleware:
+    """Per-client request limits, checked before the request reaches a route.
+
+    - auth.login: a few failed attempts per IP and username per window,
+      then a block (successful logins give their token back)
+    - other /api routes: a bucket per user (or session token / IP when the
+      session is not known yet) plus a looser bucket per IP
+    - over the limit: 429 with Retry-After, without touching ClickHouse
+
+    Buckets live in this worker's memory, or in RATE_LIMIT_SHARED_PATH
+    (SQLite) so all workers on a host enforce one limit.
+    """
+
+    LOGIN_PATH = "/api/auth/login"
+    # Login bodies are buffered to read the username; a real one is well under this
+    LOGIN_MAX_BODY_BYTES = 4096
+
+    def __init__(self, app):
+        self.app = app
+        self.rules = default_rules()
+        self.store = SQLiteStore(settings.RATE_LIMIT_SHARED_PATH) if settings.RATE_LIMIT_SHARED_PATH else MemoryStore()
+        self._proxy_warned = False
+
+    def checks(self, scope, username: str = "") -> List[Tuple[Rule, str]]:
+        path = scope["path"]
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not path.startswith("/api/"):
+            return []
+
+        ip = client_ip(scope)
+        if path == self.LOGIN_PATH:
+            return [(self.rules["ip"], f"ip-total:{ip}"), (self.rules["login"], f"login:{ip}:{username}")]
+
+        token = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-session-token":
+                token = value.decode("latin-1")
+                break
+        user_id = sessions.cached_user_id(token)
+        if user_id is not None:
+            key = f"user:{user_id}"
+        elif token:
+            key = f"session:{token}"
+        else:
+            key = f"ip:{ip}"
+        return [(self.rules["ip"], f"ip-total:{ip}"), (self.rules["api"], key)]
+
+    async def hit(self, rule: Rule, key: str) -> float:
+        now = time.time()
+        if isinstance(self.store, SQLiteStore):
+            # File locking may wait on other workers; keep it off the event loop
+            return await asyncio.to_thread(self.store.hit, key, rule, now)
+        return self.store.hit(key, rule, now)
+
+    async def refund(self, rule: Rule, key: str):
+        try:
+            if isinstance(self.store, SQLiteStore):
+                await asyncio.to_thread(self.store.refund, key, rule, time.time())
+            else:
+                self.store.refund(key, rule, time.time())
+        except Exception as e:
+            print(f"Rate limit refund failed: {e}")
+
+    def warn_untrusted_proxy(self, scope):
+        """Behind a proxy without RATE_LIMIT_TRUST_FORWARDED every client shares the proxy's buckets"""
+        if self._proxy_warned or settings.RATE_LIMIT_TRUST_FORWARDED:
+            return
+        client = scope.get("client")
+        if not client or not _is_private(client[0]):
+            return
+        if any(name in (b"x-forwarded-for", b"x-real-ip") for name, _ in scope.get("headers", [])):
+            self._proxy_warned = True
+            print(
+                f"⚠ Rate limiting: requests arrive through a proxy at {client[0]} but forwarded headers "
+                "are not trusted, so all clients share its limits. Set RATE_LIMIT_TRUST_FORWARDED=true."
+            )
+
+    async def __call__(self, scope, receive, send):
+        if not settings.RATE_LIMIT_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.warn_untrusted_proxy(scope)
+
+        username = ""
+        if scope["path"] == self.LOGIN_PATH and scope["method"] == "POST":
+            # The username is part of the login key; replay the buffered body to the route
+            for name, value in scope.get("headers", []):
+                if name == b"content-length" and (not value.isdigit() or int(value) > self.LOGIN_MAX_BODY_BYTES):
+                    await self.payload_too_large(send)
+                    return
+            body, more_body = b"", True
+            while more_body:
+                message = await receive()
+                if message["type"] != "http.request":
+                    break
+                body += message.get("body", b"")
+                more_body = message.get("more_body", False)
+                if len(body) > self.LOGIN_MAX_BODY_BYTES:
+                    # Chunked body without Content-Length
+                    await self.payload_too_large(send)
+                    return
+            username = login_username(body)
+            replayed = False
+
+            async def receive():
+                nonlocal replayed
+                if replayed:
+                    return {"type": "http.disconnect"}
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+        wait = 0.0
+        login_check = None
+        for rule, key in self.checks(scope, username):
+            bucket = f"{rule.name}|{key}"
+            if rule.name == "login":
+                login_check = (rule, bucket)
+            try:
+                wait = max(wait, await self.hit(rule, bucket))
+            except Exception as e:
+                # A broken limiter store must not take the API down with it
+                print(f"Rate limit check failed: {e}")
+
+        if wait > 0:
+            await self.too_many_requests(send, wait)
+            return
+
+        if login_check is not None:
+            # Only failed attempts count towards the login limit
+            original_send = send
+
+            async def send(message):
+                if message["type"] == "http.response.start" and 200 <= message["status"] < 300:
+                    await self.refund(*login_check)
+                await original_send(message)
+
+        await self.app(scope, receive, send)
+
+    async def too_many_requests(self, send, wait: float):
+        await self.error_response(
+            send, 429, "تم تجاوز الحد الأقصى للطلبات، حاول لاحقاً",
+            [(b"retry-after", str(math.ceil(wait)).encode("latin-1"))]
+        )
+
+    async def payload_too_large(self, send):
+        await self.error_response(send, 413, "حجم الطلب كبير جداً")
+
+    async def error_response(self, send, status: int, detail: str, headers: Optional[list] = None):
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                *(headers or []),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
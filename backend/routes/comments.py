@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Response, Query
 from typing import Optional, List
 from pydantic import BaseModel
 import uuid
+import time
+from datetime import datetime
 from database import get_client
+from sessions import get_session_user_id
+import notification_fanout
+from routes.correspondences import counts_cache
 
 router = APIRouter(prefix="/comments", tags=["Comments"])
 
@@ -17,12 +22,169 @@ class CommentCreate(BaseModel):
 class CommentUpdate(BaseModel):
     comment: str
 
+COMMENT_COLUMNS = """
+    id, correspondence_id, user_id, comment, is_internal, parent_comment_id,
+    mentioned_users, attachments, is_edited, created_at, updated_at
+"""
+
+def row_to_comment(row) -> dict:
+    return {
+        "id": row[0],
+        "correspondence_id": row[1],
+        "user_id": row[2],
+        "comment": row[3],
+        "is_internal": row[4] == 1,
+        "parent_comment_id": row[5],
+        "mentioned_users": row[6] if row[6] else [],
+        "attachments": row[7] if row[7] else [],
+        "is_edited": row[8] == 1,
+        "created_at": row[9],
+        "updated_at": row[10]
+    }
+
+# Comments are versioned (ReplacingMergeTree keyed by id): edits and deletes
+# append a row with a higher version, so reads use FINAL and skip tombstones.
+# Replies to a deleted comment are shown as top-level threads.
+
+def fetch_skeleton(client, correspondence_id: str) -> list:
+    """(id, parent_comment_id) of every live comment, oldest first, without bodies"""
+    result = client.query(
+        """
+        SELECT id, parent_comment_id
+        FROM correspondence_comments FINAL
+        WHERE correspondence_id = %(correspondence_id)s AND is_deleted = 0
+        ORDER BY created_at ASC, id ASC
+        """,
+        parameters={"correspondence_id": correspondence_id}
+    )
+    return result.result_rows
+
+def fetch_bodies(client, correspondence_id: str, comment_ids: list) -> dict:
+    """Full rows for just the comments being returned"""
+    if not comment_ids:
+        return {}
+    result = client.query(
+        f"""
+        SELECT {COMMENT_COLUMNS}
+        FROM correspondence_comments FINAL
+        WHERE correspondence_id = %(correspondence_id)s AND id IN %(ids)s AND is_deleted = 0
+        """,
+        parameters={"correspondence_id": correspondence_id, "ids": comment_ids}
+    )
+    return {row[0]: row_to_comment(row) for row in result.result_rows}
+
+def fetch_latest_version(client, comment_id: str) -> Optional[dict]:
+    """Latest version of a single comment, or None if missing or deleted"""
+    result = client.query(
+        f"""
+        SELECT {COMMENT_COLUMNS}, is_deleted
+        FROM correspondence_comments
+        WHERE id = %(id)s
+        ORDER BY version DESC
+        LIMIT 1
+        """,
+        parameters={"id": comment_id}
+    )
+    if not result.result_rows or result.result_rows[0][11] == 1:
+        return None
+    return row_to_comment(result.result_rows[0])
+
+def append_version(client, comment: dict, is_deleted: bool = False):
+    """Write a new version of a comment (a single INSERT, no mutation)"""
+    client.insert(
+        "correspondence_comments",
+        [[
+            comment["id"],
+            comment["correspondence_id"],
+            comment["user_id"],
+            comment["comment"],
+            1 if comment["is_internal"] else 0,
+            comment["parent_comment_id"],
+            comment["mentioned_users"],
+            comment["attachments"],
+            1 if comment["is_edited"] else 0,
+            comment["created_at"],
+            comment["updated_at"],
+            time.time_ns(),
+            1 if is_deleted else 0
+        ]],
+        column_names=[
+            "id", "correspondence_id", "user_id", "comment", "is_internal",
+            "parent_comment_id", "mentioned_users", "attachments", "is_edited",
+            "created_at", "updated_at", "version", "is_deleted"
+        ]
+    )
+
+def get_own_comment(client, comment_id: str, user_id: int) -> dict:
+    """Load the latest version of a comment the current user may modify"""
+    comment = fetch_latest_version(client, comment_id)
+    if comment is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Comment not found"
+        )
+    if comment["user_id"] != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the author can modify this comment"
+        )
+    return comment
+
+def build_thread_index(skeleton: list):
+    """Single pass over the skeleton: top-level ids in order and children per parent.
+    
+    Replies whose parent is missing are treated as top-level so they stay visible.
+    """
+    known_ids = {comment_id for comment_id, _ in skeleton}
+    roots = []
+    children = {}
+    for comment_id, parent_id in skeleton:
+        if parent_id and parent_id in known_ids and parent_id != comment_id:
+            children.setdefault(parent_id, []).append(comment_id)
+        else:
+            roots.append(comment_id)
+    return roots, children
+
+def select_subtrees(root_ids: list, children: dict, depth: int) -> list:
+    """Ids of the given roots and their replies down to `depth` levels"""
+    selected = []
+    level = list(root_ids)
+    for _ in range(depth + 1):
+        if not level:
+            break
+        selected.extend(level)
+        level = [child for comment_id in level for child in children.get(comment_id, [])]
+    return selected
+
+def assemble(comment_id: str, bodies: dict, children: dict, depth: int) -> dict:
+    """Nested node; replies beyond `depth` are left for lazy loading"""
+    node = dict(bodies[comment_id])
+    replies = children.get(comment_id, [])
+    node["reply_count"] = len(replies)
+    if depth > 0:
+        node["replies"] = [assemble(reply_id, bodies, children, depth - 1) for reply_id in replies if reply_id in bodies]
+        node["has_more_replies"] = False
+    else:
+        node["replies"] = []
+        node["has_more_replies"] = len(replies) > 0
+    return node
+
 @router.get("/correspondence/{correspondence_id}")
 async def list_comments(
     correspondence_id: str,
-    x_session_token: Optional[str] = Header(None)
+    response: Response,
+    x_session_token: Optional[str] = Header(None),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    depth: int = Query(3, ge=0, le=10)
 ):
-    """List all comments for a correspondence"""
+    """List comment threads for a correspondence.
+    
+    Returns top-level comments (oldest first) with their replies nested up
+    to `depth` levels. Pass the X-Next-Cursor header as ?cursor= for the
+    next page of threads, and load deeper replies from
+    /comments/correspondence/{id}/replies/{comment_id}.
+    """
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,34 +194,27 @@ async def list_comments(
     client = get_client()
     
     try:
-        result = client.query(
-            """
-            SELECT *
-            FROM correspondence_comments
-            WHERE correspondence_id = %(correspondence_id)s
-            ORDER BY created_at ASC
-            """,
-            parameters={"correspondence_id": correspondence_id}
-        )
+        roots, children = build_thread_index(fetch_skeleton(client, correspondence_id))
+        
+        start = 0
+        if cursor:
+            if cursor not in roots:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid cursor"
+                )
+            start = roots.index(cursor) + 1
+        
+        page = roots[start:start + limit]
+        if start + limit < len(roots):
+            response.headers["X-Next-Cursor"] = page[-1]
         
-        comments = []
-        for row in result.result_rows:
-            comments.append({
-                "id": row[0],
-                "correspondence_id": row[1],
-                "user_id": row[2],
-                "comment": row[3],
-                "is_internal": row[4] == 1,
-                "parent_comment_id": row[5],
-                "mentioned_users": row[6] if row[6] else [],
-                "attachments": row[7] if row[7] else [],
-                "is_edited": row[8] == 1,
-                "created_at": row[9],
-                "updated_at": row[10]
-            })
-        
-        return comments
+        bodies = fetch_bodies(client, correspondence_id, select_subtrees(page, children, depth))
         
+        return [assemble(comment_id, bodies, children, depth) for comment_id in page if comment_id in bodies]
+        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"List comments error: {e}")
         raise HTTPException(
@@ -67,6 +222,37 @@ async def list_comments(
             detail="Failed to fetch comments"
         )
 
+@router.get("/correspondence/{correspondence_id}/replies/{comment_id}")
+async def list_replies(
+    correspondence_id: str,
+    comment_id: str,
+    x_session_token: Optional[str] = Header(None),
+    depth: int = Query(3, ge=1, le=10)
+):
+    """Lazy-load the replies under a comment"""
+    if not x_session_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required"
+        )
+    
+    client = get_client()
+    
+    try:
+        _, children = build_thread_index(fetch_skeleton(client, correspondence_id))
+        
+        reply_ids = children.get(comment_id, [])
+        bodies = fetch_bodies(client, correspondence_id, select_subtrees(reply_ids, children, depth - 1))
+        
+        return [assemble(reply_id, bodies, children, depth - 1) for reply_id in reply_ids if reply_id in bodies]
+        
+    except Exception as e:
+        print(f"List replies error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch replies"
+        )
+
 @router.post("")
 async def create_comment(
     comment_data: CommentCreate,
@@ -82,49 +268,40 @@ async def create_comment(
     client = get_client()
     
     try:
-        # Get user_id from session
-        session_result = client.query(
-            """
-            SELECT user_id
-            FROM sessions
-            WHERE token = %(token)s AND expires_at > now()
-            LIMIT 1
-            """,
-            parameters={"token": x_session_token}
-        )
+        user_id = get_session_user_id(client, x_session_token)
+        comment_id = str(uuid.uuid4())
         
-        if not session_result.result_rows:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid session"
-            )
+        # Same insert path as edits and deletes, so every version of a comment
+        # is stamped by the API host's clock and later versions always win
+        now = datetime.utcnow().replace(microsecond=0)
+        append_version(client, {
+            "id": comment_id,
+            "correspondence_id": comment_data.correspondence_id,
+            "user_id": user_id,
+            "comment": comment_data.comment,
+            "is_internal": comment_data.is_internal,
+            "parent_comment_id": comment_data.parent_comment_id,
+            "mentioned_users": comment_data.mentioned_users,
+            "attachments": comment_data.attachments,
+            "is_edited": False,
+            "created_at": now,
+            "updated_at": now
+        })
         
-        user_id = session_result.result_rows[0][0]
-        comment_id = str(uuid.uuid4())
+        counts_cache.invalidate(comment_data.correspondence_id)
         
-        client.command(
-            """
-            INSERT INTO correspondence_comments (
-                id, correspondence_id, user_id, comment, is_internal,
-                parent_comment_id, mentioned_users, attachments,
-                created_at, updated_at
-            ) VALUES (
-                %(id)s, %(correspondence_id)s, %(user_id)s, %(comment)s, %(is_internal)s,
-                %(parent_comment_id)s, %(mentioned_users)s, %(attachments)s,
-                now(), now()
+        if comment_data.mentioned_users:
+            await notification_fanout.enqueue(
+                type="mention",
+                title="تمت الإشارة إليك في تعليق",
+                message=comment_data.comment[:200],
+                user_ids=comment_data.mentioned_users,
+                exclude_user_id=user_id,
+                correspondence_id=comment_data.correspondence_id,
+                related_entity_type="comment",
+                related_entity_id=comment_id,
+                action_url=f"/correspondence/{comment_data.correspondence_id}"
             )
-            """,
-            parameters={
-                "id": comment_id,
-                "correspondence_id": comment_data.correspondence_id,
-                "user_id": user_id,
-                "comment": comment_data.comment,
-                "is_internal": 1 if comment_data.is_internal else 0,
-                "parent_comment_id": comment_data.parent_comment_id,
-                "mentioned_users": comment_data.mentioned_users,
-                "attachments": comment_data.attachments
-            }
-        )
         
         return {"id": comment_id, "message": "Comment created successfully"}
         
@@ -143,31 +320,65 @@ async def update_comment(
     comment_update: CommentUpdate,
     x_session_token: Optional[str] = Header(None)
 ):
-    """Update a comment"""
+    """Update a comment (appends a new version)"""
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication required"
         )
     
-    # Note: ClickHouse doesn't support UPDATE in traditional way
-    # You may need to implement this using ALTER TABLE UPDATE or mutations
+    client = get_client()
     
-    return {"message": "Comment update not fully implemented for ClickHouse"}
+    try:
+        user_id = get_session_user_id(client, x_session_token)
+        comment = get_own_comment(client, comment_id, user_id)
+        
+        comment["comment"] = comment_update.comment
+        comment["is_edited"] = True
+        comment["updated_at"] = datetime.utcnow().replace(microsecond=0)
+        append_version(client, comment)
+        counts_cache.invalidate(comment["correspondence_id"])
+        
+        return {"id": comment_id, "message": "Comment updated successfully"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Update comment error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update comment"
+        )
 
 @router.delete("/{comment_id}")
 async def delete_comment(
     comment_id: str,
     x_session_token: Optional[str] = Header(None)
 ):
-    """Delete a comment"""
+    """Delete a comment (appends a tombstone version)"""
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication required"
         )
     
-    # Note: ClickHouse doesn't support DELETE in traditional way
-    # You may need to implement this using ALTER TABLE DELETE or mutations
+    client = get_client()
     
-    return {"message": "Comment deletion not fully implemented for ClickHouse"}
+    try:
+        user_id = get_session_user_id(client, x_session_token)
+        comment = get_own_comment(client, comment_id, user_id)
+        
+        comment["updated_at"] = datetime.utcnow().replace(microsecond=0)
+        append_version(client, comment, is_deleted=True)
+        counts_cache.invalidate(comment["correspondence_id"])
+        
+        return {"id": comment_id, "message": "Comment deleted successfully"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Delete comment error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete comment"
+        )
@@ -1,17 +1,72 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Header, Response, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
 from database import get_client
-from models import CorrespondenceCreate
+from models import CorrespondenceCreate, CorrespondenceCountsRequest
+from config import settings
+from sessions import get_session_user_id
+from routes.notifications import READ_STATE_SQL
+from ttl_cache import TTLCache
+import http_cache
+import notification_fanout
+import entity_directory
+import pdf_renderer
+import zip_export
+import audit_log
 import uuid
 from datetime import datetime
 
 router = APIRouter(prefix="/correspondences", tags=["Correspondences"])
 
+LIST_CACHE_KEY = "correspondences:list"
+
+def record_cache_key(correspondence_id: str) -> str:
+    return f"correspondences:{correspondence_id}"
+
+# Editable columns read before an update, so the audit log can keep only what changed
+AUDITED_FIELDS = """
+    number, type, subject, from_entity, received_by_entity, content, greeting,
+    responsible_person, signature_url, notes, attachments
+"""
+
+# Per-correspondence comment/attachment counts for list badges
+counts_cache = TTLCache(settings.COUNTS_CACHE_TTL_SECONDS)
+
+def resolve_entity_id(client, entity_name: Optional[str]) -> str:
+    """Entity id for a stored entity name ('' when it is not a known entity)"""
+    if not entity_name:
+        return ''
+    entity = entity_directory.get_entity_by_name(client, entity_name)
+    return entity["id"] if entity else ''
+
 @router.get("")
-async def list_correspondences():
+async def list_correspondences(
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
     """List all correspondences"""
+    # Idle polling: answer from the known version token without touching ClickHouse
+    cached_etag = http_cache.get_token(LIST_CACHE_KEY)
+    if http_cache.etag_matches(if_none_match, cached_etag):
+        return http_cache.not_modified(cached_etag)
+    
     client = get_client()
     
     try:
+        # Cheap version probe: any insert changes count(), any update bumps max(updated_at)
+        version = client.query(
+            """
+            SELECT max(updated_at), count()
+            FROM correspondences
+            """
+        )
+        max_updated_at, total = version.result_rows[0] if version.result_rows else (None, 0)
+        etag = http_cache.make_etag("list", max_updated_at, total)
+        http_cache.set_token(LIST_CACHE_KEY, etag)
+        
+        if http_cache.etag_matches(if_none_match, etag):
+            return http_cache.not_modified(etag)
+        
         result = client.query(
             f"""
             SELECT 
@@ -57,6 +112,7 @@ async def list_correspondences():
                 "status": row[23] if len(row) > 23 else 'sent'  # status
             })
         
+        http_cache.set_cache_headers(response, etag)
         return correspondences
         
     except Exception as e:
@@ -66,9 +122,136 @@ async def list_correspondences():
             detail="Failed to fetch correspondences"
         )
 
+@router.post("/batch-counts")
+async def get_batch_counts(
+    request: CorrespondenceCountsRequest,
+    x_session_token: Optional[str] = Header(None)
+):
+    """Comment counts, last comment time, attachment counts and unread
+    notifications for many correspondences in one call (list screen badges)"""
+    ids = list(dict.fromkeys(request.ids))
+    if len(ids) > settings.COUNTS_BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.COUNTS_BATCH_MAX_IDS} ids per request"
+        )
+    
+    client = get_client()
+    
+    try:
+        user_id = get_session_user_id(client, x_session_token)
+        
+        counts = counts_cache.get_many(ids)
+        missing = [correspondence_id for correspondence_id in ids if correspondence_id not in counts]
+        
+        if missing:
+            result = client.query(
+                """
+                SELECT c.id, length(c.attachments), cm.comment_count, cm.last_comment_at
+                FROM correspondences AS c
+                LEFT JOIN (
+                    SELECT correspondence_id, count() AS comment_count, max(created_at) AS last_comment_at
+                    FROM correspondence_comments FINAL
+                    WHERE correspondence_id IN %(ids)s AND is_deleted = 0
+                    GROUP BY correspondence_id
+                ) AS cm ON cm.correspondence_id = c.id
+                WHERE c.id IN %(ids)s
+                """,
+                parameters={"ids": missing}
+            )
+            
+            fetched = {
+                row[0]: {
+                    "attachment_count": row[1],
+                    "comment_count": row[2],
+                    "last_comment_at": row[3] if row[2] else None
+                }
+                for row in result.result_rows
+            }
+            counts_cache.set_many(fetched)
+            counts.update(fetched)
+        
+        # Unread state is per user, so it is not cached
+        unread_result = client.query(
+            f"""
+            SELECT correspondence_id, countIf(NOT is_read)
+            FROM ({READ_STATE_SQL} AND n.correspondence_id IN %(ids)s)
+            GROUP BY correspondence_id
+            """,
+            parameters={"user_id": user_id, "ids": ids}
+        )
+        unread = {row[0]: row[1] for row in unread_result.result_rows}
+        
+        return {
+            correspondence_id: {**counts[correspondence_id], "unread_notifications": unread.get(correspondence_id, 0)}
+            for correspondence_id in ids if correspondence_id in counts
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Batch counts error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch counts"
+        )
+
+@router.get("/export")
+async def export_correspondences(
+    date_from: datetime,
+    date_to: datetime,
+    x_session_token: Optional[str] = Header(None)
+):
+    """Download correspondences dated in [date_from, date_to) as a ZIP.
+    
+    The archive is generated while it is sent: no temp file, constant memory,
+    ZIP64 entries so multi-GB exports work.
+    """
+    if date_to <= date_from:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date_to must be after date_from"
+        )
+    if (date_to - date_from).days > settings.EXPORT_MAX_RANGE_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.EXPORT_MAX_RANGE_DAYS} days per export"
+        )
+    
+    client = get_client()
+    
+    try:
+        get_session_user_id(client, x_session_token)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Export correspondences error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to export correspondences"
+        )
+    
+    # Sync generator: Starlette pulls each chunk in the threadpool, so file
+    # reads and batch queries never block the event loop
+    filename = f"correspondences_{date_from:%Y%m%d}_{date_to:%Y%m%d}.zip"
+    return StreamingResponse(
+        zip_export.stream_export(client, date_from, date_to),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.get("/{correspondence_id}")
-async def get_correspondence(correspondence_id: str):
+async def get_correspondence(
+    correspondence_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
     """Get a single correspondence by ID"""
+    cached_etag = http_cache.get_token(record_cache_key(correspondence_id))
+    if http_cache.etag_matches(if_none_match, cached_etag):
+        return http_cache.not_modified(cached_etag)
+    
     client = get_client()
     
     try:
@@ -96,6 +279,13 @@ async def get_correspondence(correspondence_id: str):
         
         row = result.result_rows[0]
         
+        # Every write, including the one filling pdf_url, bumps updated_at
+        etag = http_cache.make_etag(row[0], row[12])
+        http_cache.set_token(record_cache_key(correspondence_id), etag)
+        if http_cache.etag_matches(if_none_match, etag):
+            return http_cache.not_modified(etag)
+        
+        http_cache.set_cache_headers(response, etag)
         return {
             "id": row[0],                        # id
             "number": row[1],                    # number
@@ -133,8 +323,74 @@ async def get_correspondence(correspondence_id: str):
             detail="Failed to fetch correspondence"
         )
 
+@router.post("/{correspondence_id}/generate-pdf")
+async def generate_correspondence_pdf(correspondence_id: str):
+    """Render the correspondence as a PDF and store its URL in pdf_url.
+    
+    Output is cached per rendered content: regenerating an unchanged
+    correspondence returns the existing file without rendering.
+    """
+    if not pdf_renderer.available():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="PDF rendering is not configured"
+        )
+    
+    client = get_client()
+    
+    try:
+        result = client.query(
+            """
+            SELECT 
+                id, number, type, subject, content, from_entity, date,
+                greeting, responsible_person, signature_url, display_type,
+                attachments, updated_at, pdf_url
+            FROM correspondences
+            WHERE id = %(id)s
+            LIMIT 1
+            """,
+            parameters={"id": correspondence_id}
+        )
+        
+        if not result.result_rows:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Correspondence not found"
+            )
+        
+        data = dict(zip(result.column_names, result.result_rows[0]))
+        pdf_url = await pdf_renderer.get_pdf(data)
+        
+        if data["pdf_url"] != pdf_url:
+            client.command(
+                """
+                ALTER TABLE correspondences
+                UPDATE pdf_url = %(pdf_url)s, updated_at = now()
+                WHERE id = %(id)s
+                """,
+                parameters={"pdf_url": pdf_url, "id": correspondence_id}
+            )
+            # updated_at moves the list ETag so pollers see the new pdf_url
+            http_cache.invalidate(record_cache_key(correspondence_id), LIST_CACHE_KEY)
+        
+        return {
+            "success": True,
+            "pdfUrl": pdf_url,
+            "pdf_url": pdf_url,
+            "message": "PDF generated successfully"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Generate PDF error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to generate PDF"
+        )
+
 @router.put("/update/{correspondence_id}")
-async def update_correspondence(correspondence_id: str, data: dict):
+async def update_correspondence(correspondence_id: str, data: dict, request: Request):
     """Update an existing correspondence"""
     client = get_client()
     
@@ -142,10 +398,11 @@ async def update_correspondence(correspondence_id: str, data: dict):
         now = datetime.utcnow()
         
         # Fetch current state to enforce locking rules for display_type
+        # (the editable fields come along for the audit diff)
         try:
             current = client.query(
                 f"""
-                SELECT display_type, archived, status
+                SELECT display_type, archived, status, {AUDITED_FIELDS}
                 FROM correspondences
                 WHERE id = %(id)s
                 LIMIT 1
@@ -195,7 +452,7 @@ async def update_correspondence(correspondence_id: str, data: dict):
             'status': 'status',
             'archived': 'archived'
         }
-        
+
         def format_value(value):
             """Format value for ClickHouse query"""
             if value is None:
@@ -221,6 +478,11 @@ async def update_correspondence(correspondence_id: str, data: dict):
                 formatted_value = format_value(value)
                 update_fields.append(f"{db_field} = {formatted_value}")
         
+        # Keep the entity ids in step with the names they were resolved from
+        for name_key, id_field in (('from_entity', 'from_entity_id'), ('received_by_entity', 'received_by_entity_id')):
+            if name_key in data:
+                update_fields.append(f"{id_field} = {format_value(resolve_entity_id(client, data[name_key]))}")
+        
         if 'attachments' in data:
             formatted_attachments = format_value(data['attachments'])
             update_fields.append(f"attachments = {formatted_attachments}")
@@ -243,6 +505,17 @@ async def update_correspondence(correspondence_id: str, data: dict):
         print(f"Executing update query: {query}")
         client.command(query)
         
+        http_cache.invalidate(record_cache_key(correspondence_id), LIST_CACHE_KEY)
+        counts_cache.invalidate(correspondence_id)
+        
+        previous = dict(zip(current.column_names, current.result_rows[0]))
+        audit_log.record(
+            "update", "correspondence", correspondence_id,
+            old=previous,
+            new={key: data[key] for key in previous if key in data},
+            request=request
+        )
+        
         return {
             "id": correspondence_id,
             "message": "Correspondence updated successfully"
@@ -256,7 +529,7 @@ async def update_correspondence(correspondence_id: str, data: dict):
         )
 
 @router.post("/create")
-async def create_correspondence(data: dict):
+async def create_correspondence(data: dict, request: Request):
     """Create a new correspondence"""
     client = get_client()
     
@@ -279,43 +552,66 @@ async def create_correspondence(data: dict):
             )
         
         # Insert into ClickHouse
-        client.insert(
-            'correspondences',
-            [[
-                correspondence_id,
-                data.get('number'),
-                data.get('type'),
-                data.get('subject'),
-                data.get('from_entity'),
-                data.get('received_by_entity', ''),
-                date_value,
-                data.get('content', ''),
-                data.get('greeting', 'السيد/'),
-                data.get('responsible_person', ''),
-                data.get('signature_url', ''),
-                data.get('display_type', 'content'),
-                data.get('attachments', []),
-                data.get('notes', ''),
-                data.get('received_by', 0),
-                data.get('received_at'),
-                data.get('created_by'),
-                now,
-                now,
-                1 if data.get('archived', False) else 0,
-                data.get('pdf_url', ''),
-                data.get('external_doc_id', ''),
-                data.get('external_connection_id', ''),
-                data.get('status', 'draft')
-            ]],
-            column_names=[
-                'id', 'number', 'type', 'subject', 'from_entity', 'received_by_entity',
-                'date', 'content', 'greeting', 'responsible_person', 'signature_url',
-                'display_type', 'attachments', 'notes', 'received_by', 'received_at',
-                'created_by', 'created_at', 'updated_at', 'archived', 'pdf_url',
-                'external_doc_id', 'external_connection_id', 'status'
-            ]
+        row = [
+            correspondence_id,
+            data.get('number'),
+            data.get('type'),
+            data.get('subject'),
+            data.get('from_entity'),
+            data.get('received_by_entity', ''),
+            date_value,
+            data.get('content', ''),
+            data.get('greeting', 'السيد/'),
+            data.get('responsible_person', ''),
+            data.get('signature_url', ''),
+            data.get('display_type', 'content'),
+            data.get('attachments', []),
+            data.get('notes', ''),
+            data.get('received_by', 0),
+            data.get('received_at'),
+            data.get('created_by'),
+            now,
+            now,
+            1 if data.get('archived', False) else 0,
+            data.get('pdf_url', ''),
+            data.get('external_doc_id', ''),
+            data.get('external_connection_id', ''),
+            data.get('status', 'draft'),
+            resolve_entity_id(client, data.get('from_entity')),
+            resolve_entity_id(client, data.get('received_by_entity'))
+        ]
+        column_names = [
+            'id', 'number', 'type', 'subject', 'from_entity', 'received_by_entity',
+            'date', 'content', 'greeting', 'responsible_person', 'signature_url',
+            'display_type', 'attachments', 'notes', 'received_by', 'received_at',
+            'created_by', 'created_at', 'updated_at', 'archived', 'pdf_url',
+            'external_doc_id', 'external_connection_id', 'status',
+            'from_entity_id', 'received_by_entity_id'
+        ]
+        client.insert('correspondences', [row], column_names=column_names)
+        
+        http_cache.invalidate(LIST_CACHE_KEY)
+        audit_log.record(
+            "create", "correspondence", correspondence_id,
+            new=dict(zip(column_names, row)),
+            user_id=data.get('created_by'),
+            request=request
         )
         
+        # Notify every user of the receiving entity (batched in the background)
+        if data.get('received_by_entity'):
+            await notification_fanout.enqueue(
+                type="new_correspondence",
+                title="مراسلة جديدة",
+                message=f"{data.get('subject')} - {data.get('from_entity')}",
+                entity=data.get('received_by_entity'),
+                exclude_user_id=data.get('created_by'),
+                correspondence_id=correspondence_id,
+                related_entity_type="correspondence",
+                related_entity_id=correspondence_id,
+                action_url=f"/correspondence/{correspondence_id}"
+            )
+        
         return {
             "id": correspondence_id,
             "message": "Correspondence created successfully"
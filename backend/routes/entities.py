@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Response, Request
 from typing import Optional
 from database import get_client
 from pydantic import BaseModel
 import uuid
+import entity_directory
+import http_cache
+import audit_log
 
 router = APIRouter(prefix="/entities", tags=["Entities"])
 
@@ -46,35 +49,27 @@ async def verify_admin_session(session_token: Optional[str]):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin or Moderator access required"
         )
+    
+    return result.result_rows[0][0]
 
 @router.get("")
-async def list_entities():
+async def list_entities(
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
     """List all entities"""
     client = get_client()
     
     try:
-        result = client.query(
-            """
-            SELECT DISTINCT id, name, type, created_at
-            FROM entities
-            ORDER BY name ASC
-            """
-        )
+        directory = entity_directory.get_directory(client)
         
-        entities = []
-        seen_ids = set()
-        for row in result.result_rows:
-            entity_id = row[0]
-            if entity_id not in seen_ids:
-                seen_ids.add(entity_id)
-                entities.append({
-                    "id": entity_id,
-                    "name": row[1],
-                    "type": row[2],
-                    "created_at": row[3]
-                })
+        etag = directory["etag"]
+        if etag:
+            if http_cache.etag_matches(if_none_match, etag):
+                return http_cache.not_modified(etag)
+            http_cache.set_cache_headers(response, etag)
         
-        return entities
+        return directory["entities"]
         
     except Exception as e:
         print(f"List entities error: {e}")
@@ -86,6 +81,7 @@ async def list_entities():
 @router.post("/create")
 async def create_entity(
     entity: EntityCreate,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Create a new entity (admin only)"""
@@ -93,7 +89,7 @@ async def create_entity(
     
     try:
         # Verify admin access
-        await verify_admin_session(x_session_token)
+        admin_user_id = await verify_admin_session(x_session_token)
         
         # Check if entity name already exists
         check_result = client.query(
@@ -127,6 +123,14 @@ async def create_entity(
             }
         )
         
+        entity_directory.invalidate(client)
+        audit_log.record(
+            "create", "entity", entity_id,
+            new={"name": entity.name, "type": entity.type},
+            user_id=admin_user_id,
+            request=request
+        )
+        
         return {"message": "تم إنشاء الجهة بنجاح", "id": entity_id}
         
     except HTTPException:
@@ -142,6 +146,7 @@ async def create_entity(
 async def update_entity(
     entity_id: str,
     entity: EntityUpdate,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Update an entity (admin only)"""
@@ -149,7 +154,7 @@ async def update_entity(
     
     try:
         # Verify admin access
-        await verify_admin_session(x_session_token)
+        admin_user_id = await verify_admin_session(x_session_token)
         
         # Check if entity exists
         check_result = client.query(
@@ -167,6 +172,8 @@ async def update_entity(
                 detail="Entity not found"
             )
         
+        previous = entity_directory.get_entity(client, entity_id)
+        
         # Update entity
         client.command(
             """
@@ -182,6 +189,15 @@ async def update_entity(
             }
         )
         
+        entity_directory.invalidate(client)
+        audit_log.record(
+            "update", "entity", entity_id,
+            old={"name": previous["name"], "type": previous["type"]} if previous else None,
+            new={"name": entity.name, "type": entity.type},
+            user_id=admin_user_id,
+            request=request
+        )
+        
         return {"message": "تم تحديث الجهة بنجاح"}
         
     except HTTPException:
@@ -196,6 +212,7 @@ async def update_entity(
 @router.delete("/delete/{entity_id}")
 async def delete_entity(
     entity_id: str,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Delete an entity (admin only)"""
@@ -203,7 +220,7 @@ async def delete_entity(
     
     try:
         # Verify admin access
-        await verify_admin_session(x_session_token)
+        admin_user_id = await verify_admin_session(x_session_token)
         
         # Check if entity is being used by users
         users_check = client.query(
@@ -221,6 +238,8 @@ async def delete_entity(
                 detail="لا يمكن حذف جهة مرتبطة بمستخدمين"
             )
         
+        previous = entity_directory.get_entity(client, entity_id)
+        
         # Delete entity
         client.command(
             """
@@ -229,6 +248,14 @@ async def delete_entity(
             parameters={"entity_id": entity_id}
         )
         
+        entity_directory.invalidate(client)
+        audit_log.record(
+            "delete", "entity", entity_id,
+            old={"name": previous["name"], "type": previous["type"]} if previous else {},
+            user_id=admin_user_id,
+            request=request
+        )
+        
         return {"message": "تم حذف الجهة بنجاح"}
         
     except HTTPException:
@@ -0,0 +1,104 @@
+from fastapi import APIRouter, HTTPException, status, Header
+from typing import Optional
+from database import get_client
+from models import ExternalSyncRequest, ExternalSyncStatusRequest
+from config import settings
+from sessions import get_session_user_id
+import asyncio
+import external_sync
+
+router = APIRouter(prefix="/external-sync", tags=["External Sync"])
+
+@router.post("/jobs")
+async def create_sync_jobs(
+    request: ExternalSyncRequest,
+    x_session_token: Optional[str] = Header(None)
+):
+    """Queue sends to an external system (one job per correspondence).
+    
+    Jobs are processed in the background; poll /external-sync/jobs/status
+    with the returned ids.
+    """
+    if not external_sync.available():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="External sync is not available on this server"
+        )
+    if request.action not in external_sync.ACTION_PATHS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown action: {request.action}"
+        )
+    if request.action == "export" and not request.correspondenceIds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="correspondenceIds is required for export"
+        )
+    if request.action != "export" and not request.data.get("externalDocId"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="data.externalDocId is required"
+        )
+    correspondence_ids = list(dict.fromkeys(request.correspondenceIds)) or [None]
+    if len(correspondence_ids) > settings.SYNC_MAX_JOBS_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.SYNC_MAX_JOBS_PER_REQUEST} correspondences per request"
+        )
+    
+    client = get_client()
+    
+    try:
+        user_id = get_session_user_id(client, x_session_token)
+        
+        job_ids = await external_sync.enqueue([
+            {
+                "connection_id": request.connectionId,
+                "action": request.action,
+                "correspondence_id": correspondence_id,
+                "data": request.data,
+                "created_by": user_id
+            }
+            for correspondence_id in correspondence_ids
+        ])
+        
+        return {"jobIds": job_ids}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Create sync jobs error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to queue sync jobs"
+        )
+
+@router.post("/jobs/status")
+async def get_sync_jobs_status(
+    request: ExternalSyncStatusRequest,
+    x_session_token: Optional[str] = Header(None)
+):
+    """State, attempts, last error and external doc id of queued sync jobs"""
+    if len(request.jobIds) > settings.SYNC_MAX_JOBS_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.SYNC_MAX_JOBS_PER_REQUEST} ids per request"
+        )
+    
+    client = get_client()
+    
+    try:
+        get_session_user_id(client, x_session_token)
+        
+        if not request.jobIds:
+            return []
+        return await asyncio.to_thread(external_sync.get_jobs, request.jobIds)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Sync jobs status error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch sync jobs"
+        )
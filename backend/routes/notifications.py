@@ -1,77 +1,153 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from pydantic import BaseModel
+from datetime import datetime
+import asyncio
+import time
 from database import get_client
+from config import settings
+import unread_counters
+from sessions import get_session_user_id
+import notification_hub
 
 router = APIRouter(prefix="/notifications", tags=["Notifications"])
 
 class NotificationUpdate(BaseModel):
     read: bool
 
+# Read state lives in notification_reads (append-only markers) instead of
+# mutating notifications. A per-notification marker newer than the user's
+# "read all" watermark wins; otherwise a notification is read if it was
+# created before the watermark (or has the legacy read flag set).
+# The created_at bound matches the retention TTL and lets ClickHouse skip
+# expired monthly partitions before TTL merges have removed them.
+READ_STATE_SQL = f"""
+    WITH (
+        SELECT max(read_until)
+        FROM notification_reads
+        WHERE user_id = %(user_id)s AND notification_id = ''
+    ) AS read_until
+    SELECT
+        n.id, n.user_id, n.type, n.title, n.message, n.correspondence_id,
+        n.related_entity_type, n.related_entity_id, n.priority, n.action_url,
+        if(m.notification_id != '' AND m.marker_at >= read_until,
+           m.marker_read,
+           n.read = 1 OR n.created_at <= read_until) AS is_read,
+        multiIf(m.notification_id != '' AND m.marker_at >= read_until AND m.marker_read = 1, m.marker_at,
+                n.read = 1, n.read_at,
+                n.created_at <= read_until, read_until,
+                NULL) AS effective_read_at,
+        n.created_at
+    FROM notifications AS n
+    LEFT JOIN (
+        SELECT
+            notification_id,
+            argMax(read, version) AS marker_read,
+            max(read_at) AS marker_at
+        FROM notification_reads
+        WHERE user_id = %(user_id)s AND notification_id != ''
+        GROUP BY notification_id
+    ) AS m ON m.notification_id = n.id
+    WHERE n.user_id = %(user_id)s
+      AND n.created_at >= now() - INTERVAL {settings.NOTIFICATION_RETENTION_DAYS} DAY
+"""
+
+def insert_read_marker(client, user_id: int, notification_id: str, read: bool, read_until: Optional[datetime] = None):
+    """Append a read marker (a single-row INSERT, no mutation)"""
+    now = datetime.utcnow().replace(microsecond=0)
+    client.insert(
+        "notification_reads",
+        [[user_id, notification_id, 1 if read else 0, now, read_until or datetime.utcfromtimestamp(0), time.time_ns()]],
+        column_names=["user_id", "notification_id", "read", "read_at", "read_until", "version"]
+    )
+
+def row_to_notification(row) -> dict:
+    """Map a READ_STATE_SQL row to the API shape"""
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "type": row[2],
+        "title": row[3],
+        "message": row[4],
+        "correspondence_id": row[5],
+        "related_entity_type": row[6],
+        "related_entity_id": row[7],
+        "priority": row[8],
+        "action_url": row[9],
+        "read": row[10] == 1,
+        "read_at": row[11],
+        "created_at": row[12]
+    }
+
 @router.get("")
 async def list_notifications(
+    response: Response,
     x_session_token: Optional[str] = Header(None),
-    unread_only: bool = False
+    unread_only: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    type: Optional[str] = None,
+    priority: Optional[str] = None,
+    since: Optional[datetime] = None
 ):
-    """List notifications for the current user"""
+    """List notifications for the current user, newest first.
+    
+    Pages are keyed on (created_at, id), matching the table's ORDER BY
+    (user_id, created_at); pass the X-Next-Cursor header of one page as
+    ?cursor= to get the next. ?since= returns only notifications created
+    after a timestamp, for incremental refresh.
+    """
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication required"
         )
     
+    position = notification_hub.parse_event_id(cursor)
+    if cursor and position is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
     client = get_client()
     
     try:
-        # Get user_id from session
-        session_result = client.query(
-            """
-            SELECT user_id
-            FROM sessions
-            WHERE token = %(token)s AND expires_at > now()
-            LIMIT 1
-            """,
-            parameters={"token": x_session_token}
-        )
+        user_id = get_session_user_id(client, x_session_token)
         
-        if not session_result.result_rows:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid session"
-            )
+        query = READ_STATE_SQL
+        params = {"user_id": user_id, "limit": limit + 1}
+        
+        if type:
+            query += " AND n.type = %(type)s"
+            params["type"] = type
+        
+        if priority:
+            query += " AND n.priority = %(priority)s"
+            params["priority"] = priority
         
-        user_id = session_result.result_rows[0][0]
+        if since:
+            query += " AND n.created_at > %(since)s"
+            params["since"] = since
         
-        query = """
-            SELECT *
-            FROM notifications
-            WHERE user_id = %(user_id)s
-        """
+        if position:
+            query += " AND (n.created_at, n.id) < (toDateTime(%(cursor_ts)s), %(cursor_id)s)"
+            params["cursor_ts"], params["cursor_id"] = position
         
         if unread_only:
-            query += " AND read = 0"
-        
-        query += " ORDER BY created_at DESC"
-        
-        result = client.query(query, parameters={"user_id": user_id})
-        
-        notifications = []
-        for row in result.result_rows:
-            notifications.append({
-                "id": row[0],
-                "user_id": row[1],
-                "type": row[2],
-                "title": row[3],
-                "message": row[4],
-                "correspondence_id": row[5],
-                "related_entity_type": row[6],
-                "related_entity_id": row[7],
-                "priority": row[8],
-                "action_url": row[9],
-                "read": row[10] == 1,
-                "read_at": row[11],
-                "created_at": row[12]
-            })
+            query += " AND NOT is_read"
+        
+        query += " ORDER BY n.created_at DESC, n.id DESC LIMIT %(limit)s"
+        
+        result = client.query(query, parameters=params)
+        
+        rows = result.result_rows[:limit]
+        if len(result.result_rows) > limit:
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = notification_hub.notification_event_id(last[12], last[0])
+        
+        notifications = [row_to_notification(row) for row in rows]
         
         return notifications
         
@@ -96,45 +172,115 @@ async def get_unread_count(x_session_token: Optional[str] = Header(None)):
     client = get_client()
     
     try:
-        # Get user_id from session
-        session_result = client.query(
-            """
-            SELECT user_id
-            FROM sessions
-            WHERE token = %(token)s AND expires_at > now()
-            LIMIT 1
-            """,
-            parameters={"token": x_session_token}
-        )
+        user_id = get_session_user_id(client, x_session_token)
         
-        if not session_result.result_rows:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid session"
-            )
-        
-        user_id = session_result.result_rows[0][0]
+        return {"count": unread_counters.get(client, user_id)}
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Get unread count error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get unread count"
+        )
+
+@router.get("/stream")
+async def stream_notifications(
+    request: Request,
+    token: Optional[str] = None,
+    x_session_token: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-Sent Events stream of new notifications and unread count changes.
+    
+    EventSource cannot send custom headers, so the session token may also be
+    passed as ?token=. On reconnect the browser sends Last-Event-ID and any
+    notifications created after it are replayed from the notifications table.
+    """
+    client = get_client()
+    user_id = get_session_user_id(client, x_session_token or token)
+    since = notification_hub.parse_event_id(last_event_id)
+
+    def load_replay():
         result = client.query(
-            """
-            SELECT COUNT(*)
-            FROM notifications
-            WHERE user_id = %(user_id)s AND read = 0
+            READ_STATE_SQL + """
+                AND (n.created_at, n.id) > (toDateTime(%(since)s), %(since_id)s)
+                ORDER BY n.created_at ASC, n.id ASC
+                LIMIT %(limit)s
             """,
-            parameters={"user_id": user_id}
+            parameters={
+                "user_id": user_id,
+                "since": since[0],
+                "since_id": since[1],
+                "limit": settings.SSE_REPLAY_LIMIT
+            }
         )
+        return [row_to_notification(row) for row in result.result_rows]
+
+    async def event_stream():
+        # Subscribe before replaying so nothing published meanwhile is lost
+        queue = notification_hub.subscribe(user_id)
+        try:
+            if since is not None:
+                for notification in await asyncio.to_thread(load_replay):
+                    yield notification_hub.format_event(
+                        "notification",
+                        notification,
+                        notification_hub.notification_event_id(notification["created_at"], notification["id"])
+                    )
+            
+            count = await asyncio.to_thread(unread_counters.get, client, user_id)
+            yield notification_hub.format_event("unread_count", {"count": count})
+            
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=settings.SSE_HEARTBEAT_SECONDS)
+                    yield message
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+        finally:
+            notification_hub.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+# Declared before /{notification_id} so "mark-all-read" is not captured as an id
+@router.put("/mark-all-read")
+async def mark_all_read(x_session_token: Optional[str] = Header(None)):
+    """Mark all notifications as read for current user"""
+    if not x_session_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required"
+        )
+    
+    client = get_client()
+    
+    try:
+        user_id = get_session_user_id(client, x_session_token)
         
-        count = result.result_rows[0][0] if result.result_rows else 0
+        # One watermark row covers the whole inbox regardless of its size
+        insert_read_marker(client, user_id, "", True, read_until=datetime.utcnow().replace(microsecond=0))
+        unread_counters.reset(client, user_id)
         
-        return {"count": count}
+        return {"message": "All notifications marked as read"}
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Get unread count error: {e}")
+        print(f"Mark all read error: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to get unread count"
+            detail="Failed to mark notifications as read"
         )
 
 @router.put("/{notification_id}")
@@ -150,19 +296,35 @@ async def update_notification(
             detail="Authentication required"
         )
     
-    # Note: ClickHouse UPDATE limitations
-    # You may need to implement using ALTER TABLE UPDATE
+    client = get_client()
     
-    return {"message": "Notification marked as read"}
-
-@router.put("/mark-all-read")
-async def mark_all_read(x_session_token: Optional[str] = Header(None)):
-    """Mark all notifications as read for current user"""
-    if not x_session_token:
+    try:
+        user_id = get_session_user_id(client, x_session_token)
+        
+        # Only a real state change moves the unread counter
+        current = client.query(
+            READ_STATE_SQL + " AND n.id = %(notification_id)s LIMIT 1",
+            parameters={"user_id": user_id, "notification_id": notification_id}
+        )
+        if not current.result_rows:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Notification not found"
+            )
+        was_read = current.result_rows[0][10] == 1
+        
+        insert_read_marker(client, user_id, notification_id, update_data.read)
+        
+        if was_read != update_data.read:
+            unread_counters.apply_deltas(client, {user_id: -1 if update_data.read else 1})
+        
+        return {"message": "Notification marked as read" if update_data.read else "Notification marked as unread"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Update notification error: {e}")
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication required"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update notification"
         )
-    
-    # Note: ClickHouse UPDATE limitations
-    return {"message": "All notifications marked as read"}
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, status, Header
 from typing import Optional
 from database import get_client
+import entity_directory
 
 router = APIRouter(prefix="/statistics", tags=["Statistics"])
 
@@ -28,8 +29,7 @@ async def get_dashboard_stats(x_session_token: Optional[str] = Header(None)):
         stats["total_users"] = result.result_rows[0][0] if result.result_rows else 0
         
         # Total entities
-        result = client.query("SELECT COUNT(*) FROM entities")
-        stats["total_entities"] = result.result_rows[0][0] if result.result_rows else 0
+        stats["total_entities"] = len(entity_directory.list_entities(client))
         
         # Active sessions
         result = client.query("SELECT COUNT(*) FROM sessions WHERE expires_at > now()")
@@ -122,10 +122,13 @@ async def get_correspondences_by_entity(x_session_token: Optional[str] = Header(
     client = get_client()
     
     try:
+        # Group by entity id; names that match no entity ('' id) keep their own group
         result = client.query("""
-            SELECT from_entity, COUNT(*) as count
+            SELECT
+                if(from_entity_id = '', any(from_entity), dictGetOrDefault('entities_dict', 'name', tuple(from_entity_id), any(from_entity))) as entity,
+                COUNT(*) as count
             FROM correspondences
-            GROUP BY from_entity
+            GROUP BY from_entity_id, if(from_entity_id = '', from_entity, '')
             ORDER BY count DESC
             LIMIT 10
         """)
@@ -199,6 +202,7 @@ async def get_monthly_stats(x_session_token: Optional[str] = Header(None)):
     client = get_client()
     
     try:
+        # Group by entity ids and show current names, so renames don't split history
         result = client.query("""
             SELECT 
                 toStartOfMonth(date) as month,
@@ -210,11 +214,12 @@ async def get_monthly_stats(x_session_token: Optional[str] = Header(None)):
                 countIf(signature_url != '') as with_signature_count,
                 countIf(content = '' AND arrayExists(x -> true, attachments)) as attachment_only_count,
                 avg(date_diff('hour', created_at, received_at)) as avg_hours_to_receive,
-                from_entity,
-                received_by_entity
+                if(from_entity_id = '', any(from_entity), dictGetOrDefault('entities_dict', 'name', tuple(from_entity_id), any(from_entity))) as from_entity_name,
+                if(received_by_entity_id = '', any(received_by_entity), dictGetOrDefault('entities_dict', 'name', tuple(received_by_entity_id), ifNull(any(received_by_entity), ''))) as received_by_entity_name
             FROM correspondences
             WHERE date >= today() - INTERVAL 12 MONTH
-            GROUP BY month, type, from_entity, received_by_entity
+            GROUP BY month, type, from_entity_id, received_by_entity_id,
+                     if(from_entity_id = '', from_entity, ''), if(received_by_entity_id = '', received_by_entity, '')
             ORDER BY month DESC
         """)
         
@@ -255,17 +260,17 @@ async def get_user_performance(x_session_token: Optional[str] = Header(None)):
     client = get_client()
     
     try:
-        result = client.query("""
+        result = client.query(f"""
             SELECT 
                 u.id,
                 u.username,
                 u.full_name,
-                u.entity_name,
+                {entity_directory.entity_name_sql("u.entity_id", "u.entity_name")} as entity_name,
                 ur.role,
                 COUNT(c.id) as total_correspondences,
                 countIf(c.created_by = u.id) as created_count,
                 countIf(c.received_by = u.id) as received_count,
-                (SELECT COUNT(*) FROM correspondence_comments WHERE user_id = u.id) as comments_count,
+                (SELECT COUNT(*) FROM correspondence_comments FINAL WHERE user_id = u.id AND is_deleted = 0) as comments_count,
                 avg(date_diff('hour', c.created_at, c.received_at)) as avg_response_hours,
                 max(c.created_at) as last_activity
             FROM users u
@@ -283,7 +288,7 @@ async def get_user_performance(x_session_token: Optional[str] = Header(None)):
                 "id": row[0],
                 "username": row[1],
                 "full_name": row[2],
-                "entity_name": row[3],
+                "entity_name": row[3] or None,
                 "role": row[4],
                 "total_correspondences": row[5],
                 "created_count": row[6],
@@ -315,35 +320,42 @@ async def get_entity_stats(x_session_token: Optional[str] = Header(None)):
     
     try:
         result = client.query("""
-            SELECT 
-                e.id,
-                e.name,
-                e.type,
-                COUNT(DISTINCT c_sent.id) as sent_count,
-                COUNT(DISTINCT c_received.id) as received_count,
-                COUNT(DISTINCT c_sent.id) + COUNT(DISTINCT c_received.id) as total_correspondences,
-                (SELECT COUNT(*) FROM users WHERE entity_id = e.id) as users_count,
-                (SELECT COUNT(*) FROM correspondence_templates WHERE entity_id = e.id) as templates_count
-            FROM entities e
-            LEFT JOIN correspondences c_sent ON e.name = c_sent.from_entity
-            LEFT JOIN correspondences c_received ON e.name = c_received.received_by_entity
-            GROUP BY e.id, e.name, e.type
-            ORDER BY total_correspondences DESC
+            SELECT entity_id, countIf(direction = 'sent'), countIf(direction = 'received')
+            FROM (
+                SELECT from_entity_id AS entity_id, 'sent' AS direction
+                FROM correspondences
+                WHERE from_entity_id != ''
+                UNION ALL
+                SELECT received_by_entity_id AS entity_id, 'received' AS direction
+                FROM correspondences
+                WHERE received_by_entity_id != ''
+            )
+            GROUP BY entity_id
         """)
+        correspondence_counts = {row[0]: (row[1], row[2]) for row in result.result_rows}
+        
+        result = client.query("SELECT entity_id, COUNT(*) FROM users WHERE entity_id IS NOT NULL GROUP BY entity_id")
+        users_counts = dict(result.result_rows)
+        
+        result = client.query("SELECT entity_id, COUNT(*) FROM correspondence_templates WHERE entity_id IS NOT NULL GROUP BY entity_id")
+        templates_counts = dict(result.result_rows)
         
         stats = []
-        for row in result.result_rows:
+        for entity in entity_directory.list_entities(client):
+            sent_count, received_count = correspondence_counts.get(entity["id"], (0, 0))
             stats.append({
-                "id": row[0],
-                "name": row[1],
-                "type": row[2],
-                "sent_count": row[3],
-                "received_count": row[4],
-                "total_correspondences": row[5],
-                "users_count": row[6],
-                "templates_count": row[7]
+                "id": entity["id"],
+                "name": entity["name"],
+                "type": entity["type"],
+                "sent_count": sent_count,
+                "received_count": received_count,
+                "total_correspondences": sent_count + received_count,
+                "users_count": users_counts.get(entity["id"], 0),
+                "templates_count": templates_counts.get(entity["id"], 0)
             })
         
+        stats.sort(key=lambda entity: entity["total_correspondences"], reverse=True)
+        
         return stats
         
     except Exception as e:
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, status, Header
 from typing import Optional, List
 import uuid
-from models import TemplateBase, TemplateCreate
+from models import TemplateBase, TemplateCreate, TemplateRenderRequest, TemplateBulkRenderRequest
 from database import get_client
+from config import settings
+import template_catalog
+import template_usage
 
 router = APIRouter(prefix="/templates", tags=["Templates"])
 
@@ -16,45 +19,7 @@ async def list_templates(
     client = get_client()
     
     try:
-        query = """
-            SELECT *
-            FROM correspondence_templates
-            WHERE is_active = 1
-        """
-        params = {}
-        
-        if category:
-            query += " AND category = %(category)s"
-            params["category"] = category
-        
-        if type:
-            query += " AND type = %(type)s"
-            params["type"] = type
-        
-        query += " ORDER BY usage_count DESC, created_at DESC"
-        
-        result = client.query(query, parameters=params if params else None)
-        
-        templates = []
-        for row in result.result_rows:
-            templates.append({
-                "id": row[0],
-                "name": row[1],
-                "content_template": row[2],
-                "subject_template": row[3],
-                "greeting": row[4],
-                "category": row[5],
-                "type": row[6],
-                "entity_id": row[7],
-                "variables": row[8],
-                "is_active": row[9] == 1,
-                "is_public": row[10] == 1,
-                "usage_count": row[11],
-                "created_by": row[12],
-                "updated_by": row[13],
-                "created_at": row[14],
-                "updated_at": row[15]
-            })
+        templates = template_catalog.list_templates(client, category=category, type=type)
         
         return templates
         
@@ -71,42 +36,15 @@ async def get_template(template_id: str):
     client = get_client()
     
     try:
-        result = client.query(
-            """
-            SELECT *
-            FROM correspondence_templates
-            WHERE id = %(id)s
-            LIMIT 1
-            """,
-            parameters={"id": template_id}
-        )
+        template = template_catalog.get_template(client, template_id)
         
-        if not result.result_rows:
+        if template is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Template not found"
             )
         
-        row = result.result_rows[0]
-        
-        return {
-            "id": row[0],
-            "name": row[1],
-            "content_template": row[2],
-            "subject_template": row[3],
-            "greeting": row[4],
-            "category": row[5],
-            "type": row[6],
-            "entity_id": row[7],
-            "variables": row[8],
-            "is_active": row[9] == 1,
-            "is_public": row[10] == 1,
-            "usage_count": row[11],
-            "created_by": row[12],
-            "updated_by": row[13],
-            "created_at": row[14],
-            "updated_at": row[15]
-        }
+        return template
         
     except HTTPException:
         raise
@@ -177,6 +115,8 @@ async def create_template(
             }
         )
         
+        template_catalog.invalidate()
+        
         return {"id": template_id, "message": "Template created successfully"}
         
     except HTTPException:
@@ -187,3 +127,88 @@ async def create_template(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create template"
         )
+
+@router.post("/{template_id}/render")
+async def render_template(template_id: str, request: TemplateRenderRequest):
+    """Render a template's subject and content with the given variable values"""
+    client = get_client()
+    
+    try:
+        rendered = template_catalog.render(client, template_id, request.values)
+        
+        if rendered is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Template not found"
+            )
+        
+        template_usage.record(template_id)
+        
+        return rendered
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Render template error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to render template"
+        )
+
+@router.post("/{template_id}/render-bulk")
+async def render_template_bulk(template_id: str, request: TemplateBulkRenderRequest):
+    """Render one template for many sets of variable values"""
+    if len(request.items) > settings.TEMPLATE_BULK_RENDER_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.TEMPLATE_BULK_RENDER_MAX_ITEMS} items per request"
+        )
+    
+    client = get_client()
+    
+    try:
+        rendered = template_catalog.render_many(client, template_id, request.items)
+        
+        if rendered is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Template not found"
+            )
+        
+        template_usage.record(template_id, len(rendered))
+        
+        return rendered
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Bulk render template error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to render templates"
+        )
+
+@router.post("/{template_id}/use")
+async def record_template_use(template_id: str):
+    """Count a use of a template applied on the client"""
+    client = get_client()
+    
+    try:
+        if template_catalog.get_template(client, template_id) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Template not found"
+            )
+        
+        template_usage.record(template_id)
+        
+        return {"message": "Template use recorded"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Record template use error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to record template use"
+        )
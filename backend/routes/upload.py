@@ -1,10 +1,15 @@
 from fastapi import APIRouter, HTTPException, status, Header, UploadFile, File, Form
+from fastapi.responses import FileResponse
 from typing import Optional
 import os
 import uuid
 import hashlib
+import base64
+import binascii
 from pathlib import Path
 from database import get_client
+from config import settings
+import previews
 
 router = APIRouter(prefix="/upload", tags=["File Upload"])
 
@@ -39,6 +44,42 @@ def calculate_md5(file_contents: bytes) -> str:
     """Calculate MD5 hash of file contents"""
     return hashlib.md5(file_contents).hexdigest()
 
+SIGNATURE_MIME_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/svg+xml": ".svg"
+}
+
+def decode_data_url(value: str) -> tuple:
+    """Decode a base64 image (data: URL or bare base64) into (bytes, extension)"""
+    file_ext = ".png"
+    if value.startswith("data:"):
+        header, _, value = value.partition(",")
+        mime_type = header[5:].split(";")[0].lower()
+        if mime_type not in SIGNATURE_MIME_EXTENSIONS:
+            raise ValueError(f"Unsupported signature type: {mime_type}")
+        file_ext = SIGNATURE_MIME_EXTENSIONS[mime_type]
+    try:
+        return base64.b64decode(value, validate=True), file_ext
+    except binascii.Error as e:
+        raise ValueError("Invalid base64 data") from e
+
+def store_signature(contents: bytes, file_ext: str) -> str:
+    """Write a signature image under its content hash and return its URL.
+
+    The name changes whenever the content does, so the file can be served
+    with immutable caching; identical signatures share one file.
+    """
+    filename = f"{calculate_md5(contents)}{file_ext.lower()}"
+    file_path = SIGNATURES_DIR / filename
+    if not file_path.exists():
+        tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, file_path)
+    return f"/uploads/signatures/{filename}"
+
 @router.post("/attachment")
 async def upload_attachment(
     file: UploadFile = File(...),
@@ -156,12 +197,7 @@ async def upload_signature(
         )
     
     try:
-        # Generate unique filename
-        file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = SIGNATURES_DIR / unique_filename
-        
-        # Read and save file
+        # Read and save file (content-addressed, see store_signature)
         contents = await file.read()
         
         if len(contents) > MAX_FILE_SIZE:
@@ -170,10 +206,7 @@ async def upload_signature(
                 detail="File size exceeds maximum allowed size (10MB)"
             )
         
-        with open(file_path, "wb") as f:
-            f.write(contents)
-        
-        file_url = f"/uploads/signatures/{unique_filename}"
+        file_url = store_signature(contents, os.path.splitext(file.filename)[1])
         
         return {
             "url": file_url,
@@ -241,3 +274,46 @@ async def upload_pdf(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to upload PDF"
         )
+
+@router.get("/preview/{filename}")
+async def get_attachment_preview(filename: str, size: int = 160):
+    """Thumbnail of an image attachment or the first page of a PDF.
+    
+    Rendered on first request in the preview process pool and cached on disk
+    by file MD5 and size; later requests are served from the cache.
+    """
+    if size not in settings.PREVIEW_SIZES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"size must be one of {settings.PREVIEW_SIZES}"
+        )
+    
+    source = ATTACHMENTS_DIR / os.path.basename(filename)
+    if not source.is_file():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    try:
+        preview = await previews.get_preview(source, size)
+    except Exception as e:
+        print(f"Preview error for {source.name}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to generate preview"
+        )
+    
+    if preview is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="No preview available for this file type"
+        )
+    
+    # Attachment names are never reused, so the preview for a URL never changes;
+    # private like the uploads themselves, shared caches must not keep them
+    return FileResponse(
+        preview,
+        media_type=f"image/{settings.PREVIEW_FORMAT.lower()}",
+        headers={"Cache-Control": f"private, max-age={settings.IMMUTABLE_CACHE_MAX_AGE_SECONDS}, immutable"}
+    )
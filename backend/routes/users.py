@@ -1,14 +1,22 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, Request
 from typing import Optional
 import bcrypt
+import calendar
 from pydantic import BaseModel
 from models import UserListRequest, UserUpdate, UserCreate
 from database import get_client
+from routes.upload import decode_data_url, store_signature, MAX_FILE_SIZE
+import user_directory
+import entity_directory
+import sessions
+import text_normalization
+import audit_log
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 class SignatureUpdate(BaseModel):
-    signature_base64: str
+    signature_base64: Optional[str] = None
+    signature_url: Optional[str] = None
 
 async def verify_admin_session(x_session_token: Optional[str] = Header(None)):
     """Verify that the session belongs to an admin user"""
@@ -57,42 +65,108 @@ async def verify_admin_session(x_session_token: Optional[str] = Header(None)):
     
     return user_id
 
+def encode_cursor(created_at, user_id: int) -> str:
+    return f"{calendar.timegm(created_at.timetuple())}:{user_id}"
+
+def parse_cursor(cursor: str):
+    timestamp, _, user_id = cursor.partition(":")
+    try:
+        return int(timestamp), int(user_id)
+    except ValueError:
+        return None
+
 @router.post("/list")
 async def list_users(request: UserListRequest):
-    """List all users (admin only)"""
+    """List users, newest first (admin only).
+    
+    Pages are keyed on (created_at, id); pass next_cursor from one page as
+    cursor to get the next. search matches username/full_name after Arabic
+    normalization; entityId and role filter the results.
+    """
+    position = parse_cursor(request.cursor) if request.cursor else None
+    if request.cursor and position is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
+    if request.role and request.role not in ('admin', 'moderator', 'user'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid role"
+        )
+    
     client = get_client()
     
     try:
         # Verify admin access using token from request body
         await verify_admin_session(request.sessionToken)
         
-        result = client.query(
-            f"""
+        roles = user_directory.get_roles(client)
+        
+        query = f"""
             SELECT 
-                u.id, u.username, u.full_name, u.entity_id, u.entity_name,
-                u.created_at, u.created_by,
-                any(ur.role) as role
+                u.id, u.username, u.full_name, u.entity_id,
+                {entity_directory.entity_name_sql("u.entity_id", "u.entity_name")} as entity_name,
+                u.created_at, u.created_by
             FROM users u
-            LEFT JOIN user_roles ur ON u.id = ur.user_id
-            GROUP BY u.id, u.username, u.full_name, u.entity_id, u.entity_name, u.created_at, u.created_by
-            ORDER BY u.created_at DESC
-            """
-        )
+            WHERE 1 = 1
+        """
+        params = {"limit": request.limit + 1}
+        
+        if request.search:
+            search = text_normalization.normalize(request.search)
+            if search:
+                query += f"""
+                    AND (positionUTF8({text_normalization.normalized_sql("u.username")}, %(search)s) > 0
+                         OR positionUTF8({text_normalization.normalized_sql("u.full_name")}, %(search)s) > 0)
+                """
+                params["search"] = search
+        
+        if request.entityId:
+            query += " AND u.entity_id = %(entity_id)s"
+            params["entity_id"] = request.entityId
+        
+        # Role filters come from the cached role map; admins and moderators are few
+        if request.role == 'user':
+            elevated_ids = [user_id for user_id, role in roles.items() if role != 'user']
+            if elevated_ids:
+                query += " AND NOT has(%(elevated_ids)s, u.id)"
+                params["elevated_ids"] = elevated_ids
+        elif request.role:
+            role_ids = [user_id for user_id, role in roles.items() if role == request.role]
+            if not role_ids:
+                return {"users": [], "next_cursor": None}
+            query += " AND has(%(role_ids)s, u.id)"
+            params["role_ids"] = role_ids
+        
+        if position:
+            query += " AND (u.created_at, u.id) < (toDateTime(%(cursor_ts)s), %(cursor_id)s)"
+            params["cursor_ts"], params["cursor_id"] = position
+        
+        query += " ORDER BY u.created_at DESC, u.id DESC LIMIT %(limit)s"
+        
+        result = client.query(query, parameters=params)
+        
+        rows = result.result_rows[:request.limit]
+        next_cursor = None
+        if len(result.result_rows) > request.limit:
+            next_cursor = encode_cursor(rows[-1][5], rows[-1][0])
         
         users = []
-        for row in result.result_rows:
+        for row in rows:
             users.append({
                 "id": row[0],
                 "username": row[1],
                 "full_name": row[2],
                 "entity_id": row[3],
-                "entity_name": row[4],
+                "entity_name": row[4] or None,
                 "created_at": row[5],
                 "created_by": row[6],
-                "role": row[7] if row[7] else 'user'
+                "role": roles.get(row[0]) or 'user'
             })
         
-        return {"users": users}
+        return {"users": users, "next_cursor": next_cursor}
         
     except HTTPException:
         raise
@@ -106,6 +180,7 @@ async def list_users(request: UserListRequest):
 @router.post("/update")
 async def update_user(
     user_update: UserUpdate,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Update user information (admin only)"""
@@ -113,7 +188,7 @@ async def update_user(
     
     try:
         # Verify admin access
-        await verify_admin_session(x_session_token)
+        admin_user_id = await verify_admin_session(x_session_token)
         
         updates = []
         params = {"user_id": user_update.userId}
@@ -124,21 +199,13 @@ async def update_user(
         
         if user_update.entityId:
             # Verify entity exists
-            entity_result = client.query(
-                f"""
-                SELECT id, name
-                FROM entities
-                WHERE id = %(entity_id)s
-                LIMIT 1
-                """,
-                parameters={"entity_id": user_update.entityId}
-            )
+            entity = entity_directory.get_entity(client, user_update.entityId)
             
-            if entity_result.result_rows:
+            if entity:
                 updates.append("entity_id = %(entity_id)s")
                 updates.append("entity_name = %(entity_name)s")
                 params["entity_id"] = user_update.entityId
-                params["entity_name"] = entity_result.result_rows[0][1]
+                params["entity_name"] = entity["name"]
         
         if user_update.password:
             # Hash password
@@ -156,8 +223,28 @@ async def update_user(
             )
         
         # ClickHouse ALTER TABLE UPDATE syntax
+        # Current values, so the audit log keeps only what actually changed
+        current = client.query(
+            """
+            SELECT full_name, entity_id, entity_name, password_hash
+            FROM users
+            WHERE id = %(user_id)s
+            LIMIT 1
+            """,
+            parameters={"user_id": user_update.userId}
+        )
+        
         update_query = f"ALTER TABLE users UPDATE {', '.join(updates)} WHERE id = %(user_id)s"
         client.command(update_query, parameters=params)
+        user_directory.invalidate()
+        
+        audit_log.record(
+            "update", "user", user_update.userId,
+            old=dict(zip(current.column_names, current.result_rows[0])) if current.result_rows else None,
+            new={key: value for key, value in params.items() if key != "user_id"},
+            user_id=admin_user_id,
+            request=request
+        )
         
         return {"message": "User updated successfully"}
         
@@ -173,6 +260,7 @@ async def update_user(
 @router.post("/create")
 async def create_user(
     user_create: UserCreate,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Create a new user (admin only)"""
@@ -205,14 +293,9 @@ async def create_user(
         # Get entity name if entity_id is provided
         entity_name = None
         if user_create.entity_id:
-            entity_result = client.query(
-                """
-                SELECT name FROM entities WHERE id = %(entity_id)s LIMIT 1
-                """,
-                parameters={"entity_id": user_create.entity_id}
-            )
-            if entity_result.result_rows:
-                entity_name = entity_result.result_rows[0][0]
+            entity = entity_directory.get_entity(client, user_create.entity_id)
+            if entity:
+                entity_name = entity["name"]
         
         # Get next user ID
         max_id_result = client.query("SELECT max(id) FROM users")
@@ -251,6 +334,21 @@ async def create_user(
             }
         )
         
+        user_directory.invalidate()
+        
+        audit_log.record(
+            "create", "user", next_id,
+            new={
+                "username": user_create.username,
+                "full_name": user_create.full_name,
+                "entity_id": user_create.entity_id,
+                "entity_name": entity_name,
+                "role": getattr(user_create, 'role', 'user')
+            },
+            user_id=admin_user_id,
+            request=request
+        )
+        
         return {
             "message": "تم إنشاء المستخدم بنجاح",
             "user_id": next_id
@@ -268,6 +366,7 @@ async def create_user(
 @router.delete("/delete/{user_id}")
 async def delete_user(
     user_id: int,
+    request: Request,
     x_session_token: Optional[str] = Header(None)
 ):
     """Delete a user (admin only)"""
@@ -275,7 +374,17 @@ async def delete_user(
     
     try:
         # Verify admin access
-        await verify_admin_session(x_session_token)
+        admin_user_id = await verify_admin_session(x_session_token)
+        
+        current = client.query(
+            """
+            SELECT username, full_name, entity_id, entity_name
+            FROM users
+            WHERE id = %(user_id)s
+            LIMIT 1
+            """,
+            parameters={"user_id": user_id}
+        )
         
         # Delete user roles first
         client.command(
@@ -301,6 +410,16 @@ async def delete_user(
             parameters={"user_id": user_id}
         )
         
+        user_directory.invalidate()
+        sessions.invalidate_user(user_id)
+        
+        audit_log.record(
+            "delete", "user", user_id,
+            old=dict(zip(current.column_names, current.result_rows[0])) if current.result_rows else {},
+            user_id=admin_user_id,
+            request=request
+        )
+        
         return {"message": "تم حذف المستخدم بنجاح"}
         
     except HTTPException:
@@ -317,7 +436,7 @@ async def get_user(
     user_id: int,
     x_session_token: Optional[str] = Header(None)
 ):
-    """Get user details including signature"""
+    """Get user details including the signature URL"""
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -327,9 +446,10 @@ async def get_user(
     try:
         client = get_client()
         result = client.query(
-            """
-            SELECT id, username, full_name, entity_id, entity_name, 
-                   signature_base64, job_title, created_at
+            f"""
+            SELECT id, username, full_name, entity_id,
+                   {entity_directory.entity_name_sql("entity_id", "entity_name")} as entity_name,
+                   signature_url, job_title, created_at
             FROM users
             WHERE id = %(user_id)s
             LIMIT 1
@@ -349,8 +469,8 @@ async def get_user(
             "username": row[1],
             "full_name": row[2],
             "entity_id": row[3],
-            "entity_name": row[4],
-            "signature_base64": row[5],
+            "entity_name": row[4] or None,
+            "signature_url": row[5],
             "job_title": row[6],
             "created_at": row[7]
         }
@@ -370,7 +490,11 @@ async def update_user_signature(
     signature_data: SignatureUpdate,
     x_session_token: Optional[str] = Header(None)
 ):
-    """Update user signature (base64)"""
+    """Update user signature.
+    
+    Accepts an image as base64 (stored as a file in the upload store) or the
+    URL returned by POST /upload/signature; only the URL is kept on the user.
+    """
     if not x_session_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -380,23 +504,48 @@ async def update_user_signature(
     try:
         client = get_client()
         
-        # Escape single quotes in base64 string for SQL
-        escaped_signature = signature_data.signature_base64.replace("'", "''")
+        if signature_data.signature_base64:
+            try:
+                contents, file_ext = decode_data_url(signature_data.signature_base64)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=str(e)
+                )
+            
+            if len(contents) > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="File size exceeds maximum allowed size (10MB)"
+                )
+            
+            signature_url = store_signature(contents, file_ext)
+        elif (signature_data.signature_url or "").startswith("/uploads/signatures/") and ".." not in signature_data.signature_url:
+            signature_url = signature_data.signature_url
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="signature_base64 or an uploaded signature_url is required"
+            )
         
-        # Update signature in ClickHouse using ALTER TABLE UPDATE
+        # Only the short URL is written, so the mutation stays small
         client.command(
-            f"""
-            ALTER TABLE users
-            UPDATE signature_base64 = '{escaped_signature}'
-            WHERE id = {user_id}
             """
+            ALTER TABLE users
+            UPDATE signature_url = %(signature_url)s
+            WHERE id = %(user_id)s
+            """,
+            parameters={"signature_url": signature_url, "user_id": user_id}
         )
         
         return {
             "success": True,
+            "signature_url": signature_url,
             "message": "Signature updated successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Update signature error: {e}")
         raise HTTPException(
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from database import get_client
+from config import settings
+import sessions
+import unread_counters
+import user_directory
+import entity_directory
+import template_catalog
+import template_usage
+
+# The worker holding a lock on SCHEDULER_LOCK_PATH is the leader and the only
+# one running the cluster-wide jobs. They must not run twice concurrently:
+# reconcile_rollups inserts relative corrections, which are not idempotent.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LOCK_PATH = Path(settings.SCHEDULER_LOCK_PATH)
+# Last run of each leader job, so a new leader does not repeat recent runs
+STATE_PATH = LOCK_PATH.with_name(LOCK_PATH.name + ".state.json")
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable
+    interval_seconds: float
+    leader_only: bool = True
+
+def optimize_tables(client) -> str:
+    """Collapse the rows of the Summing/ReplacingMergeTree rollup tables.
+
+    Reads on these tables aggregate or use FINAL until duplicates are
+    merged away. Only partitions with more than one active part are
+    optimized, and tables of other engines are skipped: on an append-only
+    MergeTree, OPTIMIZE FINAL would just rewrite the whole table.
+    """
+    if not settings.SCHEDULER_OPTIMIZE_TABLES:
+        return "no tables"
+
+    result = client.query(
+        """
+        SELECT table, partition_id
+        FROM system.parts
+        WHERE database = currentDatabase() AND active
+          AND table IN (
+              SELECT name FROM system.tables
+              WHERE database = currentDatabase() AND name IN %(tables)s
+                AND match(engine, '(Replacing|Summing|Aggregating|Collapsing)MergeTree$')
+          )
+        GROUP BY table, partition_id
+        HAVING count() > 1
+        """,
+        parameters={"tables": settings.SCHEDULER_OPTIMIZE_TABLES}
+    )
+    for table, partition_id in result.result_rows:
+        client.command(
+            f"OPTIMIZE TABLE {table} PARTITION ID %(id)s FINAL",
+            parameters={"id": partition_id}
+        )
+    return f"optimized {len(result.result_rows)} partitions"
+
+def warm_caches(client) -> str:
+    """Reload this worker's directory caches before a request finds them stale"""
+    user_directory.get_directory(client)
+    user_directory.get_roles(client)
+    entity_directory.get_directory(client)
+    template_catalog.get_catalog(client)
+    template_usage.get_totals(client)
+    return "ok"
+
+def reconcile_rollups(client) -> str:
+    return f"corrected {unread_counters.reconcile_all(client)} users"
+
+JOBS: List[Job] = [
+    Job("purge_sessions", sessions.purge_expired, settings.SCHEDULER_SESSION_PURGE_SECONDS),
+    Job("reconcile_rollups", reconcile_rollups, settings.SCHEDULER_RECONCILE_SECONDS),
+    Job("optimize_tables", optimize_tables, settings.SCHEDULER_OPTIMIZE_SECONDS),
+    Job("warm_caches", warm_caches, settings.SCHEDULER_WARM_CACHES_SECONDS, leader_only=False),
+]
+LEADER_JOBS = {job.name for job in JOBS if job.leader_only}
+
+_lock_file = None
+_leader = False
+_stats: Dict[str, dict] = {
+    job.name: {
+        "runs": 0,
+        "failures": 0,
+        "last_started_at": None,
+        "last_duration_ms": None,
+        "last_result": None,
+        "last_error": None,
+        "next_run_at": None,
+    }
+    for job in JOBS
+}
+
+def _try_lead() -> bool:
+    """Take the leader lock if no other worker holds it (the lock is kept until exit)"""
+    global _lock_file, _leader
+    if _leader:
+        return True
+    try:
+        if _lock_file is None:
+            LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+            _lock_file = open(LOCK_PATH, "a+")
+        if fcntl is not None:
+            fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            _lock_file.seek(0)
+            msvcrt.locking(_lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    _leader = True
+    print(f"✓ Scheduler leader is worker {os.getpid()}")
+    return True
+
+def _load_state() -> Dict[str, float]:
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(state: Dict[str, float]):
+    tmp_path = STATE_PATH.with_name(f"{STATE_PATH.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, STATE_PATH)
+    except OSError as e:
+        print(f"Scheduler state error: {e}")
+
+def _run(client, job: Job) -> Optional[str]:
+    stats = _stats[job.name]
+    stats["last_started_at"] = datetime.utcnow().replace(microsecond=0)
+    started = time.monotonic()
+    try:
+        result = job.fn(client)
+        stats["last_result"] = result
+        stats["last_error"] = None
+        return result
+    except Exception as e:
+        stats["failures"] += 1
+        stats["last_error"] = str(e)
+        raise
+    finally:
+        stats["runs"] += 1
+        stats["last_duration_ms"] = round((time.monotonic() - started) * 1000)
+
+def metrics() -> dict:
+    return {"leader": _leader, "pid": os.getpid(), "jobs": _stats}
+
+async def run_scheduler():
+    """Background loop running every due job once per SCHEDULER_TICK_SECONDS.
+
+    Jobs run one at a time in a thread; a failed job is retried at its next
+    interval like a successful one.
+    """
+    if not settings.SCHEDULER_ENABLED:
+        return
+
+    client = get_client()
+    last_runs: Dict[str, float] = {}
+    was_leader = False
+    while True:
+        leader = _try_lead()
+        if leader and not was_leader:
+            # Another worker may have led before this one
+            last_runs.update(_load_state())
+        was_leader = leader
+
+        for job in JOBS:
+            if job.leader_only and not leader:
+                _stats[job.name]["next_run_at"] = None
+                continue
+            due_at = last_runs.get(job.name, 0) + job.interval_seconds
+            _stats[job.name]["next_run_at"] = datetime.utcfromtimestamp(int(due_at))
+            if time.time() < due_at:
+                continue
+
+            try:
+                await asyncio.to_thread(_run, client, job)
+            except Exception as e:
+                print(f"Scheduled job {job.name} error: {e}")
+            last_runs[job.name] = time.time()
+            _stats[job.name]["next_run_at"] = datetime.utcfromtimestamp(int(last_runs[job.name] + job.interval_seconds))
+            if job.leader_only:
+                _save_state({name: ran_at for name, ran_at in last_runs.items() if name in LEADER_JOBS})
+
+        await asyncio.sleep(settings.SCHEDULER_TICK_SECONDS)
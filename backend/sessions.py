@@ -0,0 +1,98 @@
+import time
+from threading import Lock
+from typing import Optional
+from fastapi import HTTPException, status
+from config import settings
+
+# Session token -> (user_id, cached_at), so polling endpoints skip the sessions lookup
+_session_cache = {}
+_session_cache_lock = Lock()
+_SESSION_CACHE_MAX_ENTRIES = 10000
+
+def get_session_user_id(client, session_token: Optional[str]) -> int:
+    """Resolve the user_id for a session token"""
+    if not session_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required"
+        )
+    
+    with _session_cache_lock:
+        cached = _session_cache.get(session_token)
+    if cached is not None and time.monotonic() - cached[1] <= settings.SESSION_CACHE_TTL_SECONDS:
+        return cached[0]
+    
+    session_result = client.query(
+        """
+        SELECT user_id
+        FROM sessions
+        WHERE token = %(token)s AND expires_at > now()
+        LIMIT 1
+        """,
+        parameters={"token": session_token}
+    )
+    
+    if not session_result.result_rows:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid session"
+        )
+    
+    user_id = session_result.result_rows[0][0]
+    with _session_cache_lock:
+        if len(_session_cache) >= _SESSION_CACHE_MAX_ENTRIES:
+            _prune_expired()
+        _session_cache[session_token] = (user_id, time.monotonic())
+    return user_id
+
+def cached_user_id(session_token: Optional[str]) -> Optional[int]:
+    """user_id of an already-verified session token, without querying (None if unknown)"""
+    if not session_token:
+        return None
+    with _session_cache_lock:
+        cached = _session_cache.get(session_token)
+    if cached is not None and time.monotonic() - cached[1] <= settings.SESSION_CACHE_TTL_SECONDS:
+        return cached[0]
+    return None
+
+def _prune_expired():
+    now = time.monotonic()
+    for token, (_, cached_at) in list(_session_cache.items()):
+        if now - cached_at > settings.SESSION_CACHE_TTL_SECONDS:
+            del _session_cache[token]
+
+def invalidate_user(user_id: int):
+    """Forget cached sessions of a user (after the user or their sessions are deleted)"""
+    with _session_cache_lock:
+        for token, (cached_user_id, _) in list(_session_cache.items()):
+            if cached_user_id == user_id:
+                del _session_cache[token]
+
+def purge_expired(client) -> str:
+    """Remove expired sessions from ClickHouse.
+    
+    On the partitioned table (migrations/partition_sessions.py) whole
+    partitions whose sessions have all expired are dropped, which is a
+    metadata operation. The legacy unpartitioned table falls back to a
+    DELETE mutation, issued only when there is something to delete.
+    """
+    partition_key = client.query(
+        "SELECT partition_key FROM system.tables WHERE database = currentDatabase() AND name = 'sessions'"
+    ).result_rows
+    if partition_key and partition_key[0][0]:
+        expired = client.query(
+            """
+            SELECT _partition_id
+            FROM sessions
+            GROUP BY _partition_id
+            HAVING max(expires_at) < now()
+            """
+        ).result_rows
+        for (partition_id,) in expired:
+            client.command("ALTER TABLE sessions DROP PARTITION ID %(id)s", parameters={"id": partition_id})
+        return f"dropped {len(expired)} partitions"
+    
+    count = client.query("SELECT count() FROM sessions WHERE expires_at < now()").result_rows[0][0]
+    if count:
+        client.command("ALTER TABLE sessions DELETE WHERE expires_at < now()")
+    return f"deleted {count} rows"
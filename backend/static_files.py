@@ -0,0 +1,202 @@
+import mimetypes
+import os
+import re
+import stat as stat_module
+from email.utils import formatdate
+from pathlib import Path
+from typing import List, Optional, Tuple
+import anyio
+from config import settings
+import http_cache
+
+# Upload names are never reused (uuid or content hash), so the bytes behind
+# a URL never change and browsers may cache them without revalidating.
+IMMUTABLE_PREFIXES = ("attachments/", "signatures/", "pdfs/", "previews/")
+
+# Content-addressed names: <md5>.<ext>, the hash doubles as the ETag
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+CHUNK_SIZE = 64 * 1024
+
+def route_path(scope) -> str:
+    """Request path below the mount point"""
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):]
+    return path
+
+def file_etag(path: Path, stat: os.stat_result) -> str:
+    """Strong ETag: the content hash for content-addressed files, else size + mtime"""
+    if CONTENT_HASH_PATTERN.match(path.stem):
+        return f'"{path.stem}"'
+    return http_cache.make_etag(path.name, stat.st_size, stat.st_mtime_ns)
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range Range header into an inclusive (start, end).
+
+    Returns None for a missing or multi-range header (served as a full 200)
+    and raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+class UploadFiles:
+    """ASGI app serving /uploads.
+
+    - strong ETags with If-None-Match / If-Range
+    - Cache-Control: private, immutable for never-reused upload names
+    - single HTTP Range requests (PDF viewers fetch pages on demand)
+    - zero-copy sendfile when the server supports the
+      http.response.zerocopysend extension, chunked reads otherwise
+    - UPLOADS_ACCEL_MODE=x-accel-redirect|x-sendfile hands the bytes to a
+      local reverse proxy after the headers are decided here
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory).resolve()
+
+    def resolve(self, path: str) -> Optional[Path]:
+        relative = path.lstrip("/")
+        if not relative:
+            return None
+        candidate = (self.directory / relative).resolve()
+        if self.directory not in candidate.parents:
+            return None
+        return candidate
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+            await self.send_status(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        path = self.resolve(route_path(scope))
+        try:
+            stat = await anyio.to_thread.run_sync(os.stat, path) if path else None
+        except OSError:
+            stat = None
+        if stat is None or not stat_module.S_ISREG(stat.st_mode):
+            await self.send_status(send, 404)
+            return
+
+        request_headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        relative = path.relative_to(self.directory).as_posix()
+        etag = file_etag(path, stat)
+        size = stat.st_size
+
+        headers = [
+            (b"etag", etag.encode("latin-1")),
+            (b"last-modified", formatdate(stat.st_mtime, usegmt=True).encode("latin-1")),
+            (b"accept-ranges", b"bytes"),
+            (b"cache-control", self.cache_control(relative).encode("latin-1")),
+        ]
+
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        content_type_header = (b"content-type", content_type.encode("latin-1"))
+
+        if http_cache.etag_matches(request_headers.get("if-none-match"), etag):
+            # Content-Type lets CompressionMiddleware match the ETag form of the 200
+            await self.send_status(send, 304, headers + [content_type_header])
+            return
+
+        headers.append(content_type_header)
+
+        if settings.UPLOADS_ACCEL_MODE:
+            # The proxy reads the file and handles Range itself
+            await self.send_status(send, 200, headers + self.accel_headers(relative))
+            return
+
+        # If-Range: only honour Range when the client's copy is still current
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            range_header = None
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            await self.send_status(send, 416, headers + [(b"content-range", f"bytes */{size}".encode("latin-1"))])
+            return
+
+        status = 200
+        start, end = 0, size - 1
+        if byte_range is not None:
+            status = 206
+            start, end = byte_range
+            headers.append((b"content-range", f"bytes {start}-{end}/{size}".encode("latin-1")))
+        length = end - start + 1 if size else 0
+
+        headers.append((b"content-length", str(length).encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+        if method == "HEAD" or length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            await self.send_zerocopy(send, path, start, length)
+        else:
+            await self.send_chunks(send, path, start, length)
+
+    def cache_control(self, relative: str) -> str:
+        # Attachments are confidential: browsers may keep them, shared proxies and CDNs may not
+        if relative.startswith(IMMUTABLE_PREFIXES):
+            return f"private, max-age={settings.IMMUTABLE_CACHE_MAX_AGE_SECONDS}, immutable"
+        return "private, no-cache"
+
+    def accel_headers(self, relative: str) -> List[Tuple[bytes, bytes]]:
+        if settings.UPLOADS_ACCEL_MODE == "x-sendfile":
+            return [(b"x-sendfile", str(self.directory / relative).encode("utf-8"))]
+        location = settings.UPLOADS_ACCEL_PREFIX.rstrip("/") + "/" + relative
+        return [(b"x-accel-redirect", location.encode("utf-8"))]
+
+    async def send_zerocopy(self, send, path: Path, start: int, length: int):
+        with open(path, "rb") as f:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f.fileno(),
+                "offset": start,
+                "count": length,
+            })
+
+    async def send_chunks(self, send, path: Path, start: int, length: int):
+        async with await anyio.open_file(path, "rb") as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; close the body
+                await send({"type": "http.response.body", "body": b""})
+
+    async def send_status(self, send, status: int, headers: Optional[list] = None):
+        await send({"type": "http.response.start", "status": status, "headers": headers or []})
+        await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,178 @@
+import re
+import time
+from threading import Lock
+from typing import Callable, Dict, Optional
+from config import settings
+import template_usage
+
+TEMPLATE_COLUMNS = """
+    id, name, content_template, subject_template, greeting, category, type,
+    entity_id, variables, is_active, is_public, usage_count, created_by,
+    updated_by, created_at, updated_at
+"""
+
+# Placeholders use the same {name} syntax as the frontend's applyTemplate
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z0-9_\u0600-\u06FF]+)\}")
+
+# In-process catalog of all templates. Other workers' writes are picked up by
+# probing a cheap version token (max(updated_at), count()) at most every
+# TEMPLATE_CATALOG_CHECK_SECONDS; writes in this worker invalidate immediately.
+_catalog: Optional[dict] = None
+_version = None
+_checked_at = 0.0
+_lock = Lock()
+
+def compile_template(text: Optional[str]) -> Callable[[Dict[str, str]], str]:
+    """Split a template once into literals and placeholder names.
+
+    The returned function renders with a single join; placeholders without
+    a value are left as-is.
+    """
+    if not text:
+        return lambda values: ""
+
+    parts = PLACEHOLDER_PATTERN.split(text)
+    literals = parts[0::2]
+    names = parts[1::2]
+
+    if not names:
+        return lambda values: text
+
+    def render(values: Dict[str, str]) -> str:
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            value = values.get(name)
+            out.append("{" + name + "}" if value is None else str(value))
+            out.append(literal)
+        return "".join(out)
+
+    return render
+
+def row_to_template(row) -> dict:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "content_template": row[2],
+        "subject_template": row[3],
+        "greeting": row[4],
+        "category": row[5],
+        "type": row[6],
+        "entity_id": row[7],
+        "variables": row[8],
+        "is_active": row[9] == 1,
+        "is_public": row[10] == 1,
+        "usage_count": row[11],
+        "created_by": row[12],
+        "updated_by": row[13],
+        "created_at": row[14],
+        "updated_at": row[15]
+    }
+
+def _probe_version(client):
+    result = client.query(
+        """
+        SELECT max(updated_at), count()
+        FROM correspondence_templates
+        """
+    )
+    return tuple(result.result_rows[0]) if result.result_rows else None
+
+def _load(client) -> dict:
+    result = client.query(
+        f"""
+        SELECT {TEMPLATE_COLUMNS}
+        FROM correspondence_templates
+        ORDER BY usage_count DESC, created_at DESC
+        """
+    )
+
+    templates = {}
+    renderers = {}
+    for row in result.result_rows:
+        template = row_to_template(row)
+        templates[template["id"]] = template
+        renderers[template["id"]] = (
+            compile_template(template["subject_template"]),
+            compile_template(template["content_template"])
+        )
+
+    return {"templates": templates, "renderers": renderers}
+
+def get_catalog(client) -> dict:
+    """Return the catalog, reloading it if another worker changed templates"""
+    global _catalog, _version, _checked_at
+    with _lock:
+        if _catalog is not None and time.monotonic() - _checked_at <= settings.TEMPLATE_CATALOG_CHECK_SECONDS:
+            return _catalog
+
+    version = _probe_version(client)
+    with _lock:
+        if _catalog is not None and version == _version:
+            _checked_at = time.monotonic()
+            return _catalog
+
+    catalog = _load(client)
+    with _lock:
+        _catalog = catalog
+        _version = version
+        _checked_at = time.monotonic()
+    return catalog
+
+def invalidate():
+    """Drop the catalog after a template is created or changed in this worker"""
+    global _catalog
+    with _lock:
+        _catalog = None
+
+def with_usage(template: dict, totals: Dict[str, int]) -> dict:
+    """Copy of a catalog entry with tracked uses added to the stored usage_count"""
+    uses = totals.get(template["id"])
+    if not uses:
+        return template
+    return {**template, "usage_count": (template["usage_count"] or 0) + uses}
+
+def list_templates(client, category: Optional[str] = None, type: Optional[str] = None) -> list:
+    """Active templates, most used first"""
+    totals = template_usage.get_totals(client)
+    templates = [
+        with_usage(template, totals) for template in get_catalog(client)["templates"].values()
+        if template["is_active"]
+        and (not category or template["category"] == category)
+        and (not type or template["type"] == type)
+    ]
+    # The catalog is loaded in (usage_count, created_at) order; a stable sort on
+    # the merged count keeps created_at DESC among equal counts
+    templates.sort(key=lambda template: template["usage_count"] or 0, reverse=True)
+    return templates
+
+def get_template(client, template_id: str) -> Optional[dict]:
+    template = get_catalog(client)["templates"].get(template_id)
+    if template is None:
+        return None
+    return with_usage(template, template_usage.get_totals(client))
+
+def render(client, template_id: str, values: Dict[str, str]) -> Optional[dict]:
+    """Render a template's greeting, subject and content with precompiled renderers"""
+    catalog = get_catalog(client)
+    template = catalog["templates"].get(template_id)
+    if template is None:
+        return None
+    render_subject, render_content = catalog["renderers"][template_id]
+    return {
+        "greeting": template["greeting"],
+        "subject": render_subject(values),
+        "content": render_content(values)
+    }
+
+def render_many(client, template_id: str, items: list) -> Optional[list]:
+    """Render one template for many value sets (bulk letter generation)"""
+    catalog = get_catalog(client)
+    template = catalog["templates"].get(template_id)
+    if template is None:
+        return None
+    render_subject, render_content = catalog["renderers"][template_id]
+    greeting = template["greeting"]
+    return [
+        {"greeting": greeting, "subject": render_subject(values), "content": render_content(values)}
+        for values in items
+    ]
@@ -0,0 +1,94 @@
+import asyncio
+from collections import Counter
+from threading import Lock
+from typing import Dict, Optional
+from database import get_client
+from config import settings
+from ttl_cache import TTLCache
+
+# Uses recorded in this worker and not yet written. Increments are flushed
+# as one INSERT every TEMPLATE_USAGE_FLUSH_SECONDS (or sooner when the buffer
+# grows past TEMPLATE_USAGE_BUFFER_SIZE templates).
+_pending: Counter = Counter()
+_lock = Lock()
+_flush_requested: Optional[asyncio.Event] = None
+
+# Summed usage per template as stored in template_usage
+_totals_cache = TTLCache(settings.TEMPLATE_USAGE_CACHE_TTL_SECONDS)
+TOTALS_CACHE_KEY = "totals"
+
+def record(template_id: str, uses: int = 1):
+    """Count uses of a template; the write happens in the background flusher"""
+    if uses <= 0:
+        return
+    with _lock:
+        _pending[template_id] += uses
+        full = len(_pending) >= settings.TEMPLATE_USAGE_BUFFER_SIZE
+    if full and _flush_requested is not None:
+        _flush_requested.set()
+
+def _take_pending() -> Dict[str, int]:
+    global _pending
+    with _lock:
+        pending, _pending = _pending, Counter()
+    return pending
+
+def flush(client) -> int:
+    """Write buffered increments; on failure they are put back for the next flush"""
+    pending = _take_pending()
+    if not pending:
+        return 0
+
+    try:
+        client.insert(
+            "template_usage",
+            [[template_id, uses] for template_id, uses in pending.items()],
+            column_names=["template_id", "uses"]
+        )
+    except Exception:
+        with _lock:
+            _pending.update(pending)
+        raise
+
+    # Re-read totals so the flushed uses don't vanish until the cache expires
+    _totals_cache.invalidate(TOTALS_CACHE_KEY)
+    return len(pending)
+
+def get_totals(client) -> Dict[str, int]:
+    """Usage per template from template_usage plus this worker's unflushed uses"""
+    totals = _totals_cache.get(TOTALS_CACHE_KEY)
+    if totals is None:
+        result = client.query(
+            """
+            SELECT template_id, sum(uses)
+            FROM template_usage
+            GROUP BY template_id
+            """
+        )
+        totals = {row[0]: row[1] for row in result.result_rows}
+        _totals_cache.set(TOTALS_CACHE_KEY, totals)
+
+    with _lock:
+        if not _pending:
+            return totals
+        merged = dict(totals)
+        for template_id, uses in _pending.items():
+            merged[template_id] = merged.get(template_id, 0) + uses
+    return merged
+
+async def run_flusher():
+    """Background loop writing buffered usage increments"""
+    global _flush_requested
+    _flush_requested = asyncio.Event()
+    client = get_client()
+    while True:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), timeout=settings.TEMPLATE_USAGE_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+
+        try:
+            await asyncio.to_thread(flush, client)
+        except Exception as e:
+            print(f"Template usage flush error: {e}")
@@ -0,0 +1,22 @@
+import re
+
+# Arabic letter variants folded for search: alef forms -> ا, alef maqsura -> ي,
+# taa marbuta -> ه. Diacritics (harakat) and tatweel are dropped.
+FOLD_FROM = "أإآٱىة"
+FOLD_TO = "اااايه"
+_FOLD_TABLE = str.maketrans(FOLD_FROM, FOLD_TO)
+_STRIP_PATTERN = re.compile("[\u064B-\u0652\u0640]")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+def normalize(text: str) -> str:
+    """Normalize text for search the same way normalized_sql() does in ClickHouse"""
+    text = _STRIP_PATTERN.sub("", (text or "").translate(_FOLD_TABLE))
+    return _SPACE_PATTERN.sub(" ", text).strip().lower()
+
+def normalized_sql(column: str) -> str:
+    """ClickHouse expression normalizing a String column like normalize()"""
+    return (
+        "lowerUTF8(trimBoth(replaceRegexpAll(replaceRegexpAll("
+        f"translateUTF8(ifNull({column}, ''), '{FOLD_FROM}', '{FOLD_TO}'), "
+        "'[\\\\x{064B}-\\\\x{0652}\\\\x{0640}]', ''), '\\\\s+', ' ')))"
+    )
@@ -0,0 +1,64 @@
+import time
+from threading import Lock
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+class TTLCache:
+    """Small thread-safe in-process cache with per-entry expiry"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, tuple] = {}
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """Fresh entries for the given keys; missing or expired keys are omitted"""
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[1] <= self.ttl_seconds:
+                    found[key] = entry[0]
+        return found
+
+    def set(self, key: Hashable, value: Any):
+        self.set_many({key: value})
+
+    def set_many(self, values: Dict[Hashable, Any]):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) + len(values) > self.max_entries:
+                self._evict(now)
+            for key, value in values.items():
+                self._entries[key] = (value, now)
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, now: float):
+        # Drop expired entries first, then the oldest if still over the limit
+        for key, (_, stored_at) in list(self._entries.items()):
+            if now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+        overflow = len(self._entries) - self.max_entries // 2
+        if overflow > 0:
+            oldest = sorted(self._entries.items(), key=lambda item: item[1][1])[:overflow]
+            for key, _ in oldest:
+                del self._entries[key]
@@ -0,0 +1,137 @@
+import time
+from threading import Lock
+from typing import Dict, Tuple
+from config import settings
+import notification_hub
+
+# user_id -> (unread count, loaded_at). Counts are kept current by deltas
+# from this worker; entries older than UNREAD_COUNTER_TTL_SECONDS are
+# reloaded from the SummingMergeTree to pick up other workers' deltas.
+# Workers only read the persisted sum: drift against the base tables is
+# corrected by reconcile_all alone, so no correction is applied twice.
+_counters: Dict[int, Tuple[int, float]] = {}
+_lock = Lock()
+
+# Drift must be seen this far apart before it is corrected
+RECONCILE_CONFIRM_SECONDS = 5
+
+def _persisted(client, user_id: int) -> int:
+    """Sum of persisted deltas for a user"""
+    result = client.query(
+        """
+        SELECT sum(delta)
+        FROM notification_unread_counters
+        WHERE user_id = %(user_id)s
+        """,
+        parameters={"user_id": user_id}
+    )
+    return int(result.result_rows[0][0] or 0) if result.result_rows else 0
+
+def get(client, user_id: int) -> int:
+    """Current unread count for a user (in-memory, reloaded when stale)"""
+    with _lock:
+        entry = _counters.get(user_id)
+    if entry is not None and time.monotonic() - entry[1] <= settings.UNREAD_COUNTER_TTL_SECONDS:
+        return entry[0]
+
+    count = max(_persisted(client, user_id), 0)
+
+    with _lock:
+        _counters[user_id] = (count, time.monotonic())
+    return count
+
+def apply_deltas(client, deltas: Dict[int, int]):
+    """Apply +N/-N changes for many users with a single persisted INSERT"""
+    rows = [[user_id, delta] for user_id, delta in deltas.items() if delta]
+    if not rows:
+        return
+
+    client.insert("notification_unread_counters", rows, column_names=["user_id", "delta"])
+
+    updated = {}
+    with _lock:
+        for user_id, delta in rows:
+            entry = _counters.get(user_id)
+            if entry is not None:
+                _counters[user_id] = (max(entry[0] + delta, 0), entry[1])
+                updated[user_id] = _counters[user_id][0]
+
+    for user_id, count in updated.items():
+        notification_hub.publish_unread_count(user_id, count)
+
+def reset(client, user_id: int):
+    """Set a user's counter to zero (mark-all-read)"""
+    # Cancel the persisted sum rather than a cached count that may be stale
+    persisted = _persisted(client, user_id)
+    with _lock:
+        _counters[user_id] = (max(persisted, 0), time.monotonic())
+    apply_deltas(client, {user_id: -persisted})
+
+def _write_corrections(client, corrections: Dict[int, int]):
+    if corrections:
+        client.insert(
+            "notification_unread_counters",
+            [[user_id, delta] for user_id, delta in corrections.items()],
+            column_names=["user_id", "delta"]
+        )
+
+def _drift(client) -> Dict[int, int]:
+    """Base-table unread count minus sum(delta), for every user that differs"""
+    result = client.query(
+        f"""
+        SELECT user_id, actual.unread - persisted.total
+        FROM (
+            SELECT n.user_id AS user_id,
+                   countIf(NOT if(m.notification_id != '' AND m.marker_at >= w.read_until,
+                                  m.marker_read,
+                                  n.read = 1 OR n.created_at <= w.read_until)) AS unread
+            FROM notifications AS n
+            LEFT JOIN (
+                SELECT user_id, notification_id, argMax(read, version) AS marker_read, max(read_at) AS marker_at
+                FROM notification_reads
+                WHERE notification_id != ''
+                GROUP BY user_id, notification_id
+            ) AS m ON m.user_id = n.user_id AND m.notification_id = n.id
+            LEFT JOIN (
+                SELECT user_id, max(read_until) AS read_until
+                FROM notification_reads
+                WHERE notification_id = ''
+                GROUP BY user_id
+            ) AS w ON w.user_id = n.user_id
+            WHERE n.created_at >= now() - INTERVAL {settings.NOTIFICATION_RETENTION_DAYS} DAY
+            GROUP BY n.user_id
+        ) AS actual
+        FULL OUTER JOIN (
+            SELECT user_id, sum(delta) AS total
+            FROM notification_unread_counters
+            GROUP BY user_id
+        ) AS persisted USING (user_id)
+        WHERE actual.unread != persisted.total
+        """
+    )
+    return {row[0]: row[1] for row in result.result_rows if row[1]}
+
+def reconcile_all(client) -> int:
+    """Correct the persisted counters of every user (the scheduler leader's job).
+
+    A mark-read writes its marker and its delta separately, so drift is
+    measured twice RECONCILE_CONFIRM_SECONDS apart and only drift seen both
+    times is corrected. Writes landing after the second measurement change
+    both sides alike and leave the relative correction valid.
+    """
+    first = _drift(client)
+    if not first:
+        return 0
+    time.sleep(RECONCILE_CONFIRM_SECONDS)
+    corrections = {
+        user_id: delta
+        for user_id, delta in _drift(client).items()
+        if first.get(user_id) == delta
+    }
+    _write_corrections(client, corrections)
+
+    # Cached counts of this worker may be among the drifted ones
+    with _lock:
+        for user_id in corrections:
+            _counters.pop(user_id, None)
+    return len(corrections)
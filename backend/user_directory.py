@@ -0,0 +1,81 @@
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+from database import get_client
+from config import settings
+
+# Snapshot of users grouped by entity, refreshed every USER_DIRECTORY_TTL_SECONDS.
+# Used to resolve notification recipients without querying users per event.
+_directory: Optional[dict] = None
+_loaded_at = 0.0
+_lock = Lock()
+
+# Role per user (users without a user_roles row are plain 'user'), so listings
+# don't need to join user_roles. A user with several roles gets the highest one
+# (admin, then moderator), never an arbitrary one
+_roles: Optional[Dict[int, str]] = None
+_roles_loaded_at = 0.0
+
+def _load(client) -> dict:
+    result = client.query(
+        """
+        SELECT id, entity_id, entity_name
+        FROM users
+        """
+    )
+
+    by_entity_id: Dict[str, List[int]] = {}
+    by_entity_name: Dict[str, List[int]] = {}
+    user_ids = set()
+    for user_id, entity_id, entity_name in result.result_rows:
+        user_ids.add(user_id)
+        if entity_id:
+            by_entity_id.setdefault(entity_id, []).append(user_id)
+        if entity_name:
+            by_entity_name.setdefault(entity_name, []).append(user_id)
+
+    return {
+        "by_entity_id": by_entity_id,
+        "by_entity_name": by_entity_name,
+        "user_ids": user_ids
+    }
+
+def get_directory(client=None) -> dict:
+    """Return the cached directory, reloading it when stale"""
+    global _directory, _loaded_at
+    with _lock:
+        if _directory is not None and time.monotonic() - _loaded_at <= settings.USER_DIRECTORY_TTL_SECONDS:
+            return _directory
+
+    directory = _load(client or get_client())
+    with _lock:
+        _directory = directory
+        _loaded_at = time.monotonic()
+    return directory
+
+def get_roles(client=None) -> Dict[int, str]:
+    """Return the cached user_id -> role map, reloading it when stale"""
+    global _roles, _roles_loaded_at
+    with _lock:
+        if _roles is not None and time.monotonic() - _roles_loaded_at <= settings.USER_DIRECTORY_TTL_SECONDS:
+            return _roles
+
+    result = (client or get_client()).query(
+        """
+        SELECT user_id, argMax(role, (multiIf(role = 'admin', 2, role = 'moderator', 1, 0), role))
+        FROM user_roles
+        GROUP BY user_id
+        """
+    )
+    roles = {user_id: role for user_id, role in result.result_rows}
+    with _lock:
+        _roles = roles
+        _roles_loaded_at = time.monotonic()
+    return roles
+
+def invalidate():
+    """Drop the snapshots after users are created, moved or deleted"""
+    global _directory, _roles
+    with _lock:
+        _directory = None
+        _roles = None
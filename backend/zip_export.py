@@ -0,0 +1,160 @@
+import io
+import json
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+from config import settings
+
+# Formats that are already compressed; deflating them again only costs CPU
+STORED_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png", ".docx", ".xlsx", ".zip"}
+
+EXPORT_COLUMNS = """
+    id, number, type, subject, content, from_entity, from_entity_id,
+    received_by_entity, received_by_entity_id, date, received_at, received_by,
+    created_by, created_at, updated_at, archived, display_type, greeting,
+    responsible_person, signature_url, pdf_url, notes, attachments,
+    external_connection_id, external_doc_id, status
+"""
+
+class _Sink(io.RawIOBase):
+    """Write-only buffer drained after every chunk.
+
+    It has no tell()/seek(), so zipfile writes data descriptors after each
+    entry instead of seeking back, which is what makes streaming possible.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def local_path(url: Optional[str]) -> Optional[Path]:
+    """File under uploads/ for an /uploads/... URL (absolute or relative)"""
+    if not url or "/uploads/" not in url:
+        return None
+    relative = url.split("/uploads/", 1)[1]
+    root = Path("uploads").resolve()
+    path = (root / relative).resolve()
+    if root not in path.parents or not path.is_file():
+        return None
+    return path
+
+def safe_name(value: str) -> str:
+    cleaned = "".join(ch if ch.isalnum() or ch in "-_." else "-" for ch in (value or ""))
+    return cleaned.strip("-.") or "file"
+
+def _fetch_batch(client, date_from: datetime, date_to: datetime, after: Optional[tuple]) -> list:
+    query = f"""
+        SELECT {EXPORT_COLUMNS}
+        FROM correspondences
+        WHERE date >= %(date_from)s AND date < %(date_to)s
+    """
+    params = {"date_from": date_from, "date_to": date_to, "limit": settings.EXPORT_BATCH_SIZE}
+    if after:
+        query += " AND (date, id) > (%(after_date)s, %(after_id)s)"
+        params["after_date"], params["after_id"] = after
+    query += " ORDER BY date, id LIMIT %(limit)s"
+
+    result = client.query(query, parameters=params)
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+def _attachment_names(client, batch: list) -> dict:
+    """Original file names for every attachment URL in a batch, in one query"""
+    paths = {
+        f"uploads/{url.split('/uploads/', 1)[1]}"
+        for row in batch for url in (row["attachments"] or []) if "/uploads/" in url
+    }
+    if not paths:
+        return {}
+    result = client.query(
+        """
+        SELECT file_path, any(file_name)
+        FROM attachments
+        WHERE file_path IN %(paths)s
+        GROUP BY file_path
+        """,
+        parameters={"paths": list(paths)}
+    )
+    return {Path(file_path).name: file_name for file_path, file_name in result.result_rows}
+
+def _write_file(archive: zipfile.ZipFile, sink: _Sink, name: str, path: Path) -> Iterator[bytes]:
+    compress_type = zipfile.ZIP_STORED if path.suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    info = zipfile.ZipInfo(name, date_time=datetime.fromtimestamp(path.stat().st_mtime).timetuple()[:6])
+    info.compress_type = compress_type
+    with open(path, "rb") as source, archive.open(info, "w", force_zip64=True) as entry:
+        while True:
+            chunk = source.read(settings.EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            entry.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+def stream_export(client, date_from: datetime, date_to: datetime) -> Iterator[bytes]:
+    """Yield a ZIP of all correspondences dated in [date_from, date_to).
+
+    Each correspondence gets a folder with correspondence.json, its PDF (when
+    one was generated) and its attachment files. Rows are read in keyset
+    batches and files in EXPORT_CHUNK_SIZE chunks, so memory stays flat no
+    matter how large the archive grows. The manifest lists at most
+    EXPORT_MAX_MISSING_LISTED missing files.
+    """
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+    manifest = {
+        "date_from": date_from, "date_to": date_to, "correspondences": 0, "files": 0,
+        "missing_files_count": 0, "missing_files": [],
+    }
+
+    after = None
+    while True:
+        batch = _fetch_batch(client, date_from, date_to, after)
+        if not batch:
+            break
+        after = (batch[-1]["date"], batch[-1]["id"])
+        original_names = _attachment_names(client, batch)
+
+        for row in batch:
+            folder = f"{row['date']:%Y-%m-%d}_{safe_name(row['number'])}_{row['id']}"
+            archive.writestr(f"{folder}/correspondence.json", json.dumps(row, ensure_ascii=False, default=str, indent=2))
+            yield sink.drain()
+            manifest["correspondences"] += 1
+
+            files = []
+            if row["pdf_url"]:
+                files.append((row["pdf_url"], "correspondence.pdf"))
+            used_names = set()
+            for url in row["attachments"] or []:
+                basename = url.rsplit("/", 1)[-1]
+                name = safe_name(original_names.get(basename, basename))
+                if name in used_names:
+                    name = f"{Path(basename).stem}_{name}"
+                used_names.add(name)
+                files.append((url, f"attachments/{name}"))
+
+            for url, name in files:
+                path = local_path(url)
+                if path is None:
+                    manifest["missing_files_count"] += 1
+                    if len(manifest["missing_files"]) < settings.EXPORT_MAX_MISSING_LISTED:
+                        manifest["missing_files"].append(url)
+                    continue
+                yield from _write_file(archive, sink, f"{folder}/{name}", path)
+                manifest["files"] += 1
+
+    archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, default=str, indent=2))
+    archive.close()
+    yield sink.drain()
@@ -40,10 +40,13 @@ export const clickhouseApi = {
     }),
 
   // Users
-  listUsers: (sessionToken: string) =>
+  listUsers: (
+    sessionToken: string,
+    options: { limit?: number; cursor?: string; search?: string; entityId?: string; role?: 'admin' | 'moderator' | 'user' } = {}
+  ) =>
     apiRequest('/users/list', {
       method: 'POST',
-      body: JSON.stringify({ sessionToken }),
+      body: JSON.stringify({ sessionToken, ...options }),
     }),
 
   updateUser: (userId: number, data: any) =>
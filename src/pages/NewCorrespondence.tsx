@@ -103,9 +103,10 @@ const [isLocked, setIsLocked] = useState(false);
           
           if (response.ok) {
             const userDetails = await response.json();
-            if (userDetails.signature_base64) {
-              setUserSignature(userDetails.signature_base64);
-              setSignaturePreview(userDetails.signature_base64);
+            if (userDetails.signature_url) {
+              const signatureUrl = `${import.meta.env.VITE_API_URL || 'http://192.168.203.134:3001'}${userDetails.signature_url}`;
+              setUserSignature(signatureUrl);
+              setSignaturePreview(signatureUrl);
             }
             if (userDetails.job_title) {
               setUserJobTitle(userDetails.job_title);
@@ -294,7 +295,12 @@ const [isLocked, setIsLocked] = useState(false);
             });
             
             if (response.ok) {
-              setUserSignature(base64);
+              const saved = await response.json();
+              const signatureUrl = saved.signature_url
+                ? `${import.meta.env.VITE_API_URL || 'http://192.168.203.134:3001'}${saved.signature_url}`
+                : base64;
+              setUserSignature(signatureUrl);
+              setSignaturePreview(signatureUrl);
               toast({
                 title: "تم الحفظ",
                 description: "تم حفظ التوقيع بنجاح",
@@ -21,6 +21,9 @@ interface User {
   role: string;
 }
 
+// Users are listed one server page at a time
+const USERS_PAGE_SIZE = 50;
+
 interface Entity {
   id: string;
   name: string;
@@ -31,6 +34,10 @@ export default function UsersManagement() {
   const { isAdmin, isModerator, loading: roleLoading } = useUserRole();
   const { toast } = useToast();
   const [users, setUsers] = useState<User[]>([]);
+  const [userSearchQuery, setUserSearchQuery] = useState('');
+  // Cursor of every page visited so far; the last one is the page shown
+  const [userPageCursors, setUserPageCursors] = useState<(string | undefined)[]>([undefined]);
+  const [nextUserCursor, setNextUserCursor] = useState<string | null>(null);
   const [entities, setEntities] = useState<Entity[]>([]);
   const [loading, setLoading] = useState(false);
   const [newEntityName, setNewEntityName] = useState('');
@@ -61,14 +68,26 @@ export default function UsersManagement() {
 
   useEffect(() => {
     if (isAdmin || isModerator) {
-      if (isAdmin) {
-        fetchUsers();
-      }
       fetchEntities();
     }
   }, [isAdmin, isModerator]);
 
-  const fetchUsers = async () => {
+  // Searching happens on the server; start again from the first page
+  useEffect(() => {
+    if (!isAdmin) {
+      return;
+    }
+    const timer = setTimeout(() => {
+      setUserPageCursors([undefined]);
+      fetchUsers(undefined, userSearchQuery);
+    }, userSearchQuery ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [isAdmin, userSearchQuery]);
+
+  const fetchUsers = async (
+    cursor: string | undefined = userPageCursors[userPageCursors.length - 1],
+    search: string = userSearchQuery
+  ) => {
     try {
       console.log('[UsersManagement] Fetching users...');
       const sessionToken = localStorage.getItem('session_token');
@@ -82,11 +101,16 @@ export default function UsersManagement() {
         return;
       }
 
-      const data = await clickhouseApi.listUsers(sessionToken);
-
+      const data = await clickhouseApi.listUsers(sessionToken, {
+        limit: USERS_PAGE_SIZE,
+        cursor,
+        search: search.trim() || undefined,
+      });
       const usersList = (data?.users || []) as User[];
+
       console.log('[UsersManagement] Users fetch result:', { count: usersList.length });
       setUsers(usersList);
+      setNextUserCursor(data?.next_cursor || null);
     } catch (error) {
       console.error('Error fetching users:', error);
       toast({
@@ -97,6 +121,23 @@ export default function UsersManagement() {
     }
   };
 
+  const handleNextUsersPage = () => {
+    if (!nextUserCursor) {
+      return;
+    }
+    setUserPageCursors([...userPageCursors, nextUserCursor]);
+    fetchUsers(nextUserCursor);
+  };
+
+  const handlePreviousUsersPage = () => {
+    if (userPageCursors.length <= 1) {
+      return;
+    }
+    const cursors = userPageCursors.slice(0, -1);
+    setUserPageCursors(cursors);
+    fetchUsers(cursors[cursors.length - 1]);
+  };
+
   const fetchEntities = async () => {
     try {
       console.log('[UsersManagement] Fetching entities...');
@@ -497,13 +538,21 @@ export default function UsersManagement() {
             <Card>
               <CardHeader>
                 <CardTitle>
-                  المستخدمين ({users.length})
+                  المستخدمين
                 </CardTitle>
               </CardHeader>
               <CardContent>
+                <div className="mb-4">
+                  <Input
+                    placeholder="ابحث عن مستخدم..."
+                    value={userSearchQuery}
+                    onChange={(e) => setUserSearchQuery(e.target.value)}
+                    className="w-full"
+                  />
+                </div>
                 {users.length === 0 ? (
                   <div className="text-center py-8 text-muted-foreground">
-                    لا توجد مستخدمين بعد
+                    {userSearchQuery ? 'لا توجد نتائج' : 'لا توجد مستخدمين بعد'}
                   </div>
                 ) : (
                   <div className="space-y-2 max-h-[600px] overflow-y-auto">
@@ -545,6 +594,25 @@ export default function UsersManagement() {
                     ))}
                   </div>
                 )}
+                <div className="flex justify-between items-center mt-4">
+                  <Button
+                    variant="outline"
+                    size="sm"
+                    onClick={handlePreviousUsersPage}
+                    disabled={userPageCursors.length <= 1}
+                  >
+                    السابق
+                  </Button>
+                  <span className="text-sm text-muted-foreground">صفحة {userPageCursors.length}</span>
+                  <Button
+                    variant="outline"
+                    size="sm"
+                    onClick={handleNextUsersPage}
+                    disabled={!nextUserCursor}
+                  >
+                    التالي
+                  </Button>
+                </div>
               </CardContent>
             </Card>
           </div>